@@ -0,0 +1,292 @@
+"""
+ModTerm - Modbus analyser for the terminal
+
+Copyright (C) 2023  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Optional, Union
+from modterm.components.definitions import ModbusConfig, ReadConfig, WriteConfig, UnitSweepConfig, IpSweepConfig, \
+    RegisterPoint, TCP, RTU, HOLDING, INPUT, COIL, DISCRETE, HOLDING_WRITE, COIL_WRITE, MAX_BLOCK_SIZES, BigEndian, \
+    LittleEndian, formats
+from modterm.components.connection_pool import ConnectionPool, connection_pool
+from modterm.components.device_capabilities import device_profiles
+from modterm.components.modbus_handler import ModbusHandler, UnitSweepResult
+from modterm.components.register_snapshot import RegisterSnapshot
+from modterm.components.poll_scheduler import PollScheduler, PollJob, JobStats
+from modterm.components.ip_sweep import run_sweep, iterate_targets, validate_targets, SweepResult
+from modterm.components.register_map import load_register_map, plan_reads, PlannedRead, RegisterMapError
+from modterm.components.decoders import decode_value, decode_values, encode_value
+from modterm.components.bulk_write import WriteEntry, WriteResult, RestorePlan, load_write_entries, plan_writes, \
+    load_register_dump, snapshot_entries
+
+logger = logging.getLogger("ModTerm")
+
+
+class SessionError(Exception):
+    pass
+
+
+class ModbusSession:
+    # ModTerm's Modbus operations for other programs: results are register snapshots, values and dataclasses,
+    # nothing is formatted for display and nothing needs a terminal. Failures raise SessionError. A session runs
+    # one operation at a time, cancel() interrupts it from another thread.
+    # What the operations learn about the devices is kept in memory and only written to the capability file by
+    # save_capabilities(), unless the session is made with save_capabilities=True.
+    def __init__(self, modbus_config: ModbusConfig, pool: ConnectionPool = connection_pool,
+                 save_capabilities: bool = False):
+        self.modbus_config = modbus_config
+        self.last_failure: Optional[str] = None
+        self.modbus_handler = ModbusHandler(self.on_status, pool=pool)
+        self.modbus_handler.save_profiles = save_capabilities
+
+    @classmethod
+    def tcp(cls, host: str, port: int = 502, **kwargs) -> "ModbusSession":
+        return cls(ModbusConfig(mode=TCP, ip=host, port=port), **kwargs)
+
+    @classmethod
+    def serial(cls, interface: str, baud_rate: int = 9600, parity: str = "N", bytesize: int = 8, stopbits: int = 1,
+               **kwargs) -> "ModbusSession":
+        return cls(ModbusConfig(mode=RTU, interface=interface, baud_rate=baud_rate, parity=parity,
+                                bytesize=bytesize, stopbits=stopbits), **kwargs)
+
+    def on_status(self, text, failed=False, highlighted=False):
+        if failed:
+            self.last_failure = text
+            logger.warning(text)
+        else:
+            logger.debug(text)
+
+    def start(self):
+        self.last_failure = None
+        self.modbus_handler.cancel_event.clear()
+
+    def fail(self, default: str):
+        raise SessionError(self.last_failure or default)
+
+    def cancel(self):
+        self.modbus_handler.cancel()
+
+    def cancelled(self) -> bool:
+        return self.modbus_handler.cancelled()
+
+    def read(self, command: str = HOLDING, start: int = 0, number: int = 1, unit: int = 1,
+             block_size: Optional[int] = None, pipeline_depth: int = 1, adaptive_split: bool = True,
+             use_capabilities: bool = True) -> RegisterSnapshot:
+        # Reads the range in blocks, as the UI does. Registers (or bits) that could not be read are not valid in
+        # the snapshot, an interrupted read returns the registers up to the first block missing.
+        self.start()
+        read_config = ReadConfig(command=command, start=start, number=number, unit=unit,
+                                 block_size=block_size or MAX_BLOCK_SIZES[command], pipeline_depth=pipeline_depth,
+                                 adaptive_split=adaptive_split, use_capabilities=use_capabilities)
+        if (snapshot := self.modbus_handler.read_snapshot(self.modbus_config, read_config)) is None:
+            self.fail("Read failed")
+        return snapshot
+
+    def read_points(self, points: Union[List[RegisterPoint], str], unit: int = 1) -> Dict[str, Optional[
+            Union[int, float, bool]]]:
+        # The values of register map points, or of the points of a map file, by name. Points without a byte or
+        # word order of their own are decoded in the orders of the session's Modbus config.
+        self.start()
+        if isinstance(points, str):
+            try:
+                points = load_register_map(points)
+            except RegisterMapError as e:
+                raise SessionError(str(e))
+        if (values := self.modbus_handler.read_points(self.modbus_config, points, unit)) is None:
+            self.fail("Interrupted" if self.cancelled() else "Read failed")
+        return {point.name: value for point, value in zip(points, values)}
+
+    def write(self, address: int, value: Union[int, float], value_format: str = "UINT16", unit: int = 1,
+              multicast: bool = False, verify: bool = False):
+        # Encodes the value as one of the formats (UINT16, INT16, UINT32, INT32, FLOAT32) and writes it. Verified
+        # writes are read back, a value the device didn't take raises SessionError too.
+        self.start()
+        write_config = WriteConfig(command=HOLDING_WRITE, address=address, unit=unit, format=value_format,
+                                   multicast=multicast, value=value, verify=verify)
+        self.check_write(self.modbus_handler.write_registers(self.modbus_config, write_config, formats))
+
+    def write_coil(self, address: int, value: bool, unit: int = 1, multicast: bool = False, verify: bool = False):
+        self.start()
+        write_config = WriteConfig(command=COIL_WRITE, address=address, unit=unit, multicast=multicast,
+                                   value=int(value), verify=verify)
+        self.check_write(self.modbus_handler.write_registers(self.modbus_config, write_config, formats))
+
+    def check_write(self, result: Optional[WriteResult]):
+        # The result decides, a failure the handler didn't report as one doesn't pass for a success
+        if result is None:
+            self.fail("Write failed")
+        if not result.success:
+            raise SessionError(result.message)
+
+    def write_many(self, entries: Union[List[WriteEntry], str, RegisterSnapshot], unit: int = 1,
+                   verify: bool = False) -> List[WriteResult]:
+        # Writes the entries, the entries of a value file, or the holding registers or coils of a snapshot, with as
+        # few requests as it can: neighbouring values go in the same FC16 (registers) or FC15 (coils) request.
+        # Every request gets a result, a failed one doesn't stop the rest unless the connection is lost. Verified
+        # requests are read back, the results list the addresses that didn't take the value.
+        self.start()
+        try:
+            if isinstance(entries, str):
+                entries = load_write_entries(entries)
+            elif isinstance(entries, RegisterSnapshot):
+                entries = snapshot_entries(entries)
+            read_write = verify and device_profiles.get(self.modbus_config, unit).read_write is not False
+            writes = plan_writes(entries, self.modbus_config.byte_order, self.modbus_config.word_order, read_write)
+        except RegisterMapError as e:
+            raise SessionError(str(e))
+        if (results := self.modbus_handler.write_many(self.modbus_config, writes, unit, verify=verify)) is None:
+            self.fail("Write failed")
+        return results
+
+    def restore(self, snapshot: Union[RegisterSnapshot, str], unit: int = 1, dry_run: bool = False) -> RestorePlan:
+        # Writes back the holding registers of a snapshot, or of the output of the read command saved in a file,
+        # that differ on the device now. Every request is read back, the results say which registers didn't
+        # take the value. A dry run returns the plan without writing.
+        self.start()
+        if isinstance(snapshot, str):
+            try:
+                snapshot = load_register_dump(snapshot)
+            except RegisterMapError as e:
+                raise SessionError(str(e))
+        if (plan := self.modbus_handler.restore_registers(self.modbus_config, snapshot, unit, dry_run)) is None:
+            self.fail("Interrupted" if self.cancelled() else "Restore failed")
+        return plan
+
+    def sweep_units(self, first: int = 1, last: int = 255, command: str = HOLDING, start: int = 0, number: int = 1,
+                    timeout: float = 0.2) -> List[UnitSweepResult]:
+        # Every unit of the range with whether it answered the read, and how
+        self.start()
+        results = []
+        sweep_config = UnitSweepConfig(start_unit=first, last_unit=last, command=command, start_register=start,
+                                       number_of_registers=number, timeout=timeout)
+        if not self.modbus_handler.sweep_units(self.modbus_config, sweep_config, results.append):
+            self.fail("Sweep failed")
+        return results
+
+    def ip_sweep(self, targets: str, port: int = 502, command: str = HOLDING, start: int = 0, number: int = 1,
+                 unit: int = 1, timeout: float = 0.2, concurrency: int = 64) -> List[SweepResult]:
+        # Every target with whether it accepted a TCP connection and answered the read, in the order they
+        # answered. The targets have nothing to do with the Modbus config of the session.
+        if (error := validate_targets(targets)) is not None:
+            raise SessionError(error)
+        self.start()
+        results = []
+        sweep_config = IpSweepConfig(targets=targets, port=port, command=command, start_register=start,
+                                     number_of_registers=number, unit_id=unit, timeout=timeout,
+                                     concurrency=concurrency, responders_only=False)
+        try:
+            run_sweep(iterate_targets(targets), sweep_config, results.append, self.cancelled)
+        except (ValueError, OSError) as e:
+            raise SessionError(f"Sweep failed: {e}")
+        return results
+
+    def poll_job(self, command: str = HOLDING, start: int = 0, number: int = 1, period: float = 1.0, unit: int = 1,
+                 name: str = "", callback: Optional[callable] = None) -> PollJob:
+        # A job reading the range from the device of the session every period seconds, to be added to a
+        # PollScheduler. The scheduler polls the jobs of every device at once, each bus on a thread of its own.
+        return PollJob(modbus_config=self.modbus_config, unit=unit, command=command, start=start, number=number,
+                       period=period, name=name, callback=callback)
+
+    @staticmethod
+    def save_capabilities():
+        # Writes what the sessions learned about the devices to the capability file, for the next run
+        device_profiles.save()
+
+    def close(self):
+        # Closes the pooled connection of the session, the next operation connects again
+        self.modbus_handler.pool.discard(self.modbus_config)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class AsyncModbusSession:
+    # The operations of a session for asyncio programs. They run on a thread of the session one at a time, as
+    # the bus would take them anyway. Cancelling the task awaiting an operation interrupts it.
+    def __init__(self, modbus_config: ModbusConfig, pool: ConnectionPool = connection_pool,
+                 save_capabilities: bool = False):
+        self.session = ModbusSession(modbus_config, pool=pool, save_capabilities=save_capabilities)
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="ModTerm session")
+
+    @classmethod
+    def tcp(cls, host: str, port: int = 502, **kwargs) -> "AsyncModbusSession":
+        return cls(ModbusConfig(mode=TCP, ip=host, port=port), **kwargs)
+
+    @classmethod
+    def serial(cls, interface: str, baud_rate: int = 9600, parity: str = "N", bytesize: int = 8, stopbits: int = 1,
+               **kwargs) -> "AsyncModbusSession":
+        return cls(ModbusConfig(mode=RTU, interface=interface, baud_rate=baud_rate, parity=parity,
+                                bytesize=bytesize, stopbits=stopbits), **kwargs)
+
+    async def run(self, function: callable, *args, **kwargs):
+        future = asyncio.get_running_loop().run_in_executor(self.executor, partial(function, *args, **kwargs))
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The thread only stops once the operation notices, the next one must not start before that
+            self.session.cancel()
+            await asyncio.wait([future])
+            raise
+
+    async def read(self, *args, **kwargs) -> RegisterSnapshot:
+        return await self.run(self.session.read, *args, **kwargs)
+
+    async def read_points(self, *args, **kwargs) -> Dict[str, Optional[Union[int, float, bool]]]:
+        return await self.run(self.session.read_points, *args, **kwargs)
+
+    async def write(self, *args, **kwargs):
+        return await self.run(self.session.write, *args, **kwargs)
+
+    async def write_coil(self, *args, **kwargs):
+        return await self.run(self.session.write_coil, *args, **kwargs)
+
+    async def write_many(self, *args, **kwargs) -> List[WriteResult]:
+        return await self.run(self.session.write_many, *args, **kwargs)
+
+    async def restore(self, *args, **kwargs) -> RestorePlan:
+        return await self.run(self.session.restore, *args, **kwargs)
+
+    async def sweep_units(self, *args, **kwargs) -> List[UnitSweepResult]:
+        return await self.run(self.session.sweep_units, *args, **kwargs)
+
+    async def ip_sweep(self, *args, **kwargs) -> List[SweepResult]:
+        return await self.run(self.session.ip_sweep, *args, **kwargs)
+
+    async def save_capabilities(self):
+        await self.run(self.session.save_capabilities)
+
+    async def close(self):
+        await self.run(self.session.close)
+        self.executor.shutdown(wait=False)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+
+__all__ = ["ModbusSession", "AsyncModbusSession", "SessionError", "ModbusConfig", "RegisterPoint",
+           "RegisterSnapshot", "UnitSweepResult", "SweepResult", "PlannedRead", "WriteEntry", "WriteResult", "RestorePlan",
+           "decode_value", "decode_values", "encode_value", "load_register_map", "plan_reads", "load_write_entries",
+           "plan_writes", "PollScheduler", "PollJob", "JobStats", "HOLDING", "INPUT", "COIL", "DISCRETE", "BigEndian", "LittleEndian"]
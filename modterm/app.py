@@ -0,0 +1,398 @@
+"""
+ModTerm - Modbus analyser for the terminal
+
+Copyright (C) 2023  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import curses
+from os import environ, path
+import logging
+from typing import Optional
+from dataclasses import replace
+from logging.handlers import RotatingFileHandler
+
+from modterm.components.config_handler import save_modbus_config, get_project_dir
+from modterm.components.help import display_help
+from modterm.components.scrollable_list import ScrollableList, SelectWindow
+from modterm.components.header_menu import HeaderMenu
+from modterm.components.read_registers_menu import ReadRegistersMenu
+from modterm.components.write_registers_menu import WriteRegistersMenu
+from modterm.components.unit_sweep_menu import UnitSweepMenu
+from modterm.components.ip_sweep_menu import IpSweepMenu
+from modterm.components.register_map_menu import RegisterMapMenu
+from modterm.components.bulk_write_menu import BulkWriteMenu
+from modterm.components.restore_menu import RestoreMenu
+from modterm.components.popup_message import show_popup_message, show_input_popup
+from modterm.components.search_menu import SearchMenu
+from modterm.components.track_menu import TrackMenu
+from modterm.components.monitor import Monitor
+from modterm.components.config_handler import load_monitor_config, save_monitor_config
+from modterm.components.hepers import text_input_to_int, text_input_to_float
+from modterm.components.export_menu import ExportMenu
+from modterm.components.analyse_window import AnalyseWindow
+from modterm.components.modbus_handler import HistoryItem
+from modterm.components.definitions import HOLDING, COIL
+from modterm.components.bulk_write import snapshot_entries
+from modterm.components.connection_pool import connection_pool
+
+logger = logging.getLogger("ModTerm")
+
+help_text_rows = [
+    "Main",
+    "Quit application: F10",
+    "Top menu items: F keys as indicated",
+    "Navigation in list: Arrow keys, PgUp, PgDn",
+    "Enter: Register context menu",
+    "",
+    "Register operations",
+    "r - Read registers",
+    "w - Write registers",
+    "s - Sweep modbus units with register reads",
+    "e - Export register data",
+    "i - IP address sweep",
+    "h - Result history",
+    "g - Jump to address",
+    "f - Search register values",
+    "t - Track values across reads",
+    "m - Monitor: read the registers again and again, ESC to stop",
+    "p - Read the points of a register map file",
+    "b - Bulk write the values of a file, or of a table from its context menu",
+    "u - Restore the holding registers of a result from history",
+    "",
+    "Column titles",
+    "Idx - Index in the list           Addr - Address",
+    "HAddr - Address in hexadecimal    HexV - Value in hexadecimal",
+    "U16 - Unsigned 16 bit integer     I16 - Signed 16 bit integer",
+    "HexV - Value in hexadecimal       U16 - Unsigned 16 bit integer",
+    "I16 - Signe 16 bit integer        U32 - Unsigned 32 bit integer",
+    "I32 - Signed 32 bit integer       F32 - 32 bit floating point",
+    "St - string representation        Bits - the register bits"
+    # "i - Sweep IP addresses with register reads",
+]
+
+
+def app(screen):
+    screen.keypad(1)
+    curses.init_pair(1, curses.COLOR_BLACK, curses.COLOR_CYAN)
+    highlighted_text = curses.color_pair(1)
+    curses.init_pair(2, curses.COLOR_YELLOW, curses.COLOR_BLACK)
+    changed_text = curses.color_pair(2) | curses.A_BOLD
+    normal_text = curses.A_NORMAL
+    curses.curs_set(0)
+    screen.refresh()
+    screen_size = screen.getmaxyx()
+    menu = HeaderMenu(screen, normal_text, highlighted_text)
+    data_window = ScrollableList(screen.getmaxyx()[0] - 5,
+                                 screen.getmaxyx()[1],
+                                 5,
+                                 0,
+                                 normal_text,
+                                 highlighted_text,
+                                 marked_text=changed_text)
+    data_window.draw()
+    menu.draw()
+    curses.doupdate()
+    x = screen.getch()
+    modbus_handler = None
+    snapshot = None
+    logger.info("ModTerm started up")
+    history: dict[str, HistoryItem] = {}
+    while x != curses.KEY_F10:
+        if (x == curses.KEY_RESIZE and curses.is_term_resized(screen_size[0], screen_size[1])) or \
+                curses.is_term_resized(screen_size[0], screen_size[1]):
+            curses.resizeterm(screen.getmaxyx()[0],
+                              screen.getmaxyx()[1])
+            screen_size = screen.getmaxyx()
+            new_header_menu = HeaderMenu(screen, normal_text, highlighted_text)
+            new_header_menu.configuration = menu.configuration
+            menu = new_header_menu
+            new_data_window = ScrollableList(screen.getmaxyx()[0] - 5,
+                                             screen.getmaxyx()[1],
+                                             5,
+                                             0,
+                                             normal_text,
+                                             highlighted_text,
+                                             marked_text=changed_text)
+            new_data_window.data_rows = data_window.data_rows
+            new_data_window.title = data_window.title
+            new_data_window.added_border = data_window.added_border
+            new_data_window.header = data_window.header
+            new_data_window.empty_list_message = data_window.empty_list_message
+            data_window = new_data_window
+
+        if not data_window.check_navigate(x):
+            # Anything but moving in the list may have drawn over the data window
+            data_window.touch()
+        if menu.check_navigate(x):
+            if modbus_handler is not None:
+                table_data = modbus_handler.process_result(modbus_config=menu.configuration)
+                if table_data is not None:
+                    table_data.title = data_window.title
+                    page, position = data_window.page, data_window.position
+                    data_window.draw(table_data)
+                    data_window.page, data_window.position = page, position
+
+        if x == curses.KEY_F1:
+            display_help(screen, help_text_rows)
+        if x == ord("r"):
+            read_registers_menu = ReadRegistersMenu(screen, normal_text, highlighted_text, menu.configuration,
+                                                    data_window)
+            if read_registers_menu.is_valid:
+                table_data = read_registers_menu.get_result()
+                if table_data is not None:
+                    data_window.draw(table_data)
+                    modbus_handler = read_registers_menu.modbus_handler
+                    snapshot = modbus_handler.last_data
+                    history = {**{table_data.title: HistoryItem(table_content=table_data,
+                                                                modbus_handler=modbus_handler,
+                                                                snapshot=snapshot,
+                                                                modbus_config=replace(menu.configuration))},
+                               **history}
+                save_modbus_config(menu.configuration)
+        if x == ord("w"):
+            write_registers_menu = WriteRegistersMenu(screen, normal_text, highlighted_text, menu.configuration)
+            if write_registers_menu.is_valid:
+                write_registers_menu.get_result()
+                save_modbus_config(menu.configuration)
+        if x == ord("s"):
+            unit_sweep_menu = UnitSweepMenu(screen, normal_text, highlighted_text, menu.configuration)
+            if unit_sweep_menu.is_valid:
+                table_data = unit_sweep_menu.get_result()
+                if table_data is not None:
+                    data_window.draw(table_data)
+                    modbus_handler = None
+                    snapshot = None
+                save_modbus_config(menu.configuration)
+        if x == ord("i"):
+            ip_sweep_menu = IpSweepMenu(screen, normal_text, highlighted_text, menu.configuration)
+            if ip_sweep_menu.is_valid:
+                table_data = ip_sweep_menu.get_result()
+                if table_data is not None:
+                    data_window.draw(table_data)
+                    modbus_handler = None
+                    snapshot = None
+                save_modbus_config(menu.configuration)
+        if x == ord("p"):
+            register_map_menu = RegisterMapMenu(screen, normal_text, highlighted_text, menu.configuration)
+            if register_map_menu.is_valid:
+                table_data = register_map_menu.get_result()
+                if table_data is not None:
+                    data_window.draw(table_data)
+                    modbus_handler = None
+                    snapshot = None
+                save_modbus_config(menu.configuration)
+        if x == ord("b"):
+            bulk_write_menu = BulkWriteMenu(screen, normal_text, highlighted_text, menu.configuration)
+            if bulk_write_menu.is_valid:
+                table_data = bulk_write_menu.get_result()
+                if table_data is not None:
+                    data_window.draw(table_data)
+                    modbus_handler = None
+                    snapshot = None
+                save_modbus_config(menu.configuration)
+        if x == ord("u"):
+            if not any(item.snapshot is not None and item.snapshot.command == HOLDING for item in history.values()):
+                show_popup_message(screen, width=40, title="Error", message="Read some holding registers first!")
+            else:
+                restore_menu = RestoreMenu(screen, normal_text, highlighted_text, menu.configuration, history)
+                if restore_menu.is_valid:
+                    table_data = restore_menu.get_result()
+                    if table_data is not None:
+                        data_window.draw(table_data)
+                        modbus_handler = None
+                        snapshot = None
+                    save_modbus_config(menu.configuration)
+        if x == ord("e"):
+            if data_window.header is None or len(data_window.data_rows) == 0:
+                show_popup_message(screen, width=40, title="Error",
+                                   message="Nothing to export!")
+            else:
+                export_menu = ExportMenu(screen, normal_text, highlighted_text, data_window.header, data_window.data_rows)
+                if export_menu.is_valid:
+                    export_menu.get_result()
+        if x == ord("h"):
+            if len(history.keys()) != 0:
+                selection_window = SelectWindow(screen,
+                                                screen.getmaxyx()[0] - 20,
+                                                screen.getmaxyx()[1] - 30,
+                                                12,
+                                                10,
+                                                normal_text,
+                                                highlighted_text,
+                                                list(history.keys()),
+                                                title="Select previous result",
+                                                added_border=True)
+                selection = selection_window.get_selection()
+                data_window.touch()
+                if selection is not None:
+                    data_window.draw(history[selection].table_content)
+                    modbus_handler = history[selection].modbus_handler
+                    snapshot = history[selection].snapshot
+        if x == ord("g"):
+            columns = [title.strip() for title in data_window.header] if data_window.header is not None else []
+            if "Addr" not in columns or len(data_window.data_rows) == 0:
+                show_popup_message(screen, width=40, title="Error", message="No registers to jump to!")
+            elif (address := show_input_popup(screen, 40, "Jump to address", "Address: ")) is not None:
+                address = text_input_to_int(address)
+                if address is None or (row := data_window.find_row(columns.index("Addr"), address)) is None:
+                    show_popup_message(screen, width=40, title="Error", message="Address is not in the table!")
+                else:
+                    data_window.show_row(row)
+        if x == ord("f"):
+            if modbus_handler is None or snapshot is None or snapshot.is_bits:
+                show_popup_message(screen, width=40, title="Error", message="Read some registers to search in first!")
+            else:
+                search_menu = SearchMenu(screen, normal_text, highlighted_text, modbus_handler)
+                if search_menu.is_valid and (matches := search_menu.get_result()):
+                    labels = {match.label: match for match in matches}
+                    selection_window = SelectWindow(screen,
+                                                    screen.getmaxyx()[0] - 20,
+                                                    screen.getmaxyx()[1] - 30,
+                                                    12,
+                                                    10,
+                                                    normal_text,
+                                                    highlighted_text,
+                                                    list(labels.keys()),
+                                                    title="Select a match",
+                                                    added_border=True)
+                    if (selection := selection_window.get_selection()) is not None:
+                        data_window.show_row(labels[selection].index)
+        if x == ord("t"):
+            if modbus_handler is None or snapshot is None or snapshot.is_bits:
+                show_popup_message(screen, width=40, title="Error", message="Read some registers to track first!")
+            else:
+                track_menu = TrackMenu(screen, normal_text, highlighted_text, menu.configuration, modbus_handler)
+                if track_menu.is_valid:
+                    table_data = track_menu.get_result()
+                    if table_data is not None:
+                        data_window.draw(table_data)
+                    snapshot = modbus_handler.last_data
+                    save_modbus_config(menu.configuration)
+        if x == ord("m"):
+            if modbus_handler is None or snapshot is None:
+                show_popup_message(screen, width=40, title="Error", message="Read some registers to monitor first!")
+            else:
+                monitor_config = load_monitor_config()
+                interval = show_input_popup(screen, 40, "Monitor", "Poll interval (s): ", str(monitor_config.interval))
+                if interval is not None:
+                    if (interval := text_input_to_float(interval)) is None or interval <= 0:
+                        show_popup_message(screen, width=40, title="Error", message="Invalid poll interval!")
+                    else:
+                        monitor_config.interval = interval
+                        save_monitor_config(monitor_config)
+                        data_window.touch()
+                        Monitor(screen, data_window, modbus_handler, menu.configuration, interval).run()
+                        snapshot = modbus_handler.last_data
+        if x == ord('\n'):
+            if len(data_window.data_rows) != 0:
+                if data_window.bar_position is not None and 2 < len(data_window.get_current_row_data()):
+                    row_position = data_window.bar_position + 6
+                    command_list = ["Close", "Write register"]
+                    if snapshot is not None:
+                        # Rows of register map points have no raw register values to analyse
+                        command_list.append("Analyse")
+                    if snapshot is not None and snapshot.command in (HOLDING, COIL):
+                        command_list.append("Bulk write table")
+                    if row_position > screen.getmaxyx()[0] - len(command_list) - 3:
+                        row_position = data_window.position + 6 - len(command_list) - 2
+
+                    context_menu = SelectWindow(screen, len(command_list) + 2, len(max(command_list, key=len)) + 4, row_position,
+                                                25, normal_text, highlighted_text,
+                                                command_list)
+                    if (selection := context_menu.get_selection()) is not None:
+                        if selection == "Write register":
+                            current_row = data_window.get_current_row_data()
+                            if current_row is not None and 5 <= len(current_row):
+                                write_registers_menu = WriteRegistersMenu(screen, normal_text, highlighted_text, menu.configuration, int(current_row[1]))
+                                if write_registers_menu.is_valid:
+                                    write_registers_menu.get_result()
+                                    save_modbus_config(menu.configuration)
+                        elif selection == "Bulk write table":
+                            # Writes every value of the table, to the device the header is set to now
+                            bulk_write_menu = BulkWriteMenu(screen, normal_text, highlighted_text,
+                                                            menu.configuration, snapshot_entries(snapshot))
+                            if bulk_write_menu.is_valid:
+                                table_data = bulk_write_menu.get_result()
+                                if table_data is not None:
+                                    data_window.draw(table_data)
+                                    modbus_handler = None
+                                    snapshot = None
+                                save_modbus_config(menu.configuration)
+                        elif selection == "Analyse":
+                            if snapshot is not None and not snapshot.is_bits:
+                                # Rows of tracked values don't follow the registers, their first column does
+                                index = int(data_window.get_current_row_data()[0])
+                                next_4_row_data = snapshot[index:index + 4]
+                            else:
+                                next_4_row_data = data_window.get_next_4_row_raw_data()
+                            # show_popup_message(screen, 80, "fos", message=str(next_4_row_data))
+                            analyse_window = AnalyseWindow(screen, normal_text, highlighted_text, next_4_row_data, logger)
+                            analyse_window.draw()
+        menu.draw()
+        try:
+            data_window.draw()
+        except Exception:
+            logger.critical("Failed to draw data window!", exc_info=True)
+            show_popup_message(screen, width=40, title="Error", message="Failed to draw data window! Please refer to the log for details and report any software issues.")
+        # screen.addstr(screen.getmaxyx()[0] - 1, screen.getmaxyx()[1] - 4, str(x))
+        curses.doupdate()
+        x = screen.getch()
+        connection_pool.evict_idle()
+
+
+def setup_logging() -> Optional[str]:
+    # Only the UI logs to a file, importing the package or running a command writes nothing
+    logger.setLevel('INFO')
+    if (project_dir := get_project_dir()) is not None:
+        file_handler = RotatingFileHandler(path.join(project_dir, "modterm.log"),
+                                           maxBytes=2000000,
+                                           backupCount=3,
+                                           errors='replace')
+        file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+        logger.addHandler(file_handler)
+    return project_dir
+
+
+def main():
+    project_dir = setup_logging()
+    rc = 0
+    try:
+        environ.setdefault('ESCDELAY', '25')
+        stdscr = curses.initscr()
+        curses.noecho()
+        curses.cbreak()
+        stdscr.keypad(True)
+        try:
+            curses.start_color()
+        except:
+            pass
+        app(stdscr)
+    except Exception as e:
+        logger.critical("Critical error in main", exc_info=True)
+        rc = 1
+    except KeyboardInterrupt:
+        pass
+    finally:
+        connection_pool.close_all()
+        if 'stdscr' in locals():
+            stdscr.keypad(False)
+            curses.echo()
+            curses.nocbreak()
+            curses.endwin()
+    if rc == 1:
+        print(f"Critical error, please check the log file in {project_dir} and report any software issues")
+    logger.info(f"ModTerm session exited with code {rc}")
+    return rc
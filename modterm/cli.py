@@ -0,0 +1,354 @@
+"""
+ModTerm - Modbus analyser for the terminal
+
+Copyright (C) 2023  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import csv
+import json
+import sys
+from typing import List, Optional
+from modterm.components.definitions import ModbusConfig, ReadConfig, WriteConfig, UnitSweepConfig, IpSweepConfig, \
+    TCP, RTU, HOLDING, INPUT, COIL, DISCRETE, HOLDING_WRITE, COIL_WRITE, MAX_BLOCK_SIZES, BigEndian, LittleEndian, \
+    formats
+from modterm.components.modbus_handler import ModbusHandler, WORDS_HEADER_ROW, BITS_HEADER_ROW
+from modterm.components.background_worker import background_worker
+from modterm.components.device_capabilities import device_profiles
+from modterm.components.ip_sweep import validate_targets
+from modterm.components.bulk_write import load_write_entries, load_register_dump, WRITE_HEADER_ROW
+from modterm.components.register_map import RegisterMapError
+
+# Seconds between two looks at the progress of a read
+POLL_INTERVAL = 0.02
+
+FUNCTIONS = {"holding": HOLDING, "input": INPUT, "coil": COIL, "discrete": DISCRETE}
+ORDERS = {"big": BigEndian, "little": LittleEndian}
+# Columns written as numbers in JSON lines, the rest are text
+NUMERIC_COLUMNS = {"Idx", "Addr", "U16", "I16", "U32", "I32", "F32", "Val", "Unit", "Address", "Start", "End", "Count"}
+
+(EXIT_OK, EXIT_FAILED, EXIT_INTERRUPTED) = (0, 1, 130)
+
+
+class RowWriter:
+    # Writes rows to stdout the moment they are known, as CSV with a header row or as JSON objects keyed by the
+    # column titles, one per line
+    def __init__(self, header: List[str], output_format: str, stream=None):
+        self.columns = [title.strip() for title in header]
+        self.output_format = output_format
+        self.stream = stream if stream is not None else sys.stdout
+        if self.output_format == "csv":
+            self.writer = csv.writer(self.stream, lineterminator="\n")
+            self.writer.writerow(self.columns)
+            self.stream.flush()
+
+    def write(self, row: List[str]):
+        values = [str(value).strip() for value in row]
+        if self.output_format == "csv":
+            self.writer.writerow(values)
+        else:
+            self.stream.write(json.dumps({column: self.json_value(column, value)
+                                          for column, value in zip(self.columns, values)}) + "\n")
+        self.stream.flush()
+
+    @staticmethod
+    def json_value(column: str, value: str):
+        if value in ("", "-", "--"):
+            return None
+        if column in NUMERIC_COLUMNS:
+            for convert in (int, float):
+                try:
+                    return convert(value)
+                except ValueError:
+                    pass
+        return value
+
+
+class StatusPrinter:
+    # Status messages of the handler go to stderr, keeping stdout for the results
+    def __init__(self, verbose: bool, quiet: bool):
+        self.verbose = verbose
+        self.quiet = quiet
+        self.failed = False
+        self.last_failure = None
+
+    def __call__(self, text, failed=False, highlighted=False):
+        if failed:
+            self.failed = True
+            self.last_failure = text
+        if (failed and not self.quiet) or self.verbose:
+            print(text, file=sys.stderr, flush=True)
+
+
+def run(modbus_handler: ModbusHandler, function: callable, *args, progress: callable = None, **kwargs):
+    # Runs a handler operation on the background worker, as the UI does. Ctrl+C cancels it, the operation
+    # returns what it has got by then.
+    modbus_handler.cancel_event.clear()
+    job = background_worker.submit(function, *args, **kwargs)
+    try:
+        while not job.done.wait(POLL_INTERVAL):
+            if progress is not None:
+                progress()
+    except KeyboardInterrupt:
+        modbus_handler.cancel()
+        job.done.wait()
+    if job.error is not None:
+        raise job.error
+    return job.result
+
+
+def get_modbus_config(args) -> ModbusConfig:
+    if args.host is not None:
+        return ModbusConfig(mode=TCP, ip=args.host, port=args.port, byte_order=args.byte_order,
+                            word_order=args.word_order)
+    return ModbusConfig(mode=RTU, interface=args.serial, baud_rate=args.baud, parity=args.parity,
+                        bytesize=args.bytesize, stopbits=args.stopbits, byte_order=args.byte_order,
+                        word_order=args.word_order)
+
+
+def read(args, modbus_handler: ModbusHandler, status: StatusPrinter) -> int:
+    modbus_config = get_modbus_config(args)
+    read_config = ReadConfig(command=args.function, start=args.start, number=args.number, unit=args.unit,
+                             block_size=min(args.block_size, MAX_BLOCK_SIZES[args.function]),
+                             pipeline_depth=args.pipeline, adaptive_split=not args.no_map_readable)
+    bits = args.function in (COIL, DISCRETE)
+    writer = RowWriter(BITS_HEADER_ROW if bits else WORDS_HEADER_ROW, args.format)
+    written = 0
+
+    def write_rows(data, ready):
+        nonlocal written
+        if written < ready:
+            if bits:
+                rows = ModbusHandler.bit_rows(data, read_config.start, written, ready)
+            else:
+                rows = ModbusHandler.word_rows(data, modbus_config, read_config.start, written, ready)
+            for row in rows:
+                writer.write(row)
+            written = ready
+
+    def show_progress():
+        progress, data = modbus_handler.progress, modbus_handler.partial_data
+        if progress is None or data is None:
+            return
+        # The last row waits for the next register, it is part of the 32 bit values
+        write_rows(data, progress.ready if progress.ready == len(data) else max(0, progress.ready - 1))
+
+    if run(modbus_handler, modbus_handler.get_data_rows, modbus_config, read_config, progress=show_progress) is None:
+        return EXIT_INTERRUPTED if modbus_handler.cancelled() else EXIT_FAILED
+    write_rows(modbus_handler.last_data, len(modbus_handler.last_data))
+    return EXIT_INTERRUPTED if modbus_handler.cancelled() else EXIT_OK
+
+
+def write(args, modbus_handler: ModbusHandler, status: StatusPrinter) -> int:
+    try:
+        if args.coil:
+            value = int(args.value, 0)
+        elif args.type == "FLOAT32":
+            value = float(args.value)
+        else:
+            value = int(args.value, 0)
+    except ValueError:
+        print(f"Invalid value: {args.value}", file=sys.stderr)
+        return EXIT_FAILED
+    write_config = WriteConfig(command=COIL_WRITE if args.coil else HOLDING_WRITE, address=args.address,
+                               unit=args.unit, format=args.type, multicast=args.multicast, value=value,
+                               verify=args.verify)
+    result = run(modbus_handler, modbus_handler.write_registers, get_modbus_config(args), write_config, formats)
+    writer = RowWriter(["Address", "Unit", "Value", "Result"], args.format)
+    if result is None:
+        message = status.last_failure or "Failed to connect"
+    else:
+        message = result.message
+    writer.write([str(args.address), str(0 if args.multicast else args.unit), str(value), message])
+    return EXIT_OK if result is not None and result.success else EXIT_FAILED
+
+
+def write_many(args, modbus_handler: ModbusHandler, status: StatusPrinter) -> int:
+    try:
+        entries = load_write_entries(args.file)
+    except RegisterMapError as e:
+        print(e, file=sys.stderr)
+        return EXIT_FAILED
+    writer = RowWriter(WRITE_HEADER_ROW, args.format)
+    if run(modbus_handler, modbus_handler.bulk_write, get_modbus_config(args), entries, args.unit,
+           verify=args.verify, row_callback=writer.write) is None:
+        return EXIT_FAILED
+    if modbus_handler.cancelled():
+        return EXIT_INTERRUPTED
+    return EXIT_FAILED if status.failed else EXIT_OK
+
+
+def restore(args, modbus_handler: ModbusHandler, status: StatusPrinter) -> int:
+    try:
+        snapshot = load_register_dump(args.file)
+    except RegisterMapError as e:
+        print(e, file=sys.stderr)
+        return EXIT_FAILED
+    writer = RowWriter(WRITE_HEADER_ROW, args.format)
+    table = run(modbus_handler, modbus_handler.restore_snapshot, get_modbus_config(args), snapshot, args.unit,
+                args.dry_run, row_callback=writer.write)
+    if table is None:
+        return EXIT_INTERRUPTED if modbus_handler.cancelled() else EXIT_FAILED
+    if not args.quiet:
+        print(table.title.split(" - ", 1)[-1], file=sys.stderr)
+    if modbus_handler.cancelled():
+        return EXIT_INTERRUPTED
+    return EXIT_FAILED if status.failed else EXIT_OK
+
+
+def sweep(args, modbus_handler: ModbusHandler, status: StatusPrinter) -> int:
+    sweep_config = UnitSweepConfig(start_unit=args.first, last_unit=args.last, command=args.function,
+                                   start_register=args.start, number_of_registers=args.number, timeout=args.timeout)
+    writer = RowWriter(["Unit", "Scan result"], args.format)
+    if run(modbus_handler, modbus_handler.unit_sweep, get_modbus_config(args), sweep_config,
+           row_callback=writer.write) is None:
+        return EXIT_FAILED
+    return EXIT_INTERRUPTED if modbus_handler.cancelled() else EXIT_OK
+
+
+def ip_sweep(args, modbus_handler: ModbusHandler, status: StatusPrinter) -> int:
+    if (error := validate_targets(args.targets)) is not None:
+        print(f"Invalid targets: {error}", file=sys.stderr)
+        return EXIT_FAILED
+    sweep_config = IpSweepConfig(targets=args.targets, port=args.port, command=args.function,
+                                 start_register=args.start, number_of_registers=args.number, unit_id=args.unit,
+                                 timeout=args.timeout, concurrency=args.concurrency, responders_only=not args.all)
+    writer = RowWriter(["IP Address", "Scan result"], args.format)
+    if run(modbus_handler, modbus_handler.ip_sweep, ModbusConfig(), sweep_config,
+           row_callback=writer.write) is None:
+        return EXIT_FAILED
+    return EXIT_INTERRUPTED if modbus_handler.cancelled() else EXIT_OK
+
+
+def number(text: str) -> int:
+    # Accepts hexadecimal numbers with the 0x prefix, like the UI does
+    try:
+        return int(text, 0)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid number: {text}")
+
+
+def get_parser() -> argparse.ArgumentParser:
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument("--format", choices=["csv", "json"], default="csv",
+                        help="CSV with a header row, or one JSON object per line (default: csv)")
+    output.add_argument("-v", "--verbose", action="store_true", help="print every status message to stderr")
+    output.add_argument("-q", "--quiet", action="store_true", help="print no status messages, not even errors")
+
+    connection = argparse.ArgumentParser(add_help=False)
+    target = connection.add_mutually_exclusive_group(required=True)
+    target.add_argument("--host", help="IP address or name of a Modbus TCP device")
+    target.add_argument("--serial", metavar="INTERFACE", help="serial interface of a Modbus RTU bus")
+    connection.add_argument("--port", type=number, default=502, help="TCP port (default: 502)")
+    connection.add_argument("--baud", type=number, default=9600, help="baud rate (default: 9600)")
+    connection.add_argument("--parity", choices=["N", "E", "O"], default="N", help="parity (default: N)")
+    connection.add_argument("--bytesize", type=number, choices=[7, 8], default=8, help="data bits (default: 8)")
+    connection.add_argument("--stopbits", type=number, choices=[1, 2], default=1, help="stop bits (default: 1)")
+    connection.add_argument("--unit", type=number, default=1, help="Modbus unit ID (default: 1)")
+
+    registers = argparse.ArgumentParser(add_help=False)
+    registers.add_argument("--function", choices=FUNCTIONS.keys(), default="holding",
+                           help="registers, coils or inputs to read (default: holding)")
+    registers.add_argument("--start", type=number, default=0, help="first address (default: 0)")
+    registers.add_argument("--number", type=number, default=1, help="number of addresses (default: 1)")
+
+    parser = argparse.ArgumentParser(prog="modterm",
+                                     description="Modbus analyser. Without a command, the terminal UI starts. The "
+                                                 "commands stream their results to stdout.")
+    commands = parser.add_subparsers(dest="operation", required=True, metavar="command")
+
+    read_parser = commands.add_parser("read", parents=[output, connection, registers],
+                                      help="read registers, coils or discrete inputs")
+    read_parser.add_argument("--byte-order", choices=ORDERS.keys(), default="big", help="(default: big)")
+    read_parser.add_argument("--word-order", choices=ORDERS.keys(), default="big", help="(default: big)")
+    read_parser.add_argument("--block-size", type=number, default=125,
+                             help="addresses per request, at most 125 registers or 2000 bits (default: 125)")
+    read_parser.add_argument("--pipeline", type=number, default=1,
+                             help="requests in flight at a time over TCP (default: 1)")
+    read_parser.add_argument("--no-map-readable", action="store_true",
+                             help="don't narrow down the readable addresses of a block the device rejects")
+    read_parser.set_defaults(handler=read)
+
+    write_parser = commands.add_parser("write", parents=[output, connection],
+                                       help="write a holding register value or a coil")
+    write_parser.add_argument("--address", type=number, required=True, help="register or coil address")
+    write_parser.add_argument("--value", required=True, help="value to write, 0 or 1 for coils")
+    write_parser.add_argument("--type", choices=[key for key in formats if key != "BIT"], default="UINT16",
+                              help="encoding of the register value (default: UINT16)")
+    write_parser.add_argument("--coil", action="store_true", help="write a coil instead of registers")
+    write_parser.add_argument("--multicast", action="store_true", help="send to unit ID 0, expecting no response")
+    write_parser.add_argument("--verify", action="store_true",
+                              help="read the value back on the same connection, with FC23 if the device takes it")
+    write_parser.add_argument("--byte-order", choices=ORDERS.keys(), default="big", help="(default: big)")
+    write_parser.add_argument("--word-order", choices=ORDERS.keys(), default="big", help="(default: big)")
+    write_parser.set_defaults(handler=write)
+
+    write_many_parser = commands.add_parser("writemany", parents=[output, connection],
+                                            help="write the values of a file, coalescing neighbours into "
+                                                 "multi-register and multi-coil requests")
+    write_many_parser.add_argument("file", help="JSON or CSV file with address and value fields, like a register map")
+    write_many_parser.add_argument("--verify", action="store_true",
+                                   help="read every request back, with FC23 where the device takes it, or in as "
+                                        "few reads as possible once everything is written")
+    write_many_parser.add_argument("--byte-order", choices=ORDERS.keys(), default="big", help="(default: big)")
+    write_many_parser.add_argument("--word-order", choices=ORDERS.keys(), default="big", help="(default: big)")
+    write_many_parser.set_defaults(handler=write_many)
+
+    restore_parser = commands.add_parser("restore", parents=[output, connection],
+                                         help="write back the holding registers saved by a read, only the ones "
+                                              "that differ, and read them back")
+    restore_parser.add_argument("file", help="CSV or JSON lines output of the read command")
+    restore_parser.add_argument("--dry-run", action="store_true",
+                                help="list the write requests and the estimated bus time without writing")
+    restore_parser.set_defaults(handler=restore, byte_order="big", word_order="big")
+
+    sweep_parser = commands.add_parser("sweep", parents=[output, connection, registers],
+                                       help="look for the units answering a register read")
+    sweep_parser.add_argument("--first", type=number, default=1, help="first unit ID (default: 1)")
+    sweep_parser.add_argument("--last", type=number, default=255, help="last unit ID (default: 255)")
+    sweep_parser.add_argument("--timeout", type=float, default=0.2, help="seconds to wait per unit (default: 0.2)")
+    sweep_parser.set_defaults(handler=sweep, byte_order="big", word_order="big")
+
+    ip_sweep_parser = commands.add_parser("ipsweep", parents=[output, registers],
+                                          help="look for Modbus TCP devices on a network")
+    ip_sweep_parser.add_argument("targets", help="addresses, ranges (192.168.0.1-255), networks (10.0.0.0/24) "
+                                                 "and @files listing them, separated by commas")
+    ip_sweep_parser.add_argument("--port", type=number, default=502, help="TCP port (default: 502)")
+    ip_sweep_parser.add_argument("--unit", type=number, default=1, help="Modbus unit ID (default: 1)")
+    ip_sweep_parser.add_argument("--timeout", type=float, default=0.2, help="seconds to wait per host (default: 0.2)")
+    ip_sweep_parser.add_argument("--concurrency", type=number, default=64,
+                                 help="hosts probed at a time (default: 64)")
+    ip_sweep_parser.add_argument("--all", action="store_true", help="list the hosts that didn't respond as well")
+    ip_sweep_parser.set_defaults(handler=ip_sweep)
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    args = get_parser().parse_args(argv)
+    if hasattr(args, "function"):
+        args.function = FUNCTIONS[args.function]
+    if hasattr(args, "byte_order"):
+        args.byte_order, args.word_order = ORDERS[args.byte_order], ORDERS[args.word_order]
+    # Scripted runs leave the saved settings and the learned device capabilities alone
+    device_profiles.persistent = False
+    status = StatusPrinter(args.verbose, args.quiet)
+    modbus_handler = ModbusHandler(status)
+    try:
+        return args.handler(args, modbus_handler, status)
+    except BrokenPipeError:
+        # Whoever read the output has stopped, like head does
+        sys.stderr.close()
+        return EXIT_FAILED
@@ -17,6 +17,7 @@ You should have received a copy of the GNU General Public License
 along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 
+from itertools import takewhile
 from modterm.components.window_base import WindowBase
 from pymodbus.payload import BinaryPayloadDecoder as Decoder
 
@@ -29,7 +30,8 @@ class AnalyseWindow:
         self.screen = screen
         self.normal_text = normal_text
         self.highlighted_text = highlighted_text
-        self.registers = registers
+        # A register snapshot view or a list, decoding stops at the first register that couldn't be read
+        self.registers = list(takewhile(lambda register: register is not None, registers))
 
         self.column_paddings = [9, 0, 0, 0, 0]
         self.text_rows = [["Word/Byte", "Big/Big", "Big/Little", "Little/Big", "Little/Little"]]
@@ -0,0 +1,66 @@
+"""
+ModTerm - Modbus analyser for the terminal
+
+Copyright (C) 2023  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import queue
+import threading
+import logging
+from typing import Any, Optional
+
+logger = logging.getLogger("ModTerm")
+
+
+class Job:
+    def __init__(self, function: callable, args: tuple, kwargs: dict):
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class BackgroundWorker:
+    # Runs the Modbus operations one after the other on a single thread, so the curses UI never blocks on I/O.
+    def __init__(self):
+        self.jobs = queue.Queue()
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def submit(self, function: callable, *args, **kwargs) -> Job:
+        job = Job(function, args, kwargs)
+        with self.lock:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="ModTerm I/O", daemon=True)
+                self.thread.start()
+        self.jobs.put(job)
+        return job
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            try:
+                job.result = job.function(*job.args, **job.kwargs)
+            except BaseException as e:
+                logger.critical("Background operation failed", exc_info=True)
+                job.error = e
+            finally:
+                job.done.set()
+
+
+background_worker = BackgroundWorker()
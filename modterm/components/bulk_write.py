@@ -0,0 +1,257 @@
+"""
+ModTerm - Modbus analyser for the terminal
+
+Copyright (C) 2023  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import csv
+import json
+import struct
+from dataclasses import dataclass, field
+from itertools import groupby
+from typing import List, Optional, Sequence, Tuple, Union
+from modterm.components.definitions import RegisterPoint, ModbusConfig, DeviceCapabilities, HOLDING, COIL, \
+    HOLDING_WRITE, COIL_WRITE, MAX_WRITE_SIZES, MAX_READ_WRITE_SIZE, BigEndian, RTU
+from modterm.components.register_map import RegisterMapError, PlannedRead, load_map_entries, parse_point, plan_reads
+from modterm.components.register_snapshot import RegisterSnapshot
+from modterm.components.decoders import encode_value
+
+WRITE_HEADER_ROW = ["{: >8}".format("Function"), "{: >6}".format("Start"), "{: >6}".format("End"),
+                    "{: >5}".format("Count"), "{: <24}".format(" Points"), " Result"]
+
+WRITE_COMMANDS = {HOLDING: HOLDING_WRITE, COIL: COIL_WRITE}
+READ_BACK_COMMANDS = {HOLDING_WRITE: HOLDING, COIL_WRITE: COIL}
+WRITE_LABELS = {HOLDING_WRITE: "Holding", COIL_WRITE: "Coil"}
+BIT_VALUES = {"0": False, "1": True, "false": False, "true": True, "off": False, "on": True}
+
+# Seconds a device takes to answer a request, for estimates before its response time is learned
+DEFAULT_RESPONSE_TIME = 0.02
+# Silent interval between the frames of a serial line, in characters
+RTU_FRAME_GAP = 3.5
+
+
+@dataclass
+class WriteEntry:
+    point: RegisterPoint
+    value: Union[int, float, bool]
+
+
+@dataclass
+class PlannedWrite:
+    command: str
+    start: int
+    values: List[Union[int, bool]] = field(default_factory=list)
+    entries: List[WriteEntry] = field(default_factory=list)
+
+    @property
+    def number(self) -> int:
+        return len(self.values)
+
+
+@dataclass
+class WriteResult:
+    command: str
+    start: int
+    number: int
+    success: bool
+    message: str
+    # Addresses read back with a value other than the one written
+    mismatches: List[int] = field(default_factory=list)
+
+
+@dataclass
+class RestorePlan:
+    writes: List[PlannedWrite]
+    # Registers of the snapshot that could not be read from the device, these are left alone
+    skipped: int
+    estimated_time: float
+    results: List[WriteResult] = field(default_factory=list)
+
+    @property
+    def differing(self) -> int:
+        return sum(planned.number for planned in self.writes)
+
+
+def parse_entry(entry: dict, line: int) -> WriteEntry:
+    # A point of a register map with the value to write. Without a name, the point is called by its address.
+    entry = {key.strip().lower(): value for key, value in entry.items() if key is not None}
+    if str(entry.get("name", "")).strip() in ("", "None"):
+        entry["name"] = str(entry.get("address", "")).strip()
+    point = parse_point(entry, line)
+    if point.command not in WRITE_COMMANDS:
+        raise RegisterMapError(f"{point.name}: only holding registers and coils can be written")
+    value = str(entry.get("value", "")).strip()
+    if value in ("", "None"):
+        raise RegisterMapError(f"{point.name} has no value")
+    try:
+        if point.type == "BIT":
+            return WriteEntry(point, BIT_VALUES[value.lower()])
+        if point.type == "F32" or point.scale != 1:
+            return WriteEntry(point, float(value))
+        return WriteEntry(point, int(value, 16) if value.lower().startswith("0x") else int(value))
+    except (KeyError, ValueError):
+        raise RegisterMapError(f"Invalid value of {point.name}: {value}")
+
+
+def load_write_entries(path: str) -> List[WriteEntry]:
+    # A register map with a value field, name is optional
+    return [parse_entry(entry, line) for line, entry in enumerate(load_map_entries(path), start=1)]
+
+
+def snapshot_entries(snapshot: RegisterSnapshot) -> List[WriteEntry]:
+    # The holding registers or coils of a read as values to write, the ones that could not be read are left out
+    if snapshot.command not in WRITE_COMMANDS:
+        raise RegisterMapError("Only holding registers and coils can be written")
+    point_type = "BIT" if snapshot.is_bits else "U16"
+    return [WriteEntry(RegisterPoint(name=str(snapshot.start + index), address=snapshot.start + index,
+                                     command=snapshot.command, type=point_type), value)
+            for index, value in enumerate(snapshot) if value is not None]
+
+
+def encode_entry(entry: WriteEntry, byte_order: str = BigEndian,
+                 word_order: str = BigEndian) -> List[Union[int, bool]]:
+    # The registers (or the coil) of an entry. Scaled values are written as the value divided by the scale.
+    point = entry.point
+    if point.type == "BIT":
+        return [bool(entry.value)]
+    value = entry.value / point.scale if point.scale != 1 else entry.value
+    if point.type != "F32":
+        value = round(value)
+    try:
+        return encode_value(value, point.type, point.byte_order or byte_order, point.word_order or word_order)
+    except struct.error:
+        raise RegisterMapError(f"{entry.value} doesn't fit {point.name} ({point.type})")
+
+
+def plan_writes(entries: Sequence[WriteEntry], byte_order: str = BigEndian, word_order: str = BigEndian,
+                read_write: bool = False) -> List[PlannedWrite]:
+    # The fewest write requests covering every entry. Only entries next to each other are written together, as
+    # the registers between them have no value to write, and a request never goes beyond the protocol limit.
+    # With read_write, register requests stay small enough to be verified with FC23.
+    sizes = {**MAX_WRITE_SIZES, HOLDING_WRITE: MAX_READ_WRITE_SIZE} if read_write else MAX_WRITE_SIZES
+    writes = []
+    for command, group in groupby(sorted(entries, key=lambda entry: (WRITE_COMMANDS[entry.point.command],
+                                                                    entry.point.address)),
+                                  key=lambda entry: WRITE_COMMANDS[entry.point.command]):
+        current = None
+        for entry in group:
+            values = encode_entry(entry, byte_order, word_order)
+            if current is not None:
+                end = current.start + current.number
+                if entry.point.address < end:
+                    raise RegisterMapError(f"{entry.point.name} overlaps {current.entries[-1].point.name}")
+                if entry.point.address == end and current.number + len(values) <= sizes[command]:
+                    current.values += values
+                    current.entries.append(entry)
+                    continue
+            current = PlannedWrite(command=command, start=entry.point.address, values=values, entries=[entry])
+            writes.append(current)
+    return writes
+
+
+def plan_read_backs(writes: Sequence[PlannedWrite],
+                    capabilities: Optional[DeviceCapabilities] = None) -> List[PlannedRead]:
+    # The reads verifying written requests, planned like the points of a register map: requests written close to
+    # each other are read back together
+    points = [RegisterPoint(name=str(address), address=address, command=READ_BACK_COMMANDS[planned.command],
+                            type="U16" if planned.command == HOLDING_WRITE else "BIT")
+              for planned in writes for address in range(planned.start, planned.start + planned.number)]
+    return plan_reads(points, capabilities)
+
+
+def load_register_dump(path: str) -> RegisterSnapshot:
+    # Holding registers saved by a read, as CSV with a header row or as JSON objects one per line, with the
+    # columns of the register table. The raw values are taken from HexV, registers shown as -- were not read.
+    try:
+        with open(path, newline="") as f:
+            text = f.read()
+        if text.lstrip().startswith("{"):
+            rows = [json.loads(line) for line in text.splitlines() if line.strip() != ""]
+        else:
+            rows = list(csv.DictReader(text.splitlines()))
+    except (OSError, UnicodeDecodeError, json.JSONDecodeError, csv.Error) as e:
+        raise RegisterMapError(f"Failed to load the registers: {e}")
+    registers = {}
+    for line, row in enumerate(rows, start=1):
+        row = {str(key).strip(): str(value).strip() for key, value in row.items() if key is not None}
+        if "Addr" not in row or "HexV" not in row:
+            raise RegisterMapError("The file has no Addr and HexV columns of a register read")
+        try:
+            registers[int(row["Addr"])] = None if row["HexV"] in ("--", "", "None") else int(row["HexV"], 16)
+        except ValueError:
+            raise RegisterMapError(f"Invalid register in row {line}: {row['Addr']}, {row['HexV']}")
+    if len(registers) == 0:
+        raise RegisterMapError("The file has no registers")
+    start = min(registers)
+    snapshot = RegisterSnapshot(HOLDING, start, max(registers) - start + 1)
+    snapshot.set_range(0, [registers.get(address) for address in range(start, start + len(snapshot))])
+    return snapshot
+
+
+def diff_writes(target: RegisterSnapshot, current: RegisterSnapshot,
+                read_write: bool = False) -> Tuple[List[PlannedWrite], int]:
+    # The requests writing the registers of target the device now holds something else in, and the number of
+    # registers left alone because they could not be read from the device. Registers equal in both are never
+    # written, even between two differing ones: writing a register may do more than store its value.
+    entries = []
+    skipped = 0
+    for index, value in enumerate(target):
+        if value is None:
+            continue
+        if len(current) <= index or (now := current[index]) is None:
+            skipped += 1
+        elif now != value:
+            address = target.start + index
+            entries.append(WriteEntry(RegisterPoint(name=str(address), address=address), value))
+    return plan_writes(entries, read_write=read_write), skipped
+
+
+def frame_time(modbus_config: ModbusConfig, size: int) -> float:
+    # Seconds a frame of so many bytes takes on a serial line, with the silent interval following it
+    if modbus_config.mode != RTU:
+        return 0
+    bits = 1 + modbus_config.bytesize + (0 if modbus_config.parity == "N" else 1) + modbus_config.stopbits
+    return (size + RTU_FRAME_GAP) * bits / modbus_config.baud_rate
+
+
+def estimate_bus_time(modbus_config: ModbusConfig, writes: Sequence[PlannedWrite],
+                      response_time: Optional[float] = None, verify: bool = True, read_write: bool = False) -> float:
+    # Seconds the requests take: the response time of the device per request, and on serial lines the RTU
+    # frames of the requests and responses too. Verified writes are read back separately, one read per request
+    # at worst, or in the same FC23 round trip with read_write.
+    response_time = DEFAULT_RESPONSE_TIME if response_time is None else response_time
+    seconds = 0
+    for planned in writes:
+        data = 2 * planned.number if planned.command == HOLDING_WRITE else (planned.number + 7) // 8
+        if verify and read_write and planned.command == HOLDING_WRITE and planned.number <= MAX_READ_WRITE_SIZE:
+            # Read address and count come before the write of FC23, the response carries the registers read
+            seconds += response_time + frame_time(modbus_config, 13 + data) + frame_time(modbus_config, 5 + data)
+            continue
+        # Unit ID, function code, address, count, byte count, data and CRC, the response echoes the first five
+        seconds += response_time + frame_time(modbus_config, 9 + data) + frame_time(modbus_config, 8)
+        if verify:
+            seconds += response_time + frame_time(modbus_config, 8) + frame_time(modbus_config, 5 + data)
+    return seconds
+
+
+def write_row(planned: PlannedWrite, result: WriteResult) -> List[str]:
+    names = ", ".join(entry.point.name for entry in planned.entries)
+    return ["{: >8}".format(WRITE_LABELS[planned.command]),
+            "{: >6}".format(planned.start),
+            "{: >6}".format(planned.start + planned.number - 1),
+            "{: >5}".format(planned.number),
+            " {: <23}".format(names if len(names) <= 23 else names[:20] + "..."),
+            f" {result.message}"]
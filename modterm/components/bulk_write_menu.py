@@ -0,0 +1,110 @@
+"""
+ModTerm - Modbus analyser for the terminal
+
+Copyright (C) 2023  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import curses
+import os
+from typing import List, Optional
+from modterm.components.hepers import get_text_input, CancelInput, text_input_to_int
+from modterm.components.config_handler import load_bulk_write_config, save_bulk_write_config
+from modterm.components.modbus_handler import ModbusHandler
+from modterm.components.bulk_write import load_write_entries, WriteEntry
+from modterm.components.register_map import RegisterMapError
+from modterm.components.menu_base import MenuBase
+
+
+class BulkWriteMenu(MenuBase):
+    # Writes the values of a file, or the entries given, the values of a register table
+    def __init__(self, screen, normal_text, highlighted_text, modbus_config,
+                 entries: Optional[List[WriteEntry]] = None, source_name: str = "table"):
+        super().__init__(screen,
+                         normal_text,
+                         highlighted_text,
+                         menu_labels={2: "F2 - Value file: " if entries is None else
+                                      f"Values: {len(entries)} of the {source_name}",
+                                      3: "F3 - Modbus unit ID: ",
+                                      4: "F4 - Read back: ",
+                                      5: "Write values, ESC to interrupt the process "},
+                         config_values={2: "path" if entries is None else "",
+                                        3: "unit",
+                                        4: "verify",
+                                        5: ""},
+                         interfaces={2: self.get_path if entries is None else lambda clear=False: None,
+                                     3: self.get_unit_id,
+                                     4: self.swap_verify},
+                         menu_name="Bulk write")
+
+        self.modbus_handler = ModbusHandler(self.add_status_text)
+        self.modbus_config = modbus_config
+        self.configuration = load_bulk_write_config()
+        self.entries = entries
+        self.source_name = source_name
+        self.help_text_rows.extend(["",
+                                    "Writes the values of a JSON or CSV file with address, value, function,",
+                                    "type, scale, byte_order and word_order fields, like a register map,",
+                                    "or the holding registers or coils of a table, from its context menu.",
+                                    "Values next to each other are written in the same request. Unit ID 0",
+                                    "sends them to every unit, expecting no response. Read back verifies",
+                                    "the values, in the same round trip (FC23) if the device supports it."])
+
+    def get_path(self, clear=False):
+        try:
+            file_path = get_text_input(self.dialog.window, self.dialog.width - 20, 2, 18,
+                                       str(self.configuration.path) if not clear else "")
+        except CancelInput:
+            return
+        if not os.path.isfile(file_path):
+            self.dialog.window.addstr(2, 18, "  File doesn't exist  ")
+            self.dialog.window.refresh()
+            curses.napms(1000)
+        else:
+            self.configuration.path = file_path
+
+    def get_unit_id(self, clear=False):
+        try:
+            unit_id = get_text_input(self.dialog.window, 5, 3, 23,
+                                     str(self.configuration.unit) if not clear else "")
+        except CancelInput:
+            return
+        unit_id = text_input_to_int(unit_id)
+        if unit_id is not None:
+            if not 0 <= unit_id <= 255:
+                unit_id = None
+        if unit_id is None:
+            self.dialog.window.addstr(3, 23, "Invalid unit ID")
+            self.dialog.window.refresh()
+            curses.napms(1000)
+        else:
+            self.configuration.unit = unit_id
+
+    def swap_verify(self, clear=False):
+        self.configuration.verify = not self.configuration.verify
+
+    def action(self):
+        save_bulk_write_config(self.configuration)
+        if self.entries is not None:
+            entries, source_name = self.entries, self.source_name
+        else:
+            try:
+                entries = load_write_entries(self.configuration.path)
+            except RegisterMapError as e:
+                self.add_status_text(str(e), failed=True)
+                return None
+            source_name = os.path.basename(self.configuration.path)
+        return self.run_in_background(self.modbus_handler.bulk_write, self.modbus_config, entries,
+                                      self.configuration.unit, source_name, self.configuration.verify)
@@ -25,7 +25,8 @@ import sys
 from pathlib import Path
 from json import loads, dumps
 from modterm.components.definitions import CONFIG_DIR, ConfigType, ModbusConfig, ReadConfig, WriteConfig, \
-    UnitSweepConfig, ExportConfig, IpSweepConfig
+    UnitSweepConfig, ExportConfig, IpSweepConfig, CapabilityCache, SearchConfig, \
+    TrackConfig, MonitorConfig, RegisterMapConfig, BulkWriteConfig, RestoreConfig
 
 
 class ConfigOperation(Enum):
@@ -62,18 +63,39 @@ def config_file_manager(action: ConfigOperation,
                                                      Type[WriteConfig],
                                                      Type[UnitSweepConfig],
                                                      Type[ExportConfig],
-                                                     Type[IpSweepConfig]]] = None,
+                                                     Type[IpSweepConfig],
+                                                     Type[CapabilityCache],
+                                                     Type[SearchConfig],
+                                                     Type[TrackConfig],
+                                                     Type[MonitorConfig],
+                                                     Type[RegisterMapConfig],
+                                                     Type[BulkWriteConfig],
+                                                     Type[RestoreConfig]]] = None,
                         config_to_save: Optional[Union[ModbusConfig,
                                                        ReadConfig,
                                                        WriteConfig,
                                                        UnitSweepConfig,
                                                        ExportConfig,
-                                                       IpSweepConfig]] = None) -> Optional[Union[ModbusConfig,
-                                                                                                ReadConfig,
-                                                                                                WriteConfig,
-                                                                                                UnitSweepConfig,
-                                                                                                ExportConfig,
-                                                                                                IpSweepConfig]]:
+                                                       IpSweepConfig,
+                                                       CapabilityCache,
+                                                       SearchConfig,
+                                                       TrackConfig,
+                                                       MonitorConfig,
+                                                       RegisterMapConfig,
+                                                       BulkWriteConfig,
+                                                       RestoreConfig]] = None) -> Optional[Union[ModbusConfig,
+                                                                                                   ReadConfig,
+                                                                                                   WriteConfig,
+                                                                                                   UnitSweepConfig,
+                                                                                                   ExportConfig,
+                                                                                                   IpSweepConfig,
+                                                                                                   CapabilityCache,
+                                                                                                   SearchConfig,
+                                                                                                   TrackConfig,
+                                                                                                   MonitorConfig,
+                                                                                                   RegisterMapConfig,
+                                                                                                   BulkWriteConfig,
+                                                                                                   RestoreConfig]]:
 
     if (config_dir := get_project_dir()) is None:
         # TODO log error
@@ -171,3 +193,87 @@ def load_export_config() -> ExportConfig:
     return config_file_manager(action=ConfigOperation.LOAD,
                                config_type=ConfigType.ExportConfig,
                                config_class=ExportConfig)
+
+
+def load_capability_cache() -> CapabilityCache:
+    return config_file_manager(action=ConfigOperation.LOAD,
+                               config_type=ConfigType.DeviceCapabilities,
+                               config_class=CapabilityCache)
+
+
+def save_capability_cache(config: CapabilityCache):
+    return config_file_manager(action=ConfigOperation.SAVE,
+                               config_type=ConfigType.DeviceCapabilities,
+                               config_to_save=config)
+
+
+def load_search_config() -> SearchConfig:
+    return config_file_manager(action=ConfigOperation.LOAD,
+                               config_type=ConfigType.SearchConfig,
+                               config_class=SearchConfig)
+
+
+def save_search_config(config: SearchConfig):
+    return config_file_manager(action=ConfigOperation.SAVE,
+                               config_type=ConfigType.SearchConfig,
+                               config_to_save=config)
+
+
+def load_track_config() -> TrackConfig:
+    return config_file_manager(action=ConfigOperation.LOAD,
+                               config_type=ConfigType.TrackConfig,
+                               config_class=TrackConfig)
+
+
+def save_track_config(config: TrackConfig):
+    return config_file_manager(action=ConfigOperation.SAVE,
+                               config_type=ConfigType.TrackConfig,
+                               config_to_save=config)
+
+
+def load_monitor_config() -> MonitorConfig:
+    return config_file_manager(action=ConfigOperation.LOAD,
+                               config_type=ConfigType.MonitorConfig,
+                               config_class=MonitorConfig)
+
+
+def save_monitor_config(config: MonitorConfig):
+    return config_file_manager(action=ConfigOperation.SAVE,
+                               config_type=ConfigType.MonitorConfig,
+                               config_to_save=config)
+
+
+def load_register_map_config() -> RegisterMapConfig:
+    return config_file_manager(action=ConfigOperation.LOAD,
+                               config_type=ConfigType.RegisterMapConfig,
+                               config_class=RegisterMapConfig)
+
+
+def save_register_map_config(config: RegisterMapConfig):
+    return config_file_manager(action=ConfigOperation.SAVE,
+                               config_type=ConfigType.RegisterMapConfig,
+                               config_to_save=config)
+
+
+def load_bulk_write_config() -> BulkWriteConfig:
+    return config_file_manager(action=ConfigOperation.LOAD,
+                               config_type=ConfigType.BulkWriteConfig,
+                               config_class=BulkWriteConfig)
+
+
+def save_bulk_write_config(config: BulkWriteConfig):
+    return config_file_manager(action=ConfigOperation.SAVE,
+                               config_type=ConfigType.BulkWriteConfig,
+                               config_to_save=config)
+
+
+def load_restore_config() -> RestoreConfig:
+    return config_file_manager(action=ConfigOperation.LOAD,
+                               config_type=ConfigType.RestoreConfig,
+                               config_class=RestoreConfig)
+
+
+def save_restore_config(config: RestoreConfig):
+    return config_file_manager(action=ConfigOperation.SAVE,
+                               config_type=ConfigType.RestoreConfig,
+                               config_to_save=config)
@@ -0,0 +1,164 @@
+"""
+ModTerm - Modbus analyser for the terminal
+
+Copyright (C) 2023  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import select
+import threading
+import time
+import logging
+from dataclasses import dataclass, field
+from typing import Optional, Union, Tuple, Dict
+from pymodbus.client import ModbusTcpClient
+from pymodbus.client.serial import ModbusSerialClient
+from modterm.components.definitions import ModbusConfig, TCP
+
+logger = logging.getLogger("ModTerm")
+
+DEFAULT_TIMEOUT = 1
+IDLE_TIMEOUT = 60
+
+
+def get_connection_key(modbus_config: ModbusConfig) -> Tuple:
+    # A serial line is one bus whatever its settings, it is only ever driven through one connection
+    if modbus_config.mode == TCP:
+        return TCP, modbus_config.ip, modbus_config.port
+    return modbus_config.mode, modbus_config.interface
+
+
+def get_line_settings(modbus_config: ModbusConfig) -> Optional[Tuple]:
+    if modbus_config.mode == TCP:
+        return None
+    return modbus_config.baud_rate, modbus_config.bytesize, modbus_config.parity, modbus_config.stopbits
+
+
+@dataclass
+class PooledConnection:
+    client: Union[ModbusTcpClient, ModbusSerialClient]
+    line_settings: Optional[Tuple] = None
+    last_used: float = 0
+    users: int = 0
+    lock: threading.RLock = field(default_factory=threading.RLock)
+
+
+class ConnectionPool:
+    def __init__(self, idle_timeout: float = IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.connections: Dict[Tuple, PooledConnection] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def create_client(modbus_config: ModbusConfig) -> Union[ModbusTcpClient, ModbusSerialClient]:
+        if modbus_config.mode == TCP:
+            return ModbusTcpClient(host=modbus_config.ip,
+                                   port=modbus_config.port,
+                                   timeout=DEFAULT_TIMEOUT)
+        return ModbusSerialClient(port=modbus_config.interface,
+                                  baudrate=modbus_config.baud_rate,
+                                  bytesize=modbus_config.bytesize,
+                                  parity=modbus_config.parity,
+                                  stopbits=modbus_config.stopbits,
+                                  timeout=DEFAULT_TIMEOUT)
+
+    @staticmethod
+    def is_healthy(client: Union[ModbusTcpClient, ModbusSerialClient]) -> bool:
+        if client.socket is None:
+            return False
+        if isinstance(client, ModbusTcpClient):
+            # A readable idle socket either got closed by the peer or holds a late answer to an
+            # earlier, timed out request. The former is dead, the latter is drained.
+            try:
+                while select.select([client.socket], [], [], 0)[0]:
+                    if client.socket.recv(1024) == b"":
+                        return False
+            except (OSError, ValueError):
+                return False
+            return True
+        try:
+            if not client.socket.is_open:
+                return False
+            client.socket.reset_input_buffer()
+        except Exception:
+            return False
+        return True
+
+    def acquire(self,
+                modbus_config: ModbusConfig,
+                timeout: float = None,
+                multicast_enable: bool = False) -> Optional[Union[ModbusTcpClient, ModbusSerialClient]]:
+        self.evict_idle()
+        key = get_connection_key(modbus_config)
+        with self.lock:
+            if (connection := self.connections.get(key)) is None:
+                connection = PooledConnection(client=self.create_client(modbus_config),
+                                              line_settings=get_line_settings(modbus_config))
+                self.connections[key] = connection
+            connection.users += 1
+        connection.lock.acquire()
+        if connection.line_settings != get_line_settings(modbus_config):
+            # The same serial line with other settings, reopened once the previous user is done with it
+            logger.info(f"Reopening {key} with the settings {get_line_settings(modbus_config)}")
+            with self.lock:
+                connection.client.close()
+                connection.client = self.create_client(modbus_config)
+                connection.line_settings = get_line_settings(modbus_config)
+        client = connection.client
+        client.comm_params.timeout_connect = DEFAULT_TIMEOUT if timeout is None else timeout
+        client.params.broadcast_enable = multicast_enable
+        if client.socket is not None and not self.is_healthy(client):
+            logger.info(f"Pooled connection {key} is stale, reconnecting")
+            client.close()
+        if client.socket is None:
+            if not client.connect():
+                self.release(client)
+                return None
+        elif not isinstance(client, ModbusTcpClient) and client.socket.timeout != client.comm_params.timeout_connect:
+            client.socket.timeout = client.comm_params.timeout_connect
+        return client
+
+    def release(self, client: Union[ModbusTcpClient, ModbusSerialClient]):
+        with self.lock:
+            for connection in self.connections.values():
+                if connection.client is client:
+                    connection.last_used = time.monotonic()
+                    connection.users -= 1
+                    connection.lock.release()
+                    return
+
+    def discard(self, modbus_config: ModbusConfig):
+        with self.lock:
+            connection = self.connections.pop(get_connection_key(modbus_config), None)
+        if connection is not None:
+            with connection.lock:
+                connection.client.close()
+
+    def evict_idle(self):
+        now = time.monotonic()
+        with self.lock:
+            for key, connection in list(self.connections.items()):
+                if connection.users == 0 and self.idle_timeout < now - connection.last_used:
+                    connection.client.close()
+                    del self.connections[key]
+
+    def close_all(self):
+        with self.lock:
+            for connection in self.connections.values():
+                connection.client.close()
+            self.connections = {}
+
+
+connection_pool = ConnectionPool()
@@ -0,0 +1,82 @@
+"""
+ModTerm - Modbus analyser for the terminal
+
+Copyright (C) 2023  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import struct
+from typing import List, Optional, Sequence, Union
+from modterm.components.definitions import BigEndian, LittleEndian
+
+# struct formats of the value types, on big endian words in big endian word order
+VALUE_FORMATS = {
+    "U16": ">H",
+    "I16": ">h",
+    "U32": ">I",
+    "I32": ">i",
+    "F32": ">f"
+}
+VALUE_SIZES = {value_type: struct.calcsize(value_format) // 2 for value_type, value_format in VALUE_FORMATS.items()}
+
+
+def swap_byte_order(word: int) -> int:
+    return (word >> 8) | ((word & 0xff) << 8)
+
+
+def decode_value(registers: Sequence[int], value_type: str, byte_order: str = BigEndian,
+                 word_order: str = BigEndian) -> Union[int, float]:
+    # A U16, I16, U32, I32 or F32 value from the first one or two registers
+    size = VALUE_SIZES[value_type]
+    if len(registers) < size:
+        raise ValueError(f"{value_type} takes {size} registers")
+    words = [swap_byte_order(word) if byte_order == LittleEndian else word for word in registers[:size]]
+    if word_order == LittleEndian:
+        words.reverse()
+    return struct.unpack(VALUE_FORMATS[value_type], struct.pack(f">{size}H", *words))[0]
+
+
+def encode_value(value: Union[int, float], value_type: str, byte_order: str = BigEndian,
+                 word_order: str = BigEndian) -> List[int]:
+    # The registers of a value, the reverse of decode_value. struct.error if the value doesn't fit the type.
+    size = VALUE_SIZES[value_type]
+    words = list(struct.unpack(f">{size}H", struct.pack(VALUE_FORMATS[value_type], value)))
+    if word_order == LittleEndian:
+        words.reverse()
+    return [swap_byte_order(word) if byte_order == LittleEndian else word for word in words]
+
+
+def decode_values(registers: Sequence[Optional[int]], value_type: str, byte_order: str = BigEndian,
+                  word_order: str = BigEndian) -> List[Optional[Union[int, float]]]:
+    # The value starting at every register, None where a register of it is None (could not be read). 32 bit
+    # values overlap: the list is one shorter than the registers.
+    size = VALUE_SIZES[value_type]
+    words = [None if word is None else swap_byte_order(word) if byte_order == LittleEndian else word
+             for word in registers]
+    if size == 1:
+        if value_type == "U16":
+            return words
+        return [None if word is None else word - 0x10000 if 0x8000 <= word else word for word in words]
+    unpack = struct.Struct(VALUE_FORMATS[value_type]).unpack
+    pack = struct.Struct(">HH").pack
+    values = []
+    for first, second in zip(words, words[1:]):
+        if first is None or second is None:
+            values.append(None)
+        elif word_order == LittleEndian:
+            values.append(unpack(pack(second, first))[0])
+        else:
+            values.append(unpack(pack(first, second))[0])
+    return values
@@ -18,8 +18,8 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 
 from enum import Enum
-from typing import List, Optional
-from dataclasses import dataclass
+from typing import List, Optional, Dict, Sequence
+from dataclasses import dataclass, field
 import inspect
 
 CONFIG_DIR = "modterm"
@@ -32,6 +32,52 @@ DISCRETE = "Read discrete inputs"
 HOLDING_WRITE = "Write holding registers"
 COIL_WRITE = "Write coils"
 
+READ_METHODS = {
+    HOLDING: "read_holding_registers",
+    INPUT: "read_input_registers",
+    COIL: "read_coils",
+    DISCRETE: "read_discrete_inputs"
+}
+
+MAX_BLOCK_SIZES = {
+    HOLDING: 125,
+    INPUT: 125,
+    COIL: 2000,
+    DISCRETE: 2000
+}
+
+# The most registers and coils a write request takes
+MAX_WRITE_SIZES = {
+    HOLDING_WRITE: 123,
+    COIL_WRITE: 1968
+}
+
+# The most registers an FC23 request writes, while reading some back in the same round trip
+MAX_READ_WRITE_SIZE = 121
+
+# Unwanted registers (or bits) worth reading along to save a request
+REGISTER_GAP = 10
+BIT_GAP = 80
+
+# Types of the points of a register map, with the number of registers (or bits) they take
+POINT_TYPES = {
+    "U16": 1,
+    "I16": 1,
+    "U32": 2,
+    "I32": 2,
+    "F32": 2,
+    "BIT": 1
+}
+
+NEW_SEARCH = "New search"
+CHANGED = "Changed"
+UNCHANGED = "Unchanged"
+INCREASED = "Increased"
+DECREASED = "Decreased"
+EQUAL = "Equal to value"
+
+TRACK_CONDITIONS = [NEW_SEARCH, CHANGED, UNCHANGED, INCREASED, DECREASED, EQUAL]
+
 LittleEndian = "Little endian"
 BigEndian = "Big endian"
 
@@ -55,6 +101,13 @@ class ConfigType(Enum):
     UnitSweepConfig = "scan_config.conf"
     ExportConfig = "export.conf"
     IpSweepConfig = "ip_sweep_config.conf"
+    DeviceCapabilities = "device_capabilities.conf"
+    SearchConfig = "search_config.conf"
+    TrackConfig = "track_config.conf"
+    MonitorConfig = "monitor_config.conf"
+    RegisterMapConfig = "register_map_config.conf"
+    BulkWriteConfig = "bulk_write_config.conf"
+    RestoreConfig = "restore_config.conf"
 
 
 @dataclass
@@ -85,6 +138,9 @@ class ReadConfig:
     number: int = 1
     unit: int = 1
     block_size: int = 125
+    pipeline_depth: int = 1
+    adaptive_split: bool = True
+    use_capabilities: bool = True
 
     @classmethod
     def from_dict(cls, config_dict):
@@ -102,6 +158,7 @@ class WriteConfig:
     format: str = list(formats.keys())[0]
     multicast: bool = False
     value: float = 1
+    verify: bool = False
 
     @classmethod
     def from_dict(cls, config_dict):
@@ -144,15 +201,84 @@ class UnitSweepConfig:
 
 @dataclass
 class IpSweepConfig:
-    subnet: str = "192.168.0"
-    start_address: int = 1
-    end_address: int = 255
+    targets: str = "192.168.0.1-255"
     port: int = 502
     command: str = HOLDING
     start_register: int = 0
     number_of_registers: int = 1
     unit_id: int = 1
     timeout: float = 0.2
+    concurrency: int = 64
+    responders_only: bool = True
+
+    @classmethod
+    def from_dict(cls, config_dict):
+        if "targets" not in config_dict and "subnet" in config_dict:
+            config_dict["targets"] = (f"{config_dict['subnet']}.{config_dict.get('start_address', 1)}"
+                                      f"-{config_dict.get('end_address', 255)}")
+        return cls(**{
+            k: v for k, v in config_dict.items()
+            if k in inspect.signature(cls).parameters
+        })
+
+
+@dataclass
+class SearchConfig:
+    value: float = 0
+    tolerance: float = 0
+
+    @classmethod
+    def from_dict(cls, config_dict):
+        return cls(**{
+            k: v for k, v in config_dict.items()
+            if k in inspect.signature(cls).parameters
+        })
+
+
+@dataclass
+class TrackConfig:
+    condition: str = NEW_SEARCH
+    value: float = 0
+    tolerance: float = 0
+
+    @classmethod
+    def from_dict(cls, config_dict):
+        return cls(**{
+            k: v for k, v in config_dict.items()
+            if k in inspect.signature(cls).parameters
+        })
+
+
+@dataclass
+class MonitorConfig:
+    interval: float = 1.0
+
+    @classmethod
+    def from_dict(cls, config_dict):
+        return cls(**{
+            k: v for k, v in config_dict.items()
+            if k in inspect.signature(cls).parameters
+        })
+
+
+@dataclass
+class RegisterMapConfig:
+    path: str = ""
+    unit: int = 1
+
+    @classmethod
+    def from_dict(cls, config_dict):
+        return cls(**{
+            k: v for k, v in config_dict.items()
+            if k in inspect.signature(cls).parameters
+        })
+
+
+@dataclass
+class BulkWriteConfig:
+    path: str = ""
+    unit: int = 1
+    verify: bool = False
 
     @classmethod
     def from_dict(cls, config_dict):
@@ -162,8 +288,70 @@ class IpSweepConfig:
         })
 
 
+@dataclass
+class RestoreConfig:
+    # Title of the history result to restore, only meaningful in the session it was read in
+    snapshot: str = ""
+    unit: int = 1
+    dry_run: bool = True
+
+    @classmethod
+    def from_dict(cls, config_dict):
+        return cls(**{
+            k: v for k, v in config_dict.items()
+            if k in inspect.signature(cls).parameters
+        })
+
+
+@dataclass
+class RegisterPoint:
+    # A named value of a register map. Points without a byte or word order of their own use the global ones.
+    name: str
+    address: int
+    command: str = HOLDING
+    type: str = "U16"
+    scale: float = 1
+    byte_order: Optional[str] = None
+    word_order: Optional[str] = None
+
+    @property
+    def size(self) -> int:
+        return POINT_TYPES[self.type]
+
+
+@dataclass
+class DeviceCapabilities:
+    max_block_size: Dict[str, int] = field(default_factory=dict)
+    rejected_block_size: Dict[str, int] = field(default_factory=dict)
+    dead_ranges: Dict[str, List[List[int]]] = field(default_factory=dict)
+    response_time: Optional[float] = None
+    max_response_time: Optional[float] = None
+    pipelining: Optional[bool] = None
+    # Whether the device takes FC23, read/write multiple registers
+    read_write: Optional[bool] = None
+
+    @classmethod
+    def from_dict(cls, config_dict):
+        return cls(**{
+            k: v for k, v in config_dict.items()
+            if k in inspect.signature(cls).parameters and
+            (k not in ("max_block_size", "rejected_block_size") or isinstance(v, dict))
+        })
+
+
+@dataclass
+class CapabilityCache:
+    devices: Dict[str, DeviceCapabilities] = field(default_factory=dict)
+
+    @classmethod
+    def from_dict(cls, config_dict):
+        return cls(devices={
+            k: DeviceCapabilities.from_dict(v) for k, v in config_dict.get("devices", {}).items()
+        })
+
+
 @dataclass
 class TableContents:
     header: Optional[List[str]]
-    rows: List[List[str]]
+    rows: Sequence[List[str]]
     title: str = ""
@@ -0,0 +1,137 @@
+"""
+ModTerm - Modbus analyser for the terminal
+
+Copyright (C) 2023  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import threading
+from typing import List, Tuple, Optional
+from modterm.components.definitions import ModbusConfig, DeviceCapabilities, CapabilityCache, TCP
+from modterm.components.config_handler import load_capability_cache, save_capability_cache
+
+RESPONSE_TIME_SMOOTHING = 0.2
+MIN_TIMEOUT = 0.05
+MAX_TIMEOUT = 5
+
+
+def get_device_key(modbus_config: ModbusConfig, unit: int) -> str:
+    if modbus_config.mode == TCP:
+        return f"{TCP}:{modbus_config.ip}:{modbus_config.port}/{unit}"
+    return (f"{modbus_config.mode}:{modbus_config.interface}:{modbus_config.baud_rate}-{modbus_config.bytesize}"
+            f"{modbus_config.parity}{modbus_config.stopbits}/{unit}")
+
+
+def merge_ranges(ranges: List[List[int]]) -> List[List[int]]:
+    merged = []
+    for first, last in sorted(ranges):
+        if merged and first <= merged[-1][1] + 1:
+            merged[-1][1] = max(merged[-1][1], last)
+        else:
+            merged.append([first, last])
+    return merged
+
+
+class DeviceProfiles:
+    def __init__(self):
+        self.cache: Optional[CapabilityCache] = None
+        # Profiles are updated from the background worker, the poll threads and API sessions while another thread
+        # may be saving them, the helpers below change them holding this lock and save() serialises under it
+        self.lock = threading.Lock()
+        # Without persistence, what is learned about the devices is kept in memory only
+        self.persistent = True
+
+    def get(self, modbus_config: ModbusConfig, unit: int) -> DeviceCapabilities:
+        with self.lock:
+            if self.cache is None:
+                self.cache = (load_capability_cache() if self.persistent else None) or CapabilityCache()
+            return self.cache.devices.setdefault(get_device_key(modbus_config, unit), DeviceCapabilities())
+
+    def save(self):
+        with self.lock:
+            if self.cache is not None and self.persistent:
+                save_capability_cache(self.cache)
+
+
+def record_response_time(capabilities: DeviceCapabilities, seconds: float):
+    with device_profiles.lock:
+        if capabilities.response_time is None:
+            capabilities.response_time = seconds
+        else:
+            capabilities.response_time += RESPONSE_TIME_SMOOTHING * (seconds - capabilities.response_time)
+        capabilities.max_response_time = max(seconds, capabilities.max_response_time or 0)
+
+
+def record_block_size(capabilities: DeviceCapabilities, command: str, size: int, accepted: bool):
+    with device_profiles.lock:
+        if accepted:
+            capabilities.max_block_size[command] = max(size, capabilities.max_block_size.get(command, 0))
+        elif size < capabilities.rejected_block_size.get(command, size + 1):
+            capabilities.rejected_block_size[command] = size
+
+
+def block_size_limit(capabilities: DeviceCapabilities, command: str, block_size: int) -> int:
+    if (rejected := capabilities.rejected_block_size.get(command)) is not None:
+        return max(1, min(block_size, rejected - 1))
+    return block_size
+
+
+def probe_block_size(capabilities: DeviceCapabilities, command: str) -> int:
+    # Binary search between the largest accepted and the smallest rejected block size
+    rejected = capabilities.rejected_block_size[command]
+    accepted = min(capabilities.max_block_size.get(command, 0), rejected - 1)
+    if accepted == 0:
+        return max(1, rejected // 2)
+    return max(accepted, (accepted + rejected) // 2)
+
+
+def learned_timeout(capabilities: DeviceCapabilities) -> Optional[float]:
+    if capabilities.response_time is None:
+        return None
+    return min(MAX_TIMEOUT, max(MIN_TIMEOUT, 4 * capabilities.response_time, 2 * capabilities.max_response_time))
+
+
+def get_dead_ranges(capabilities: DeviceCapabilities, command: str) -> List[Tuple[int, int]]:
+    with device_profiles.lock:
+        return [(first, last) for first, last in capabilities.dead_ranges.get(command, [])]
+
+
+def update_dead_ranges(capabilities: DeviceCapabilities, command: str, start: int, number: int,
+                       gaps: List[Tuple[int, int]]):
+    # The freshly read span replaces what was known about it, the rest of the address space is kept
+    with device_profiles.lock:
+        replace_dead_ranges(capabilities, command, start, number, gaps)
+
+
+def replace_dead_ranges(capabilities: DeviceCapabilities, command: str, start: int, number: int,
+                        gaps: List[Tuple[int, int]]):
+    end = start + number - 1
+    ranges = []
+    for first, last in capabilities.dead_ranges.get(command, []):
+        if last < start or end < first:
+            ranges.append([first, last])
+            continue
+        if first < start:
+            ranges.append([first, start - 1])
+        if end < last:
+            ranges.append([end + 1, last])
+    ranges += [[first, last] for first, last in gaps]
+    if ranges:
+        capabilities.dead_ranges[command] = merge_ranges(ranges)
+    else:
+        capabilities.dead_ranges.pop(command, None)
+
+
+device_profiles = DeviceProfiles()
@@ -63,7 +63,7 @@ class HeaderMenu:
         self.window.addstr(0, (self.screen.getmaxyx()[1] - len(header))//2, header, self.normal_text)
         helptext = " F1 - Help "
         self.window.addstr(4, self.screen.getmaxyx()[1] - len(helptext) - 3, helptext, self.normal_text)
-        self.window.refresh()
+        self.window.noutrefresh()
 
     def switch_protocol(self):
         if self.configuration.mode == RTU:
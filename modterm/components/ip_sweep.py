@@ -0,0 +1,262 @@
+"""
+ModTerm - Modbus analyser for the terminal
+
+Copyright (C) 2023  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import errno
+import os
+from dataclasses import dataclass
+from ipaddress import ip_address, ip_network
+from typing import FrozenSet, Iterator, Optional, Tuple
+from pymodbus.client import AsyncModbusTcpClient
+from modterm.components.definitions import IpSweepConfig, READ_METHODS
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+CANCEL_POLL_INTERVAL = 0.02
+CONNECT_SCAN_CONCURRENCY = 512
+# Descriptors left to the rest of the process, the terminal, the log and pooled Modbus connections
+RESERVED_DESCRIPTORS = 64
+DEFAULT_DESCRIPTOR_LIMIT = 512
+
+(RESPONDED, NO_MODBUS_RESPONSE, CONNECTION_REFUSED, NO_TCP_RESPONSE) = range(4)
+
+
+def parse_target(target: str, visited: FrozenSet[str] = frozenset()) -> Iterator[str]:
+    # visited holds the resolved paths of the files being read, a file listing itself is a cycle
+    if target.startswith("@"):
+        return iterate_target_file(target[1:], visited)
+    if "/" in target:
+        network = ip_network(target, strict=False)
+        if network.num_addresses == 1:
+            return iter([str(network.network_address)])
+        return (str(address) for address in network.hosts())
+    if "-" in target:
+        first, last = target.split("-", 1)
+        try:
+            first = ip_address(first.strip())
+        except ValueError:
+            # Host names may contain dashes as well
+            return iter([target])
+        last = last.strip()
+        if "." not in last:
+            last = ip_address(".".join(str(first).split(".")[:3] + [last]))
+        else:
+            last = ip_address(last)
+        if int(last) < int(first):
+            raise ValueError(f"{target}: the range ends before it starts")
+        return (str(ip_address(address)) for address in range(int(first), int(last) + 1))
+    return iter([target])
+
+
+def resolve_target_file(file_name: str) -> str:
+    return os.path.realpath(os.path.expanduser(file_name))
+
+
+def iterate_target_file(file_name: str, visited: FrozenSet[str] = frozenset()) -> Iterator[str]:
+    if (path := resolve_target_file(file_name)) in visited:
+        raise ValueError(f"{file_name} refers to itself")
+    with open(path, "r") as target_file:
+        for line in target_file:
+            line = line.split("#", 1)[0].strip()
+            if line:
+                yield from iterate_targets(line, visited | {path})
+
+
+def iterate_targets(targets: str, visited: FrozenSet[str] = frozenset()) -> Iterator[str]:
+    # Targets are comma or whitespace separated CIDR blocks (10.0.0.0/16), ranges (10.0.0.1-10.0.3.254 or
+    # 10.0.0.1-254), single addresses or host names and @file references to files listing any of these.
+    # Addresses are generated as they are consumed, the full target list is never built.
+    for target in targets.replace(",", " ").split():
+        yield from parse_target(target, visited)
+
+
+def validate_targets(targets: str, visited: FrozenSet[str] = frozenset()) -> Optional[str]:
+    items = targets.replace(",", " ").split()
+    if len(items) == 0:
+        return "No targets given"
+    for target in items:
+        if target.startswith("@"):
+            if (error := validate_target_file(target[1:], visited)) is not None:
+                return error
+            continue
+        try:
+            parse_target(target)
+        except ValueError as e:
+            return str(e)
+    return None
+
+
+def validate_target_file(file_name: str, visited: FrozenSet[str] = frozenset()) -> Optional[str]:
+    # Every line is checked before the sweep starts, a bad one would otherwise only surface mid-sweep
+    if not os.path.isfile(os.path.expanduser(file_name)):
+        return f"File {file_name} doesn't exist"
+    if (path := resolve_target_file(file_name)) in visited:
+        return f"{file_name} refers to itself"
+    try:
+        with open(path, "r") as target_file:
+            for line_number, line in enumerate(target_file, start=1):
+                line = line.split("#", 1)[0].strip()
+                if line and (error := validate_targets(line, visited | {path})) is not None:
+                    return f"{file_name}, line {line_number}: {error}"
+    except (OSError, UnicodeDecodeError) as e:
+        return f"Failed to read {file_name}: {e}"
+    return None
+
+
+def descriptor_limit() -> int:
+    # Every connect check and every probe holds a socket, together they must stay below the soft limit of
+    # open files or the scan would report hosts as unreachable when it is the process that ran out
+    if resource is None:
+        return DEFAULT_DESCRIPTOR_LIMIT
+    try:
+        soft_limit, _ = resource.getrlimit(resource.RLIMIT_NOFILE)
+    except (OSError, ValueError):
+        return DEFAULT_DESCRIPTOR_LIMIT
+    if soft_limit == resource.RLIM_INFINITY:
+        return CONNECT_SCAN_CONCURRENCY * 4
+    return max(2, soft_limit - RESERVED_DESCRIPTORS)
+
+
+def split_concurrency(probe_concurrency: int) -> Tuple[int, int]:
+    # Returns the number of connect and probe workers, the probes get at most half of the descriptors
+    available = descriptor_limit()
+    probe_workers = max(1, min(probe_concurrency, available // 2))
+    connect_workers = max(1, min(max(probe_workers, CONNECT_SCAN_CONCURRENCY), available - probe_workers))
+    return connect_workers, probe_workers
+
+
+def sort_key(host: str):
+    try:
+        return 0, int(ip_address(host)), host
+    except ValueError:
+        return 1, 0, host
+
+
+@dataclass
+class SweepResult:
+    ip: str
+    status: int
+    message: str
+
+    @property
+    def responded(self) -> bool:
+        return self.status == RESPONDED
+
+
+async def check_port(ip: str, configuration: IpSweepConfig) -> Optional[SweepResult]:
+    try:
+        _, writer = await asyncio.wait_for(asyncio.open_connection(ip, configuration.port),
+                                           timeout=configuration.timeout)
+    except asyncio.TimeoutError:
+        return SweepResult(ip, NO_TCP_RESPONSE, "No TCP response")
+    except ConnectionRefusedError:
+        return SweepResult(ip, CONNECTION_REFUSED, "TCP connection refused")
+    except OSError as e:
+        if e.errno in (errno.EMFILE, errno.ENFILE):
+            # Out of descriptors says nothing about the host
+            raise
+        return SweepResult(ip, NO_TCP_RESPONSE, f"TCP connection failed: {e.strerror}")
+    writer.close()
+    try:
+        await writer.wait_closed()
+    except OSError:
+        pass
+    return None
+
+
+async def probe_address(ip: str, configuration: IpSweepConfig) -> SweepResult:
+    client = AsyncModbusTcpClient(host=ip,
+                                  port=configuration.port,
+                                  timeout=configuration.timeout,
+                                  retries=0,
+                                  reconnect_delay=0)
+    try:
+        if not await client.connect():
+            return SweepResult(ip, NO_MODBUS_RESPONSE, "TCP open, failed to connect for the Modbus probe")
+        result = await getattr(client, READ_METHODS[configuration.command])(
+            address=configuration.start_register,
+            count=configuration.number_of_registers,
+            slave=configuration.unit_id)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        return SweepResult(ip, NO_MODBUS_RESPONSE, f"TCP open, no Modbus response: {repr(e).strip()}")
+    finally:
+        client.close()
+    if result.isError():
+        return SweepResult(ip, NO_MODBUS_RESPONSE, f"TCP open, no valid Modbus response: {repr(result).strip()}")
+    return SweepResult(ip, RESPONDED, "Valid modbus register response received!")
+
+
+async def sweep_addresses(addresses: Iterator[str],
+                          configuration: IpSweepConfig,
+                          result_callback: callable,
+                          cancel_check: callable) -> bool:
+    # Phase one only opens a TCP connection to every address, phase two sends the configured Modbus read to
+    # the hosts that accepted it. Open hosts are handed over as soon as they are found.
+    open_hosts = asyncio.Queue()
+    connect_concurrency, probe_concurrency = split_concurrency(max(1, configuration.concurrency))
+
+    async def connect_worker():
+        # The iterator is shared, every worker pulls the next address once it is done with the previous one
+        for ip in addresses:
+            if (result := await check_port(ip, configuration)) is None:
+                await open_hosts.put(ip)
+            else:
+                result_callback(result)
+
+    async def connect_scan():
+        try:
+            await asyncio.gather(*(connect_worker() for _ in range(connect_concurrency)))
+        finally:
+            # The probe workers must learn that no more hosts are coming even if the scan failed
+            for _ in range(probe_concurrency):
+                open_hosts.put_nowait(None)
+
+    async def probe_worker():
+        while (ip := await open_hosts.get()) is not None:
+            result_callback(await probe_address(ip, configuration))
+
+    tasks = [asyncio.ensure_future(connect_scan())]
+    tasks += [asyncio.ensure_future(probe_worker()) for _ in range(probe_concurrency)]
+    try:
+        while not all(task.done() for task in tasks):
+            if cancel_check():
+                return False
+            await asyncio.wait(tasks, timeout=CANCEL_POLL_INTERVAL, return_when=asyncio.FIRST_EXCEPTION)
+            for task in tasks:
+                if task.done() and not task.cancelled() and task.exception() is not None:
+                    raise task.exception()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return True
+
+
+def run_sweep(addresses: Iterator[str],
+              configuration: IpSweepConfig,
+              result_callback: callable,
+              cancel_check: callable) -> bool:
+    # Errors of the targets (a file that became unreadable since it was validated) or of the result callback
+    # stop the sweep and are raised here
+    return asyncio.run(sweep_addresses(addresses, configuration, result_callback, cancel_check))
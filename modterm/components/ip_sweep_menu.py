@@ -20,8 +20,8 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 import curses
 from modterm.components.scrollable_list import SelectWindow
 from modterm.components.definitions import HOLDING, INPUT, COIL, DISCRETE
-from modterm.components.hepers import get_text_input, CancelInput, text_input_to_int, text_input_to_float, \
-                                      validate_ip
+from modterm.components.hepers import get_text_input, CancelInput, text_input_to_int, text_input_to_float
+from modterm.components.ip_sweep import validate_targets
 from modterm.components.modbus_handler import ModbusHandler
 from modterm.components.config_handler import load_ip_sweep_config, save_ip_sweep_config
 from modterm.components.menu_base import MenuBase
@@ -36,31 +36,31 @@ class IpSweepMenu(MenuBase):
                                       3: "F3  - Start register: ",
                                       4: "F4  - Number of registers to read: ",
                                       5: "F5  - Unit ID: ",
-                                      6: "F6  - Subnet (first 3 octets): ",
+                                      6: "F6  - Targets: ",
                                       7: "F7  - TCP port: ",
-                                      8: "F8  - Start address: ",
-                                      9: "F9  - End address: ",
-                                      10: "F10 - Timeout: ",
+                                      8: "F8  - Timeout: ",
+                                      9: "F9  - Concurrent probes: ",
+                                      10: "F10 - Only list responders: ",
                                       11: "Start reading, ESC to interrupt the process"},
                          config_values={2: "command",
                                         3: "start_register",
                                         4: "number_of_registers",
                                         5: "unit_id",
-                                        6: "subnet",
+                                        6: "targets",
                                         7: "port",
-                                        8: "start_address",
-                                        9: "end_address",
-                                        10: "timeout",
+                                        8: "timeout",
+                                        9: "concurrency",
+                                        10: "responders_only",
                                         11: ""},
                          interfaces={2: self.switch_command,
                                      3: self.get_start_register,
                                      4: self.get_number_of_registers,
                                      5: self.get_unit_id,
-                                     6: self.get_subnet,
+                                     6: self.get_targets,
                                      7: self.get_port,
-                                     8: self.get_start_address,
-                                     9: self.get_end_address,
-                                     10: self.get_timeout},
+                                     8: self.get_timeout,
+                                     9: self.get_concurrency,
+                                     10: self.swap_responders_only},
                          menu_name="Sweep IP addresses")
 
         self.modbus_handler = ModbusHandler(self.add_status_text)
@@ -127,19 +127,18 @@ class IpSweepMenu(MenuBase):
         else:
             self.configuration.unit = unit_id
 
-    def get_subnet(self, clear=False):
+    def get_targets(self, clear=False):
         try:
-            subnet = get_text_input(self.dialog.window, 16, 6, len(self.menu_labels[6]) + 2,
-                                    str(self.configuration.subnet) if not clear else "")
+            targets = get_text_input(self.dialog.window, self.dialog.width - len(self.menu_labels[6]) - 4, 6,
+                                     len(self.menu_labels[6]) + 2, str(self.configuration.targets) if not clear else "")
         except CancelInput:
-            self.dialog.window.addstr(6, 23, "Cancelled")
             return
-        if not validate_ip(subnet + ".0"):
-            self.dialog.window.addstr(6, 23, "Invalid subnet! Must be the first 3 octets")
+        if (error := validate_targets(targets)) is not None:
+            self.dialog.window.addstr(6, len(self.menu_labels[6]) + 2, f"Invalid targets! {error}"[:self.dialog.width - len(self.menu_labels[6]) - 4])
             self.dialog.window.refresh()
             curses.napms(1500)
         else:
-            self.configuration.subnet = subnet
+            self.configuration.targets = targets
 
     def get_port(self, clear=False):
         try:
@@ -158,69 +157,45 @@ class IpSweepMenu(MenuBase):
         else:
             self.configuration.port = port
 
-    def get_start_address(self, clear=False):
-        try:
-            start_ip = get_text_input(self.dialog.window, 5, 8, len(self.menu_labels[8]) + 2,
-                                           str(self.configuration.start_address) if not clear else "")
-        except CancelInput:
-            return
-        start_ip = text_input_to_int(start_ip)
-        if start_ip is not None:
-            if not 0 < int(start_ip) < 256:
-                start_ip = None
-        if start_ip is not None:
-            if self.configuration.end_address <= start_ip:
-                self.dialog.window.addstr(8, 22, "Must be lower than the end address!")
-                self.dialog.window.refresh()
-                curses.napms(1000)
-                return
-            self.configuration.start_address = start_ip
-            return
-        self.dialog.window.addstr(8, 22, "Invalid address")
-        self.dialog.window.refresh()
-        curses.napms(1000)
-
-    def get_end_address(self, clear=False):
-        try:
-            end_ip = get_text_input(self.dialog.window, 5, 9, len(self.menu_labels[9]) + 2,
-                                          str(self.configuration.end_address) if not clear else "")
-        except CancelInput:
-            return
-        end_ip = text_input_to_int(end_ip)
-        if end_ip is not None:
-            if not 0 < int(end_ip) < 256:
-                end_ip = None
-        if end_ip is not None:
-            if end_ip <= self.configuration.start_address:
-                self.dialog.window.addstr(9, 21, "Must be greater than the start address!")
-                self.dialog.window.refresh()
-                curses.napms(1000)
-                return
-            self.configuration.end_address = end_ip
-            return
-        self.dialog.window.addstr(9, 21, "Invalid address")
-        self.dialog.window.refresh()
-        curses.napms(1000)
-
     def get_timeout(self, clear=False):
         try:
-            timeout = get_text_input(self.dialog.window, 5, 10, len(self.menu_labels[10]) + 2,
+            timeout = get_text_input(self.dialog.window, 5, 8, len(self.menu_labels[8]) + 2,
                                      str(self.configuration.timeout) if not clear else "")
         except CancelInput:
             return
         timeout = text_input_to_float(timeout)
         if timeout is not None:
             if 60 < float(timeout):
-                self.dialog.window.addstr(10, 16, "I don't think you want to wait for that long")
+                self.dialog.window.addstr(8, 16, "I don't think you want to wait for that long")
                 self.dialog.window.refresh()
                 curses.napms(1000)
                 return
             self.configuration.timeout = timeout
             return
-        self.dialog.window.addstr(10, 16, "Invalid timeout value!")
+        self.dialog.window.addstr(8, 16, "Invalid timeout value!")
         self.dialog.window.refresh()
         curses.napms(1000)
 
+    def get_concurrency(self, clear=False):
+        try:
+            concurrency = get_text_input(self.dialog.window, 5, 9, len(self.menu_labels[9]) + 2,
+                                         str(self.configuration.concurrency) if not clear else "")
+        except CancelInput:
+            return
+        concurrency = text_input_to_int(concurrency)
+        if concurrency is not None:
+            if not 1 <= concurrency <= 1024:
+                concurrency = None
+        if concurrency is None:
+            self.dialog.window.addstr(9, 27, "Must be between 1 and 1024")
+            self.dialog.window.refresh()
+            curses.napms(1000)
+        else:
+            self.configuration.concurrency = concurrency
+
+    def swap_responders_only(self, clear=False):
+        self.configuration.responders_only = not self.configuration.responders_only
+
     def action(self):
         save_ip_sweep_config(self.configuration)
-        return self.modbus_handler.ip_sweep(self.screen, self.modbus_config, self.configuration)
+        return self.run_in_background(self.modbus_handler.ip_sweep, self.modbus_config, self.configuration)
@@ -19,12 +19,17 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 
 from typing import Optional
 import curses
+import queue
+import threading
 from functools import partial
 from textwrap import wrap
 from abc import abstractmethod
 from modterm.components.window_base import WindowBase
 from modterm.components.definitions import TableContents
 from modterm.components.help import display_help
+from modterm.components.background_worker import background_worker
+
+UI_POLL_INTERVAL = 20
 
 
 class MenuBase:
@@ -44,6 +49,7 @@ class MenuBase:
         self.start_status_index = max(self.menu_labels.keys()) + 2
         self.status_index = self.start_status_index
         self.failed_action = False
+        self.status_queue = queue.Queue()
 
         self.position = max(self.menu_labels.keys())
 
@@ -62,6 +68,8 @@ class MenuBase:
             curses.KEY_F7: partial(self.jump_to, position=7, execute=True),
             curses.KEY_F8: partial(self.jump_to, position=8, execute=True),
             curses.KEY_F9: partial(self.jump_to, position=9, execute=True),
+            curses.KEY_F10: partial(self.jump_to, position=10, execute=True),
+            curses.KEY_F11: partial(self.jump_to, position=11, execute=True),
             curses.KEY_F1: self.help}
 
         self.help_text_rows = [
@@ -122,6 +130,10 @@ class MenuBase:
         self.dialog.window.refresh()
 
     def add_status_text(self, text, failed=False, highlighted=False):
+        if threading.current_thread() is not threading.main_thread():
+            # Curses is not thread safe, messages of background operations are drawn by run_in_background
+            self.status_queue.put((text, failed, highlighted))
+            return
         if failed:
             self.failed_action = True
         text_lines = wrap(text, self.dialog.width - 4)
@@ -180,6 +192,35 @@ class MenuBase:
             x = self.screen.getch()
         return None
 
+    def process_status_queue(self):
+        while not self.status_queue.empty():
+            self.add_status_text(*self.status_queue.get())
+
+    def run_in_background(self, function: callable, *args, progress: callable = None):
+        # Runs a Modbus operation of self.modbus_handler on the background worker, while the dialog keeps
+        # drawing its status messages. ESC cancels the operation, even in the middle of a request timeout.
+        # A progress callback takes over the screen instead, it gets every other key pressed meanwhile and the
+        # status messages are shown once the operation is over.
+        self.modbus_handler.cancel_event.clear()
+        job = background_worker.submit(function, *args)
+        self.screen.timeout(UI_POLL_INTERVAL)
+        while not job.done.is_set():
+            if progress is None:
+                self.process_status_queue()
+            key = self.screen.getch()
+            if key == 27:
+                if not self.modbus_handler.cancelled():
+                    self.modbus_handler.cancel()
+            elif progress is not None:
+                progress(key)
+        if progress is not None:
+            self.draw(True)
+        self.process_status_queue()
+        self.screen.timeout(-1)
+        if job.error is not None:
+            raise job.error
+        return job.result
+
     @abstractmethod
     def action(self):
         ...
@@ -16,28 +16,97 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
+import select
+import socket
+import struct
+import threading
+import time
 from datetime import datetime
-from typing import Optional, List, Union
-from dataclasses import dataclass
+from typing import Optional, List, Union, Tuple, Dict
+from dataclasses import dataclass, field, replace
 from pymodbus.client import ModbusTcpClient
-from pymodbus.pdu import ExceptionResponse, ModbusExceptions
+from pymodbus.pdu import ExceptionResponse, ModbusExceptions, ModbusResponse
+from pymodbus.register_read_message import ReadHoldingRegistersRequest, ReadInputRegistersRequest
+from pymodbus.bit_read_message import ReadCoilsRequest, ReadDiscreteInputsRequest
 from pymodbus.exceptions import ConnectionException, ModbusIOException
 from pymodbus.client.serial import ModbusSerialClient
 from modterm.components.definitions import HOLDING, INPUT, LittleEndian, ModbusConfig, ReadConfig, WriteConfig, \
-    TableContents, TCP, UnitSweepConfig, COIL, DISCRETE, COIL_WRITE, IpSweepConfig
+    TableContents, TCP, UnitSweepConfig, COIL, DISCRETE, COIL_WRITE, IpSweepConfig, READ_METHODS, DeviceCapabilities, \
+    MAX_BLOCK_SIZES, NEW_SEARCH, RegisterPoint, HOLDING_WRITE, MAX_READ_WRITE_SIZE
 import logging
 from pymodbus import pymodbus_apply_logging_config
-from pymodbus.payload import BinaryPayloadDecoder as Decoder
 from pymodbus.payload import BinaryPayloadBuilder as Builder
+from modterm.components.connection_pool import ConnectionPool, connection_pool
+from modterm.components.register_snapshot import RegisterSnapshot
+from modterm.components import vectorized_decode
+from modterm.components.table_model import LazyRows
+from modterm.components.decoders import decode_value, VALUE_SIZES
+from modterm.components.value_search import ValueIndex, SearchMatch
+from modterm.components.value_tracker import ValueTracker
+from modterm.components.register_map import plan_reads, decode_point, format_value, MAP_HEADER_ROW, FUNCTION_LABELS, \
+    PlannedRead, RegisterMapError
+from modterm.components.bulk_write import WriteEntry, PlannedWrite, WriteResult, RestorePlan, plan_writes, \
+    plan_read_backs, diff_writes, estimate_bus_time, write_row, WRITE_HEADER_ROW, READ_BACK_COMMANDS
+from modterm.components.device_capabilities import device_profiles, learned_timeout, record_response_time, \
+    record_block_size, block_size_limit, probe_block_size, get_dead_ranges, update_dead_ranges, merge_ranges
+from modterm.components.ip_sweep import run_sweep, iterate_targets, sort_key, SweepResult, RESPONDED, NO_MODBUS_RESPONSE, \
+    CONNECTION_REFUSED, NO_TCP_RESPONSE
 
 pymodbus_apply_logging_config(logging.CRITICAL)
 
 
 (INVALID, WORD, DWORD) = range(3)
 
+MBAP_HEADER_LENGTH = 7
+
+PIPELINE_REQUESTS = {
+    HOLDING: ReadHoldingRegistersRequest,
+    INPUT: ReadInputRegistersRequest,
+    COIL: ReadCoilsRequest,
+    DISCRETE: ReadDiscreteInputsRequest
+}
+
 logger = logging.getLogger("ModTerm")
 
 
+def is_illegal_address(result) -> bool:
+    return isinstance(result, ExceptionResponse) and result.exception_code == ModbusExceptions.IllegalAddress
+
+
+def is_illegal_value(result) -> bool:
+    return isinstance(result, ExceptionResponse) and result.exception_code == ModbusExceptions.IllegalValue
+
+
+class PipelineError(Exception):
+    pass
+
+
+class ReadInterrupted(Exception):
+    pass
+
+
+@dataclass
+class ReadProgress:
+    blocks_total: int
+    registers_total: int
+    blocks_done: int = 0
+    registers_done: int = 0
+    ready_blocks: int = 0
+    ready: int = 0
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.registers_done / elapsed if 0 < elapsed else 0
+
+    @property
+    def eta(self) -> Optional[float]:
+        if (rate := self.rate) == 0:
+            return None
+        return (self.registers_total - self.registers_done) / rate
+
+
 @dataclass
 class Header:
     title: str
@@ -76,65 +145,168 @@ for header_def in bits_columns:
     BITS_HEADER_ROW.append("{number: >{align}}".format(number=header_def.title, align=header_def.padding))
 
 
+@dataclass
+class UnitSweepResult:
+    unit: int
+    responded: bool
+    message: str
+
+
+def log_status(text, failed=False, highlighted=False):
+    # Status messages of a handler nobody shows them for
+    if failed:
+        logger.warning(text)
+    else:
+        logger.debug(text)
+
+
 class ModbusHandler:
-    def __init__(self, status_text_callback: callable):
-        self.status_text_callback = status_text_callback
-        self.last_data = []
+    def __init__(self, status_text_callback: Optional[callable] = None, pool: ConnectionPool = connection_pool):
+        self.status_text_callback = status_text_callback if status_text_callback is not None else log_status
+        self.pool = pool
+        self.last_data: Optional[RegisterSnapshot] = None
+        self.last_gaps: List[Tuple[int, int]] = []
         self.last_command = None
+        self.last_read_config: Optional[ReadConfig] = None
+        # Rows of last_data per byte and word order (None for bits), dropped with the data
+        self.decoded_rows: Dict[Optional[Tuple[str, str]], LazyRows] = {}
+        self.value_index: Optional[ValueIndex] = None
+        # Candidates of a value tracking search, kept across the reads of the same range
+        self.tracker: Optional[ValueTracker] = None
+        self.cancel_event = threading.Event()
+        self.active_clients = []
+        self.partial_data: Optional[RegisterSnapshot] = None
+        self.progress: Optional[ReadProgress] = None
+        # Whether the operations write what they learned about the devices to the capability file
+        self.save_profiles = True
+
+    def save_device_profiles(self):
+        if self.save_profiles:
+            device_profiles.save()
 
     def get_client(self,
                    modbus_config: ModbusConfig,
                    timeout: float = None,
                    multicast_enable=False) -> Optional[Union[ModbusTcpClient, ModbusSerialClient]]:
-        if modbus_config.mode == TCP:
-            client = ModbusTcpClient(host=modbus_config.ip,
-                                     port=modbus_config.port,
-                                     timeout=1 if timeout is None else timeout,
-                                     broadcast_enable=multicast_enable)
-        else:
-            client = ModbusSerialClient(port=modbus_config.interface,
-                                        baudrate=modbus_config.baud_rate,
-                                        bytesize=modbus_config.bytesize,
-                                        parity=modbus_config.parity,
-                                        stopbits=modbus_config.stopbits,
-                                        timeout=1 if timeout is None else timeout,
-                                        broadcast_enable=multicast_enable)
-        try:
-            client.connect()
-        except ConnectionException:
+        client = self.pool.acquire(modbus_config, timeout=timeout, multicast_enable=multicast_enable)
+        if client is None:
             self.status_text_callback("Failed to connect", failed=True)
-            return None
+        else:
+            self.active_clients.append(client)
         return client
 
-    def get_data_rows(self, screen, modbus_config: ModbusConfig, read_config: ReadConfig) -> Optional[TableContents]:
-        client = self.get_client(modbus_config)
+    def release_client(self, client: Union[ModbusTcpClient, ModbusSerialClient]):
+        if client in self.active_clients:
+            self.active_clients.remove(client)
+        self.pool.release(client)
+
+    def cancelled(self) -> bool:
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        # Called from the UI thread while an operation runs in the background. Shutting the socket down wakes
+        # up a read blocked in the middle of its timeout, the pool reconnects the next time the client is used.
+        self.cancel_event.set()
+        for client in list(self.active_clients):
+            try:
+                if isinstance(client, ModbusTcpClient):
+                    client.socket.shutdown(socket.SHUT_RDWR)
+                else:
+                    client.socket.cancel_read()
+            except (AttributeError, OSError):
+                pass
+
+    def get_data_rows(self, modbus_config: ModbusConfig, read_config: ReadConfig) -> Optional[TableContents]:
+        if (snapshot := self.read_snapshot(modbus_config, read_config)) is None:
+            return None
+        self.last_data = snapshot
+        self.last_command = read_config.command
+        self.last_read_config = replace(read_config)
+        self.decoded_rows = {}
+        self.value_index = None
+        return self.process_result(modbus_config, read_config)
+
+    def read_snapshot(self, modbus_config: ModbusConfig, read_config: ReadConfig) -> Optional[RegisterSnapshot]:
+        # The registers (or bits) of a read, with what the read taught about the device saved in its profile.
+        # Without capabilities the profile is neither used nor updated.
+        capabilities = device_profiles.get(modbus_config, read_config.unit) if read_config.use_capabilities else None
+        client = self.get_client(modbus_config,
+                                 timeout=learned_timeout(capabilities) if capabilities is not None else None)
         if client is None:
             return None
 
         self.status_text_callback("Starting transaction")
-        if read_config.command == HOLDING:
-            self.last_data = self.get_register_blocks(screen, client.read_holding_registers, read_config)
-        elif read_config.command == INPUT:
-            self.last_data = self.get_register_blocks(screen, client.read_input_registers, read_config)
-        elif read_config.command == DISCRETE:
-            self.last_data = self.get_register_blocks(screen, client.read_discrete_inputs, read_config, bits=True)
-        else:
-            self.last_data = self.get_register_blocks(screen, client.read_coils, read_config, bits=True)
-        self.last_command = read_config.command
-        client.close()
-        return self.process_result(modbus_config, read_config)
+        self.last_gaps = []
+        try:
+            snapshot = self.get_register_blocks(client, read_config, capabilities)
+        finally:
+            self.release_client(client)
+        self.last_gaps = [(first, last) for first, last in merge_ranges([list(gap) for gap in self.last_gaps])]
+        if capabilities is not None:
+            if read_config.adaptive_split:
+                update_dead_ranges(capabilities, read_config.command, read_config.start, len(snapshot),
+                                   self.last_gaps)
+            self.save_device_profiles()
+        return snapshot
+
+    def poll(self, modbus_config: ModbusConfig, read_config: ReadConfig) -> Optional[RegisterSnapshot]:
+        # One read of a monitored range. Unlike get_data_rows, it leaves the last result and the device profile alone.
+        capabilities = device_profiles.get(modbus_config, read_config.unit) if read_config.use_capabilities else None
+        client = self.get_client(modbus_config,
+                                 timeout=learned_timeout(capabilities) if capabilities is not None else None)
+        if client is None:
+            return None
+        self.last_gaps = []
+        try:
+            return self.get_register_blocks(client, read_config, capabilities)
+        finally:
+            self.release_client(client)
+
+    def show_snapshot(self, modbus_config: ModbusConfig, snapshot: RegisterSnapshot) -> Optional[TableContents]:
+        # Makes a polled snapshot the last result, with the read config of the last read
+        self.last_data = snapshot
+        self.decoded_rows = {}
+        self.value_index = None
+        return self.process_result(modbus_config)
 
     def process_words(self, modbus_config: ModbusConfig, read_config: ReadConfig) -> TableContents:
+        order = (modbus_config.byte_order, modbus_config.word_order)
+        if (return_rows := self.decoded_rows.get(order)) is None:
+            data, start = self.last_data, read_config.start
+            config = replace(modbus_config)
+            return_rows = LazyRows(len(data), lambda begin, end: self.word_rows(data, config, start, begin, end))
+            self.decoded_rows[order] = return_rows
+        date = datetime.fromtimestamp(self.last_data.finished).strftime("%H:%M:%S")
+        read_type = "Holding" if read_config.command == HOLDING else "Input"
+        source = self.describe_source(modbus_config, read_config.unit)
+
+        return TableContents(header=WORDS_HEADER_ROW,
+                             rows=return_rows,
+                             title=f"{date} - {read_type} registers {read_config.start} -> {read_config.start + read_config.number} from {source}",)
+
+    @staticmethod
+    def describe_source(modbus_config: ModbusConfig, unit: int) -> str:
+        if modbus_config.mode == TCP:
+            return f"{modbus_config.ip}:{modbus_config.port} unit: {unit}"
+        return f"{modbus_config.interface}:{modbus_config.baud_rate}/{modbus_config.bytesize}{modbus_config.parity}{modbus_config.stopbits} unit {unit}"
+
+    @staticmethod
+    def word_rows(data: RegisterSnapshot, modbus_config: ModbusConfig, start_reg: int, begin: int,
+                  end: int) -> List[List[str]]:
+        if vectorized_decode.is_available() and vectorized_decode.MIN_ROWS <= end - begin:
+            return vectorized_decode.word_rows(data, modbus_config.byte_order, modbus_config.word_order, start_reg,
+                                               begin, end)
         return_rows = []
-        start_reg = read_config.start
-        for idx, register in enumerate(self.last_data):
+        for idx in range(begin, end):
+            register = data[idx]
             is_word = bool(register is not None)
-            is_dword = bool(len(self.last_data) > idx + 1 and self.last_data[idx+1] is not None)
+            is_dword = bool(len(data) > idx + 1 and data[idx+1] is not None)
             return_row = []
             if is_word:
-                decoder = Decoder.fromRegisters(self.last_data[idx:idx + 2] if is_dword else self.last_data[idx:idx + 1],
-                                                byteorder="<" if modbus_config.byte_order == LittleEndian else ">",
-                                                wordorder="<" if modbus_config.word_order == LittleEndian else ">")
+                words = [register, data[idx + 1]] if is_dword else [register]
+                values = {value_type: decode_value(words, value_type, modbus_config.byte_order,
+                                                   modbus_config.word_order)
+                          for value_type in (VALUE_SIZES if is_dword else ("U16", "I16"))}
 
             for header in word_columns:
                 if header.title == "Idx":
@@ -155,33 +327,18 @@ class ModbusHandler:
                 if header.title == "HexV":
                     return_row.append("{num: >{padding}X}".format(num=register, padding=header.padding))
                     continue
-                if header.title == "U16":
-                    decoder.reset()
-                    return_row.append("{num: >{padding}}".format(num=decoder.decode_16bit_uint(),
-                                                                 padding=header.padding))
-                    continue
-                if header.title == "I16":
-                    decoder.reset()
-                    return_row.append("{num: >{padding}}".format(num=decoder.decode_16bit_int(),
-                                                                 padding=header.padding))
+                if header.title in ("U16", "I16"):
+                    return_row.append("{num: >{padding}}".format(num=values[header.title], padding=header.padding))
                     continue
                 if not is_dword and header.title not in ("St", "Bits"):
                     return_row.append("{text: >{padding}}".format(text="--", padding=header.padding))
                     continue
 
-                if header.title == "U32":
-                    decoder.reset()
-                    return_row.append("{num: >{padding}}".format(num=decoder.decode_32bit_uint(),
-                                                                 padding=header.padding))
-                    continue
-                if header.title == "I32":
-                    decoder.reset()
-                    return_row.append("{num: >{padding}}".format(num=decoder.decode_32bit_int(),
-                                                                 padding=header.padding))
+                if header.title in ("U32", "I32"):
+                    return_row.append("{num: >{padding}}".format(num=values[header.title], padding=header.padding))
                     continue
                 if header.title == "F32":
-                    decoder.reset()
-                    number = decoder.decode_32bit_float()
+                    number = values["F32"]
                     number_string = "{0:0.3f}".format(number)
                     if len(str(number_string)) > 11:
                         number_string = "{0:0.5e}".format(number)
@@ -201,26 +358,33 @@ class ModbusHandler:
                     continue
 
                 if header.title == "Bits":
-                    decoder.reset()
-                    bits = "{0:016b}".format(decoder.decode_16bit_uint())
+                    bits = "{0:016b}".format(values["U16"])
                     return_row.append(f"{bits[0:4]} {bits[4:8]} {bits[8:12]} {bits[12:16]}")
                     continue
             return_rows.append(return_row)
-        date = datetime.now().strftime("%H:%M:%S")
-        read_type = "Holding" if read_config.command == HOLDING else "Input"
+        return return_rows
+
+    def process_bits(self, modbus_config: ModbusConfig, read_config: ReadConfig):
+        if (return_rows := self.decoded_rows.get(None)) is None:
+            data, start = self.last_data, read_config.start
+            return_rows = LazyRows(len(data), lambda begin, end: self.bit_rows(data, start, begin, end))
+            self.decoded_rows[None] = return_rows
+        date = datetime.fromtimestamp(self.last_data.finished).strftime("%H:%M:%S")
+        read_type = "Coils" if read_config.command == COIL else "Discrete inputs"
         if modbus_config.mode == TCP:
             source = f"{modbus_config.ip}:{modbus_config.port} unit: {read_config.unit}"
         else:
-            source = f"{modbus_config.interface}:{modbus_config.baud_rate}/{modbus_config.bytesize}{modbus_config.parity}{modbus_config.stopbits} unit {read_config.unit}"
-
-        return TableContents(header=WORDS_HEADER_ROW,
+            source = f"{modbus_config.interface}:{modbus_config.baud_rate}-{modbus_config.bytesize}{modbus_config.parity}{modbus_config.stopbits} unit {read_config.unit}"
+        return TableContents(header=BITS_HEADER_ROW,
                              rows=return_rows,
-                             title=f"{date} - {read_type} registers {read_config.start} -> {read_config.start + read_config.number} from {source}",)
+                             title=f"{date} - {read_type} {read_config.start} -> {read_config.start + read_config.number} from {source}",)
 
-    def process_bits(self, modbus_config: ModbusConfig, read_config: ReadConfig):
+    @staticmethod
+    def bit_rows(data: RegisterSnapshot, start_bit: int, begin: int,
+                 end: int) -> List[List[str]]:
         return_rows = []
-        start_bit = read_config.start
-        for idx, bit in enumerate(self.last_data):
+        for idx in range(begin, end):
+            bit = data[idx]
             return_row = []
             for header in bits_columns:
                 if header.title == "Idx":
@@ -243,19 +407,14 @@ class ModbusHandler:
                     return_row.append("{num: >{padding}}".format(num=str(int(bit)) if bit is not None else "-", padding=header.padding))
                     continue
             return_rows.append(return_row)
-        date = datetime.now().strftime("%H:%M:%S")
-        read_type = "Coils" if read_config.command == COIL else "Discrete inputs"
-        if modbus_config.mode == TCP:
-            source = f"{modbus_config.ip}:{modbus_config.port} unit: {read_config.unit}"
-        else:
-            source = f"{modbus_config.interface}:{modbus_config.baud_rate}-{modbus_config.bytesize}{modbus_config.parity}{modbus_config.stopbits} unit {read_config.unit}"
-        return TableContents(header=BITS_HEADER_ROW,
-                             rows=return_rows,
-                             title=f"{date} - {read_type} {read_config.start} -> {read_config.start + read_config.number} from {source}",)
+        return return_rows
 
-    def process_result(self, modbus_config: ModbusConfig, read_config: ReadConfig) -> Optional[TableContents]:
-        if self.last_data == [] or self.last_command is None:
+    def process_result(self, modbus_config: ModbusConfig,
+                       read_config: Optional[ReadConfig] = None) -> Optional[TableContents]:
+        if self.last_data is None or len(self.last_data) == 0 or self.last_command is None:
             return None
+        if read_config is None:
+            read_config = self.last_read_config
         if self.last_command == INPUT or self.last_command == HOLDING:
             try:
                 return self.process_words(modbus_config, read_config)
@@ -267,62 +426,369 @@ class ModbusHandler:
             except Exception:
                 logger.critical("Failed to process bits", exc_info=True)
 
-    def read_registers(self, command: callable, address: int, count: int, slave: int, bits:bool = False) -> List[Optional[int]]:
+    def search_values(self, low: float, high: float) -> Optional[List[SearchMatch]]:
+        if self.last_data is None or self.last_data.is_bits:
+            self.status_text_callback("Only register tables can be searched", failed=True)
+            return None
+        if self.value_index is None:
+            self.value_index = ValueIndex(self.last_data)
+        matches, total = self.value_index.search(low, high)
+        if total == 0:
+            self.status_text_callback("No matching values", failed=True)
+            return None
+        if len(matches) < total:
+            self.status_text_callback(f"{total} matches, showing the first {len(matches)}")
+        else:
+            self.status_text_callback(f"{total} matches")
+        return matches
+
+    def track_values(self, modbus_config: ModbusConfig, condition: str, low: float = 0,
+                     high: float = 0) -> Optional[TableContents]:
+        # Reads the range of the last read again and narrows the tracked candidates down with it
+        if self.last_data is None or self.last_data.is_bits:
+            self.status_text_callback("Only register reads can be tracked", failed=True)
+            return None
+        if self.get_data_rows(modbus_config, self.last_read_config) is None or self.cancelled():
+            return None
+        if condition == NEW_SEARCH or self.tracker is None or not self.tracker.same_range(self.last_data):
+            if condition != NEW_SEARCH:
+                self.status_text_callback("No tracked reads of this range yet, starting a new search")
+            self.tracker = ValueTracker(self.last_data)
+        else:
+            self.tracker.narrow(self.last_data, condition, low, high)
+        self.status_text_callback(f"{len(self.tracker)} candidates after {self.tracker.reads} reads")
+        read_type = "holding" if self.last_read_config.command == HOLDING else "input"
+        return self.tracker.get_table(f"Tracking {read_type} registers {self.last_read_config.start} -> "
+                                      f"{self.last_read_config.start + self.last_read_config.number}: "
+                                      f"{len(self.tracker)} candidates after {self.tracker.reads} reads")
+
+    def read_register_map(self, modbus_config: ModbusConfig, points: List[RegisterPoint], unit: int,
+                          map_name: str = "map") -> Optional[TableContents]:
+        reads = plan_reads(points, device_profiles.get(modbus_config, unit))
+        self.status_text_callback(f"Reading {len(points)} points in {len(reads)} requests")
+        if (values := self.read_points(modbus_config, points, unit, reads)) is None:
+            return None
+        if (failed := sum(1 for value in values if value is None)) != 0:
+            self.status_text_callback(f"{failed} points could not be read", failed=True)
+        rows = [["{: <24}".format(point.name[:24]),
+                 "{: >6}".format(point.address),
+                 "{: >5X}".format(point.address),
+                 "{: >8}".format(FUNCTION_LABELS[point.command]),
+                 "{: >4}".format(point.type),
+                 "{: >16}".format(format_value(point, value))] for point, value in zip(points, values)]
+        date = datetime.now().strftime("%H:%M:%S")
+        return TableContents(header=MAP_HEADER_ROW, rows=rows,
+                             title=f"{date} - {len(points)} points of {map_name} in {len(reads)} requests "
+                                   f"from {self.describe_source(modbus_config, unit)}")
+
+    def read_points(self, modbus_config: ModbusConfig, points: List[RegisterPoint], unit: int,
+                    reads: Optional[List[PlannedRead]] = None) -> Optional[List[Optional[Union[float, bool]]]]:
+        # Reads the points of a register map with as few requests as the planner can manage, each point is
+        # decoded as its own type, in its own byte and word order. The values are in the order of the points.
+        capabilities = device_profiles.get(modbus_config, unit)
+        if reads is None:
+            reads = plan_reads(points, capabilities)
+        client = self.get_client(modbus_config, timeout=learned_timeout(capabilities))
+        if client is None:
+            return None
+        values = {}
+        try:
+            for planned in reads:
+                self.last_gaps = []
+                read_config = ReadConfig(command=planned.command, start=planned.start, number=planned.number,
+                                         unit=unit, block_size=planned.number)
+                snapshot = self.get_register_blocks(client, read_config, capabilities)
+                update_dead_ranges(capabilities, planned.command, planned.start, len(snapshot),
+                                   [(first, last) for first, last in merge_ranges([list(gap) for gap in self.last_gaps])])
+                for point in planned.points:
+                    offset = point.address - planned.start
+                    values[id(point)] = decode_point(point, snapshot[offset:offset + point.size],
+                                                     modbus_config.byte_order, modbus_config.word_order)
+                if self.cancelled():
+                    return None
+        finally:
+            self.release_client(client)
+        self.save_device_profiles()
+        return [values[id(point)] for point in points]
+
+    def read_registers(self, command: callable, address: int, count: int, slave: int, bits: bool = False,
+                       adaptive: bool = False, capabilities: Optional[DeviceCapabilities] = None,
+                       read_command: str = None) -> List[Optional[int]]:
+        if self.cancelled():
+            return [None] * count
+        # Capabilities are learned per read command, read_command must be given with them
+        if adaptive and capabilities is not None and 1 < count and \
+                capabilities.rejected_block_size.get(read_command, count + 1) <= count:
+            values = []
+            offset = 0
+            while offset < count:
+                chunk = min(count - offset, probe_block_size(capabilities, read_command))
+                values += self.read_registers(command, address + offset, chunk, slave, bits, adaptive, capabilities,
+                                              read_command)
+                offset += chunk
+            return values
+        request_start = time.monotonic()
         try:
             result = command(address=address, count=count, slave=slave)
         except ConnectionException as e:
-            self.status_text_callback(f"Failed to connect: {repr(e)}", failed=True)
+            if not self.cancelled():
+                self.status_text_callback(f"Failed to connect: {repr(e)}", failed=True)
             return [None] * count
         if result.isError():
+            if self.cancelled():
+                return [None] * count
+            if adaptive and 1 < count and is_illegal_value(result):
+                self.status_text_callback(f"Block of {count} rejected by {slave} at {address}, retrying in smaller blocks")
+                half = count // 2
+                values = self.read_registers(command, address, half, slave, bits, adaptive, capabilities,
+                                             read_command) + \
+                    self.read_registers(command, address + half, count - half, slave, bits, adaptive, capabilities,
+                                        read_command)
+                # ILLEGAL DATA VALUE may have nothing to do with the size of the block, it is only learned as the
+                # device's limit once the same registers were read in smaller blocks
+                if capabilities is not None and all(value is not None for value in values):
+                    record_block_size(capabilities, read_command, count, accepted=False)
+                return values
+            if adaptive and 1 < count and is_illegal_address(result):
+                self.status_text_callback(f"Illegal address in {slave}, {address}, {count}, mapping readable registers")
+                return self.map_readable_registers(command, address, count, slave, bits)
             self.status_text_callback(f"Failed to read {slave}, {address}, {count}, {result}", failed=True)
             return [None] * count
+        if capabilities is not None:
+            record_response_time(capabilities, time.monotonic() - request_start)
+            record_block_size(capabilities, read_command, count, accepted=True)
         self.status_text_callback(f"Successfully read {slave}, {address}, {count}")
         if not bits:
             return result.registers
         return result.bits[:count]
 
-    def get_register_blocks(self, screen, command: callable, read_config: ReadConfig, bits: bool = False) -> List[Optional[int]]:
-        if read_config.number <= read_config.block_size:
-            return self.read_registers(command,
-                                       address=read_config.start,
-                                       count=read_config.number,
-                                       slave=read_config.unit,
-                                       bits=bits)
-        regs_to_return = []
-        start = read_config.start
-        count = read_config.number
-        number = read_config.block_size
-        count -= read_config.block_size
-        screen.nodelay(True)
-        while True:
-            regs = self.read_registers(command, address=start, count=number, slave=read_config.unit, bits=bits)
-            key = screen.getch()
-            if key == 27:
-                self.status_text_callback("Interrupted!", failed=True)
-                return regs_to_return
-            if regs is None:
-                regs_to_return += [None] * number
+    def map_readable_registers(self, command: callable, address: int, count: int, slave: int,
+                               bits: bool = False) -> List[Optional[int]]:
+        # Recovers the readable registers of a block rejected with ILLEGAL DATA ADDRESS. The longest readable
+        # prefix is found by binary search, then the unreadable registers following it are confirmed one by one
+        # until a readable one turns up, and the rest of the block is tried in one go again.
+        values = [None] * count
+
+        def try_read(offset: int, number: int) -> Optional[bool]:
+            try:
+                result = command(address=address + offset, count=number, slave=slave)
+            except ConnectionException:
+                return None
+            if result.isError():
+                return False if is_illegal_address(result) else None
+            values[offset:offset + number] = result.bits[:number] if bits else result.registers
+            return True
+
+        offset = 0
+        remainder_failed = True
+        while offset < count:
+            if not remainder_failed:
+                if (success := try_read(offset, count - offset)) is None:
+                    break
+                if success:
+                    break
+            readable, failing = 0, count - offset
+            while 1 < failing - readable:
+                middle = (readable + failing) // 2
+                if (success := try_read(offset, middle)) is None:
+                    return values
+                if success:
+                    readable = middle
+                else:
+                    failing = middle
+            offset += readable
+            gap_start = address + offset
+            offset += 1
+            while offset < count:
+                if (success := try_read(offset, 1)) is None:
+                    return values
+                if success:
+                    break
+                offset += 1
+            self.add_gap(gap_start, address + offset - 1)
+            self.status_text_callback(f"Unreadable registers: {gap_start} -> {address + offset - 1}")
+            offset += 1
+            remainder_failed = False
+        return values
+
+    def add_gap(self, first: int, last: int):
+        self.last_gaps.append((first, last))
+
+    @staticmethod
+    def split_blocks(start: int, number: int, block_size: int,
+                     skip: List[Tuple[int, int]] = ()) -> List[Tuple[int, int]]:
+        end = start + number
+        live_ranges = []
+        address = start
+        for first, last in sorted(skip):
+            if last < address or end <= first:
                 continue
+            if address < first:
+                live_ranges.append((address, first))
+            address = last + 1
+        if address < end:
+            live_ranges.append((address, end))
+        blocks = []
+        for live_start, live_end in live_ranges:
+            for block_start in range(live_start, live_end, block_size):
+                blocks.append((block_start, min(block_size, live_end - block_start)))
+        return blocks
+
+    def get_register_blocks(self, client: Union[ModbusTcpClient, ModbusSerialClient], read_config: ReadConfig,
+                            capabilities: Optional[DeviceCapabilities] = None) -> RegisterSnapshot:
+        command = getattr(client, READ_METHODS[read_config.command])
+        bits = read_config.command in (COIL, DISCRETE)
+        block_size = min(read_config.block_size, MAX_BLOCK_SIZES[read_config.command])
+        skip = []
+        if capabilities is not None and read_config.use_capabilities:
+            block_size = block_size_limit(capabilities, read_config.command, block_size)
+            skip = get_dead_ranges(capabilities, read_config.command)
+            for first, last in skip:
+                if read_config.start <= last and first < read_config.start + read_config.number:
+                    self.add_gap(max(first, read_config.start), min(last, read_config.start + read_config.number - 1))
+        blocks = self.split_blocks(read_config.start, read_config.number, block_size, skip)
+        results = {}
+        self.partial_data = RegisterSnapshot(read_config.command, read_config.start, read_config.number)
+        self.progress = ReadProgress(blocks_total=len(blocks), registers_total=sum(count for _, count in blocks))
+        pipelining = 1 < read_config.pipeline_depth and 1 < len(blocks) and isinstance(client, ModbusTcpClient)
+        if pipelining and capabilities is not None and read_config.use_capabilities and capabilities.pipelining is False:
+            self.status_text_callback("Device is known not to handle pipelined requests, reading sequentially")
+            pipelining = False
+        if pipelining:
+            try:
+                self.read_blocks_pipelined(client, read_config, blocks, results)
+            except ReadInterrupted:
+                self.status_text_callback("Interrupted!", failed=True)
+                return self.finish_snapshot(read_config.start, blocks, results)
+            except PipelineError as e:
+                if self.cancelled():
+                    self.status_text_callback("Interrupted!", failed=True)
+                    return self.finish_snapshot(read_config.start, blocks, results)
+                logger.info(f"Pipelined read failed, falling back to sequential reads: {e}")
+                self.status_text_callback(f"Pipelined read failed ({e}), falling back to sequential reads")
+                if capabilities is not None:
+                    capabilities.pipelining = False
+                # Responses of the abandoned requests may still be on their way, start over on a clean connection
+                client.close()
             else:
-                regs_to_return += regs
-            if count == 0:
-                return regs_to_return
-            if read_config.block_size < count:
-                start += number
-                number = read_config.block_size
-                count -= read_config.block_size
+                if capabilities is not None:
+                    capabilities.pipelining = True
+        for block in blocks:
+            if block in results:
+                continue
+            start, count = block
+            results[block] = self.read_registers(command, address=start, count=count, slave=read_config.unit, bits=bits,
+                                                 adaptive=read_config.adaptive_split, capabilities=capabilities,
+                                                 read_command=read_config.command)
+            self.block_done(read_config.start, blocks, results, block)
+            if self.cancelled():
+                self.status_text_callback("Interrupted!", failed=True)
+                break
+        return self.finish_snapshot(read_config.start, blocks, results)
+
+    def block_done(self, start: int, blocks: List[Tuple[int, int]], results: dict, block: Tuple[int, int]):
+        # Publishes a finished block for the progressive view, which shows rows up to the first missing block.
+        # Devices answering with more registers than asked for are cut down to the block.
+        results[block] = results[block][:block[1]]
+        self.partial_data.set_range(block[0] - start, results[block])
+        progress = self.progress
+        progress.blocks_done += 1
+        progress.registers_done += block[1]
+        while progress.ready_blocks < len(blocks) and blocks[progress.ready_blocks] in results:
+            progress.ready_blocks += 1
+        if progress.ready_blocks < len(blocks):
+            progress.ready = blocks[progress.ready_blocks][0] - start
+        else:
+            progress.ready = len(self.partial_data)
+
+    def finish_snapshot(self, start: int, blocks: List[Tuple[int, int]], results: dict) -> RegisterSnapshot:
+        # An interrupted read keeps the registers up to the first block missing
+        snapshot = self.partial_data
+        for block in blocks:
+            if block not in results:
+                snapshot = snapshot[:block[0] - start]
+                break
+        snapshot.finished = time.time()
+        return snapshot
+
+    def read_blocks_pipelined(self, client: ModbusTcpClient, read_config: ReadConfig,
+                              blocks: List[Tuple[int, int]], results: dict):
+        # Keeps up to pipeline_depth requests in flight on the connection, the responses are matched to their
+        # blocks by the MBAP transaction ID, so devices may answer them in any order.
+        if not client.connect():
+            raise PipelineError("not connected")
+        request_class = PIPELINE_REQUESTS[read_config.command]
+        bits = read_config.command in (COIL, DISCRETE)
+        pending = {}
+        to_send = iter(blocks)
+        next_block = next(to_send, None)
+        while next_block is not None or pending:
+            while next_block is not None and len(pending) < read_config.pipeline_depth:
+                request = request_class(next_block[0], next_block[1], slave=read_config.unit)
+                request.transaction_id = client.transaction.getNextTID()
+                try:
+                    client.socket.sendall(client.framer.buildPacket(request))
+                except OSError as e:
+                    raise PipelineError(f"failed to send: {e}")
+                pending[request.transaction_id] = next_block
+                next_block = next(to_send, None)
+            transaction_id, response = self.receive_response(client)
+            if (block := pending.pop(transaction_id, None)) is None:
+                raise PipelineError(f"unexpected transaction ID {transaction_id}")
+            start, count = block
+            if read_config.adaptive_split and 1 < count and (is_illegal_address(response) or is_illegal_value(response)):
+                # Left for the sequential pass, which maps the readable part of the block
+                pass
+            elif response is None or response.isError():
+                self.status_text_callback(f"Failed to read {read_config.unit}, {start}, {count}, {response}", failed=True)
+                results[block] = [None] * count
+                self.block_done(read_config.start, blocks, results, block)
             else:
-                start += number
-                number = count
-                count = 0
+                self.status_text_callback(f"Successfully read {read_config.unit}, {start}, {count}")
+                results[block] = response.bits[:count] if bits else response.registers
+                self.block_done(read_config.start, blocks, results, block)
+            if self.cancelled():
+                raise ReadInterrupted
+
+    @staticmethod
+    def receive_response(client: ModbusTcpClient) -> Tuple[int, Optional[ModbusResponse]]:
+        def receive(size: int) -> bytes:
+            data = b""
+            deadline = time.monotonic() + client.comm_params.timeout_connect
+            while len(data) < size:
+                if (remaining := deadline - time.monotonic()) <= 0 or \
+                        not select.select([client.socket], [], [], remaining)[0]:
+                    raise PipelineError("no response")
+                try:
+                    chunk = client.socket.recv(size - len(data))
+                except OSError as e:
+                    raise PipelineError(f"connection error: {e}")
+                if chunk == b"":
+                    raise PipelineError("connection closed by the device")
+                data += chunk
+            return data
+
+        transaction_id, _, length, _ = struct.unpack(">HHHB", receive(MBAP_HEADER_LENGTH))
+        if length < 2:
+            raise PipelineError("malformed response")
+        return transaction_id, client.framer.decoder.decode(receive(length - 1))
 
-    def write_registers(self, modbus_config: ModbusConfig, write_config: WriteConfig, format_mapping: dict):
+    def write_registers(self, modbus_config: ModbusConfig, write_config: WriteConfig,
+                        format_mapping: dict) -> Optional[WriteResult]:
+        # The result of the write, None if there was no connection to write on
         unit_id = 0 if write_config.multicast else write_config.unit
+        command = COIL_WRITE if write_config.command == COIL_WRITE else HOLDING_WRITE
+        address = int(write_config.address)
+
+        def failure(message: str, number: int = 1) -> WriteResult:
+            self.status_text_callback(message, failed=True)
+            return WriteResult(command, address, number, False, message)
 
         client = self.get_client(modbus_config,
                                  multicast_enable=write_config.multicast)
         if client is None:
             return None
+        registers = None
         if write_config.command != COIL_WRITE:
             format = format_mapping[write_config.format]
             encoder = Builder(wordorder="<" if modbus_config.word_order == LittleEndian else ">",
@@ -331,45 +797,338 @@ class ModbusHandler:
             try:
                 encode_call(write_config.value)
             except Exception as e:
-                self.status_text_callback(f"Failed to encode value! {repr(e)}", failed=True)
-                client.close()
-                return
+                self.release_client(client)
+                return failure(f"Failed to encode value! {repr(e)}")
+            registers = encoder.to_registers()
+        if write_config.verify and not write_config.multicast:
+            return self.write_verified(modbus_config, client, write_config, registers)
+        number = 1 if registers is None else len(registers)
         try:
             if write_config.command == COIL_WRITE:
                 try:
                     value = bool(int(write_config.value))
                 except Exception as e:
-                    self.status_text_callback(f"Failed to convert coil value: {e}", failed=True)
-                    client.close()
-                    return
-                result = (client.write_coil(address=int(write_config.address),
+                    return failure(f"Failed to convert coil value: {e}")
+                result = (client.write_coil(address=address,
                                             value=value,
                                             slave=unit_id))
             else:
-                result = client.write_registers(address=int(write_config.address),
-                                                values=encoder.to_registers(),
+                result = client.write_registers(address=address,
+                                                values=registers,
                                                 slave=unit_id)
         except Exception as e:
             logger.critical("Failed to write registers", exc_info=True)
-            self.status_text_callback(f"Failed to write register: {e}", failed=True)
-            client.close()
-            return
+            return failure(f"Failed to write register: {e}", number)
+        finally:
+            self.release_client(client)
         if write_config.multicast:
             self.status_text_callback("Multicast message sent with unit ID 0, no response expected")
-            client.close()
-            return
+            if write_config.verify:
+                self.status_text_callback("Multicast writes are not read back")
+            return WriteResult(command, address, number, True, "Sent, no response expected")
         if hasattr(result, "isError") and result.isError():
-            self.status_text_callback(f"Failed to write register: {result}", failed=True)
+            return failure(f"Failed to write register: {result}", number)
+        self.status_text_callback(f"Register(s) successfully written")
+        return WriteResult(command, address, number, True, "OK")
+
+    def bulk_write(self, modbus_config: ModbusConfig, entries: List[WriteEntry], unit: int, file_name: str = "file",
+                   verify: bool = False, row_callback: Optional[callable] = None) -> Optional[TableContents]:
+        # The row callback gets the row of every request as soon as it is answered, on the thread of the writes
+        read_write = verify and device_profiles.get(modbus_config, unit).read_write is not False
+        try:
+            writes = plan_writes(entries, modbus_config.byte_order, modbus_config.word_order, read_write)
+        except RegisterMapError as e:
+            self.status_text_callback(str(e), failed=True)
+            return None
+        self.status_text_callback(f"Writing {len(entries)} values in {len(writes)} requests")
+        to_return = TableContents(header=WRITE_HEADER_ROW, rows=[])
+
+        def add_result(planned: PlannedWrite, result: WriteResult):
+            row = write_row(planned, result)
+            to_return.rows.append(row)
+            if row_callback is not None:
+                row_callback(row)
+
+        if (results := self.write_many(modbus_config, writes, unit, add_result, verify)) is None:
+            return None
+        if (failed := sum(1 for result in results if not result.success)) != 0:
+            self.status_text_callback(f"{failed} of {len(writes)} requests failed", failed=True)
+        date = datetime.now().strftime("%H:%M:%S")
+        to_return.title = f"{date} - {len(entries)} values of {file_name} in {len(writes)} requests " \
+                          f"to {self.describe_source(modbus_config, unit)}"
+        return to_return
+
+    def write_verified(self, modbus_config: ModbusConfig, client: Union[ModbusTcpClient, ModbusSerialClient],
+                       write_config: WriteConfig, registers: Optional[List[int]]) -> WriteResult:
+        # A write of the write dialog read back on the same connection, with FC23 where the device takes it. The
+        # client is released.
+        try:
+            if write_config.command == COIL_WRITE:
+                try:
+                    values = [bool(int(write_config.value))]
+                except Exception as e:
+                    self.status_text_callback(f"Failed to convert coil value: {e}", failed=True)
+                    return WriteResult(COIL_WRITE, int(write_config.address), 1, False,
+                                       f"Failed to convert coil value: {e}")
+            else:
+                values = registers
+            planned = PlannedWrite(command=COIL_WRITE if write_config.command == COIL_WRITE else HOLDING_WRITE,
+                                   start=int(write_config.address), values=values)
+            capabilities = device_profiles.get(modbus_config, write_config.unit)
+            if write_config.command == COIL_WRITE:
+                # Still FC05 as without the read back, a device taking only that must not fail because of it
+                results = [self.write_block(client, planned, write_config.unit, single_coil=True)]
+                if results[0].success:
+                    self.read_back(client, [planned], results, [0], write_config.unit, capabilities)
+                result = results[0]
+            else:
+                result = self.send_writes(client, [planned], write_config.unit, verify=True,
+                                          capabilities=capabilities)[0]
+        finally:
+            self.release_client(client)
+        self.save_device_profiles()
+        if result.success:
+            self.status_text_callback("Register(s) successfully written and read back")
+        return result
+
+    def write_many(self, modbus_config: ModbusConfig, writes: List[PlannedWrite], unit: int,
+                   result_callback: Optional[callable] = None, verify: bool = False) -> Optional[List[WriteResult]]:
+        # Sends the planned requests over one connection, in order. None if there was no connection to write on.
+        capabilities = device_profiles.get(modbus_config, unit)
+        client = self.get_client(modbus_config, multicast_enable=unit == 0)
+        if client is None:
+            return None
+        try:
+            results = self.send_writes(client, writes, unit, result_callback, verify, capabilities)
+        finally:
+            self.release_client(client)
+        if self.cancelled():
+            self.status_text_callback("Interrupted!", failed=True)
+        self.save_device_profiles()
+        return results
+
+    def send_writes(self, client: Union[ModbusTcpClient, ModbusSerialClient], writes: List[PlannedWrite], unit: int,
+                    result_callback: Optional[callable] = None, verify: bool = False,
+                    capabilities: Optional[DeviceCapabilities] = None) -> List[WriteResult]:
+        # The callback gets every request with its result, as soon as it is final. Once the connection is lost or
+        # the process is interrupted, the rest are not sent but still get a result.
+        # Verified register writes go as FC23 to the devices taking it, writing and reading back in one round
+        # trip. The rest are read back together once everything is written, on the same connection.
+        results = []
+        unverified = []
+        stopped = None
+        for planned in writes:
+            if stopped is None and self.cancelled():
+                stopped = "Not sent, interrupted"
+            result = None
+            if stopped is not None:
+                result = WriteResult(planned.command, planned.start, planned.number, False, stopped)
+            elif verify and unit != 0 and planned.command == HOLDING_WRITE and \
+                    planned.number <= MAX_READ_WRITE_SIZE and capabilities is not None and \
+                    capabilities.read_write is not False:
+                result = self.write_read_block(client, planned, unit, capabilities)
+            if result is None:
+                result = self.write_block(client, planned, unit)
+                if result.success and verify and unit != 0:
+                    unverified.append(len(results))
+            if result.message.startswith("Failed to connect"):
+                stopped = "Not sent, no connection"
+            results.append(result)
+            if result_callback is not None and (len(unverified) == 0 or unverified[-1] != len(results) - 1):
+                result_callback(planned, result)
+        if len(unverified) != 0:
+            self.read_back(client, [writes[index] for index in unverified], results, unverified, unit, capabilities)
+            if result_callback is not None:
+                for index in unverified:
+                    result_callback(writes[index], results[index])
+        return results
+
+    def write_read_block(self, client: Union[ModbusTcpClient, ModbusSerialClient], planned: PlannedWrite, unit: int,
+                         capabilities: DeviceCapabilities) -> Optional[WriteResult]:
+        # One FC23 request writing the registers and reading them back. None if the device doesn't take FC23,
+        # the request is to be written the usual way then.
+        # Only an ILLEGAL FUNCTION exception proves that nothing was written. Without a response the device may
+        # have written the registers and only the answer got lost, so the request is never sent again.
+        try:
+            result = client.readwrite_registers(read_address=planned.start, read_count=planned.number,
+                                                write_address=planned.start, values=planned.values, slave=unit)
+        except ConnectionException as e:
+            message = "Interrupted" if self.cancelled() else f"Failed to connect: {repr(e)}"
+            return WriteResult(planned.command, planned.start, planned.number, False, message)
+        if isinstance(result, ExceptionResponse) and result.exception_code == ModbusExceptions.IllegalFunction:
+            self.status_text_callback("Device doesn't take FC23, reading the writes back separately")
+            capabilities.read_write = False
+            return None
+        if result.isError():
+            if self.cancelled():
+                return WriteResult(planned.command, planned.start, planned.number, False, "Interrupted, unknown")
+            if isinstance(result, ExceptionResponse):
+                message = f"Failed: {result}"
+            else:
+                message = f"No response, unknown if written: {result}"
+            self.status_text_callback(f"Failed to write {planned.number} registers at {planned.start}: {message}",
+                                      failed=True)
+            return WriteResult(planned.command, planned.start, planned.number, False, message)
+        capabilities.read_write = True
+        self.status_text_callback(f"Successfully wrote and read back {planned.number} registers at {planned.start}")
+        return self.check_read_back(planned, result.registers)
+
+    def read_back(self, client: Union[ModbusTcpClient, ModbusSerialClient], writes: List[PlannedWrite],
+                  results: List[WriteResult], indexes: List[int], unit: int,
+                  capabilities: Optional[DeviceCapabilities] = None):
+        # Reads the written requests back with as few reads as the read planner manages, the results of the
+        # requests at the indexes are replaced by the outcome of the comparison
+        values = {}
+        for planned in plan_read_backs(writes, capabilities):
+            if self.cancelled():
+                break
+            read_config = ReadConfig(command=planned.command, start=planned.start, number=planned.number,
+                                     unit=unit, block_size=planned.number)
+            snapshot = self.get_register_blocks(client, read_config, capabilities)
+            for offset, value in enumerate(snapshot):
+                values[(planned.command, planned.start + offset)] = value
+        self.status_text_callback(f"Read back {len(writes)} write requests")
+        for planned, index in zip(writes, indexes):
+            read_values = [values.get((READ_BACK_COMMANDS[planned.command], address))
+                           for address in range(planned.start, planned.start + planned.number)]
+            if self.cancelled() and any(value is None for value in read_values):
+                results[index] = WriteResult(planned.command, planned.start, planned.number, True,
+                                             "Written, interrupted")
+            else:
+                results[index] = self.check_read_back(planned, read_values)
+
+    def check_read_back(self, planned: PlannedWrite, values: List[Optional[Union[int, bool]]]) -> WriteResult:
+        # Devices may clamp or ignore a value without answering with an error
+        bits = planned.command != HOLDING_WRITE
+        if len(values) < planned.number or any(value is None for value in values[:planned.number]):
+            self.status_text_callback(f"Failed to read back the {planned.number} written at {planned.start}",
+                                      failed=True)
+            return WriteResult(planned.command, planned.start, planned.number, False, "Written, read back failed")
+        mismatches = [planned.start + index for index, (written, value) in enumerate(zip(planned.values, values))
+                      if (bool(written) != bool(value) if bits else written != value)]
+        if len(mismatches) == 0:
+            return WriteResult(planned.command, planned.start, planned.number, True, "OK, verified")
+        shown = ", ".join(str(address) for address in mismatches[:3]) + (", ..." if 3 < len(mismatches) else "")
+        self.status_text_callback(f"{len(mismatches)} of {planned.number} written at {planned.start} read back "
+                                  f"different: {shown}", failed=True)
+        return WriteResult(planned.command, planned.start, planned.number, False, f"Read back different: {shown}",
+                           mismatches)
+
+    def write_block(self, client: Union[ModbusTcpClient, ModbusSerialClient], planned: PlannedWrite,
+                    unit: int, single_coil: bool = False) -> WriteResult:
+        # One FC16 (registers) or FC15 (coils) request, FC05 for a single coil if asked for
+        kind = "registers" if planned.command == HOLDING_WRITE else "coils"
+        try:
+            if planned.command == HOLDING_WRITE:
+                result = client.write_registers(address=planned.start, values=planned.values, slave=unit)
+            elif single_coil:
+                result = client.write_coil(address=planned.start, value=planned.values[0], slave=unit)
+            else:
+                result = client.write_coils(address=planned.start, values=planned.values, slave=unit)
+        except ConnectionException as e:
+            message = "Interrupted" if self.cancelled() else f"Failed to connect: {repr(e)}"
         else:
-            self.status_text_callback(f"Register(s) successfully written")
-        client.close()
+            if unit == 0:
+                self.status_text_callback(f"{planned.number} {kind} at {planned.start} sent with unit ID 0, "
+                                          f"no response expected")
+                return WriteResult(planned.command, planned.start, planned.number, True, "Sent, no response expected")
+            if not result.isError():
+                self.status_text_callback(f"Successfully wrote {planned.number} {kind} at {planned.start}")
+                return WriteResult(planned.command, planned.start, planned.number, True, "OK")
+            message = "Interrupted" if self.cancelled() else f"Failed: {result}"
+        if not self.cancelled():
+            self.status_text_callback(f"Failed to write {planned.number} {kind} at {planned.start}: {message}",
+                                      failed=True)
+        return WriteResult(planned.command, planned.start, planned.number, False, message)
+
+    def restore_snapshot(self, modbus_config: ModbusConfig, snapshot: RegisterSnapshot, unit: int,
+                         dry_run: bool = False, row_callback: Optional[callable] = None) -> Optional[TableContents]:
+        # The row callback gets the row of every request as soon as it is written and read back
+        to_return = TableContents(header=WRITE_HEADER_ROW, rows=[])
+
+        def add_result(planned: PlannedWrite, result: WriteResult):
+            row = write_row(planned, result)
+            to_return.rows.append(row)
+            if row_callback is not None:
+                row_callback(row)
 
-    def unit_sweep(self, screen, modbus_config: ModbusConfig, sweep_config: UnitSweepConfig) -> Optional[TableContents]:
+        if (plan := self.restore_registers(modbus_config, snapshot, unit, dry_run, add_result)) is None:
+            return None
+        if dry_run:
+            for planned in plan.writes:
+                add_result(planned, WriteResult(planned.command, planned.start, planned.number, True,
+                                                "Not written, dry run"))
+        elif (failed := sum(1 for result in plan.results if not result.success)) != 0:
+            self.status_text_callback(f"{failed} of {len(plan.writes)} requests failed", failed=True)
+        date = datetime.now().strftime("%H:%M:%S")
+        to_return.title = f"{date} - {'Dry run: ' if dry_run else ''}{plan.differing} of {len(snapshot)} registers " \
+                          f"from {snapshot.start} differ, {len(plan.writes)} requests, " \
+                          f"~{plan.estimated_time * 1000:.0f} ms to {self.describe_source(modbus_config, unit)}"
+        return to_return
+
+    def restore_registers(self, modbus_config: ModbusConfig, snapshot: RegisterSnapshot, unit: int,
+                          dry_run: bool = False, result_callback: Optional[callable] = None) -> Optional[RestorePlan]:
+        # Puts the holding registers of a snapshot back: reads what the device holds now, writes only the
+        # registers that differ, with as few requests as they allow, and reads every request back. A dry run
+        # stops after planning. It all goes over one connection.
+        if snapshot.command != HOLDING:
+            self.status_text_callback("Only holding registers can be restored", failed=True)
+            return None
+        capabilities = device_profiles.get(modbus_config, unit)
+        client = self.get_client(modbus_config, timeout=learned_timeout(capabilities))
+        if client is None:
+            return None
+        try:
+            self.status_text_callback(f"Reading the {len(snapshot)} registers from {snapshot.start} to compare")
+            self.last_gaps = []
+            read_config = ReadConfig(command=HOLDING, start=snapshot.start, number=len(snapshot), unit=unit)
+            current = self.get_register_blocks(client, read_config, capabilities)
+            if self.cancelled():
+                return None
+            read_write = capabilities.read_write is not False
+            writes, skipped = diff_writes(snapshot, current, read_write)
+            plan = RestorePlan(writes=writes, skipped=skipped,
+                               estimated_time=estimate_bus_time(modbus_config, writes, capabilities.response_time,
+                                                                read_write=read_write))
+            if skipped != 0:
+                self.status_text_callback(f"{skipped} registers could not be read from the device, left alone",
+                                          failed=True)
+            self.status_text_callback(f"{plan.differing} registers differ, {len(writes)} write requests, about "
+                                      f"{plan.estimated_time * 1000:.0f} ms on the bus with the read backs")
+            if not dry_run:
+                plan.results = self.send_writes(client, writes, unit, result_callback, True, capabilities)
+        finally:
+            self.release_client(client)
+        if self.cancelled():
+            self.status_text_callback("Interrupted!", failed=True)
+        self.save_device_profiles()
+        return plan
+
+    def unit_sweep(self, modbus_config: ModbusConfig, sweep_config: UnitSweepConfig,
+                   row_callback: Optional[callable] = None) -> Optional[TableContents]:
+        # The row callback gets every row of the result as soon as it is known, on the thread of the sweep
         to_return = TableContents(header=[
             "Unit",
             " Scan result"
         ], rows=[])
+
+        def add_result(result: UnitSweepResult):
+            row = [" {num: >{width}}".format(num=result.unit, width=3), f" {result.message}"]
+            to_return.rows.append(row)
+            if row_callback is not None:
+                row_callback(row)
+
+        if not self.sweep_units(modbus_config, sweep_config, add_result):
+            return None
+        return to_return
+
+    def sweep_units(self, modbus_config: ModbusConfig, sweep_config: UnitSweepConfig,
+                    result_callback: callable) -> bool:
+        # Sends the read of the sweep to every unit, the callback gets the result of each. False if there was
+        # no connection to sweep on.
         client = self.get_client(modbus_config, timeout=sweep_config.timeout)
+        if client is None:
+            return False
         if sweep_config.command == HOLDING:
             command = client.read_holding_registers
         elif sweep_config.command == COIL:
@@ -379,86 +1138,74 @@ class ModbusHandler:
         else:
             command = client.read_input_registers
         unit = sweep_config.start_unit
-        screen.nodelay(True)
-        while unit <= sweep_config.last_unit:
-            key = screen.getch()
-            if key == 27:
-                self.status_text_callback("Interrupted!", failed=True)
-                break
-            try:
-                result = command(address=sweep_config.start_register,
-                                 count=sweep_config.number_of_registers,
-                                 slave=unit)
-            except Exception as e:
-                self.status_text_callback(f"Unit {unit}: No response: {repr(e)}", failed=True)
-                to_return.rows.append([" {num: >{width}}".format(num=unit, width=3),
-                                       f" No response: {repr(e).strip()}"])
-            else:
-                if result.isError():
-                    if type(result) == ModbusIOException:
-                        self.status_text_callback(f"Unit {unit}: No response: ModbusIOException", failed=True)
-                        to_return.rows.append([" {num: >{width}}".format(num=unit, width=3),
-                                               f" No response: ModbusIOException"])
-                    elif type(result) == ExceptionResponse:
-                        self.status_text_callback(f"Unit {unit}: Received exception: {ModbusExceptions.decode(result.exception_code)}", failed=True)
-                        to_return.rows.append([" {num: >{width}}".format(num=unit, width=3),
-                                               f" Received exception: {result}"])
-                    else:
-                        self.status_text_callback(f"Unit {unit}: Received no known response", failed=True)
-                        to_return.rows.append([" {num: >{width}}".format(num=unit, width=3),
-                                               f" No know response received: {result}"])
+        try:
+            while unit <= sweep_config.last_unit:
+                try:
+                    result = command(address=sweep_config.start_register,
+                                     count=sweep_config.number_of_registers,
+                                     slave=unit)
+                except Exception as e:
+                    if self.cancelled():
+                        break
+                    self.status_text_callback(f"Unit {unit}: No response: {repr(e)}", failed=True)
+                    result_callback(UnitSweepResult(unit, False, f"No response: {repr(e).strip()}"))
                 else:
-                    self.status_text_callback(f"Unit {unit}: Valid register response received!")
-                    to_return.rows.append([" {num: >{width}}".format(num=unit, width=3),
-                                           f" Valid modbus register response received!"])
-            unit += 1
-        client.close()
-        return to_return
+                    if self.cancelled():
+                        break
+                    if result.isError():
+                        if type(result) == ModbusIOException:
+                            self.status_text_callback(f"Unit {unit}: No response: ModbusIOException", failed=True)
+                            result_callback(UnitSweepResult(unit, False, "No response: ModbusIOException"))
+                        elif type(result) == ExceptionResponse:
+                            self.status_text_callback(f"Unit {unit}: Received exception: {ModbusExceptions.decode(result.exception_code)}", failed=True)
+                            result_callback(UnitSweepResult(unit, False, f"Received exception: {result}"))
+                        else:
+                            self.status_text_callback(f"Unit {unit}: Received no known response", failed=True)
+                            result_callback(UnitSweepResult(unit, False, f"No know response received: {result}"))
+                    else:
+                        self.status_text_callback(f"Unit {unit}: Valid register response received!")
+                        result_callback(UnitSweepResult(unit, True, "Valid modbus register response received!"))
+                unit += 1
+                if self.cancelled():
+                    break
+        finally:
+            self.release_client(client)
+        if self.cancelled():
+            self.status_text_callback("Interrupted!", failed=True)
+        return True
 
-    def ip_sweep(self, screen, modbus_config, confiuration: IpSweepConfig) -> Optional[TableContents]:
+    def ip_sweep(self, modbus_config, confiuration: IpSweepConfig,
+                 row_callback: Optional[callable] = None) -> Optional[TableContents]:
+        # The row callback gets the rows in the order the targets answer, the returned table is sorted
         to_return = TableContents(header=[
             "IP Address",
             "      Scan result"
         ], rows=[])
-        address = confiuration.start_address
-        screen.nodelay(True)
-        while address <= confiuration.end_address:
-            key = screen.getch()
-            if key == 27:
-                self.status_text_callback("Interrupted!", failed=True)
-                break
-            ip = confiuration.subnet + f".{address}"
-            client = ModbusTcpClient(host=ip,
-                                     port=confiuration.port,
-                                     timeout=confiuration.timeout)
-            if confiuration.command == HOLDING:
-                command = client.read_holding_registers
-            elif confiuration.command == COIL:
-                command = client.read_coils
-            elif confiuration.command == DISCRETE:
-                command = client.read_discrete_inputs
-            else:
-                command = client.read_input_registers
-            try:
-                result = command(address=confiuration.start_register,
-                                 count=confiuration.number_of_registers,
-                                 slave=confiuration.unit_id)
-            except Exception as e:
-                self.status_text_callback(f"{ip}: No response: {repr(e)}", failed=True)
-                to_return.rows.append(["{num: <{width}}".format(num=ip, width=15),
-                                       f" No response: {repr(e).strip()}"])
-            else:
-                if result.isError():
-                    self.status_text_callback(f"{ip}: No response: {repr(result)}", failed=True)
-                    to_return.rows.append(["{num: <{width}}".format(num=ip, width=15),
-                                           f" No response: {repr(result).strip()}"])
-                else:
-                    self.status_text_callback(f"{ip}: Valid register response received!")
-                    to_return.rows.append(["{num: <{width}}".format(num=ip, width=15),
-                                           f" Valid modbus register response received!"])
 
-            address += 1
-            client.close()
+        counts = {RESPONDED: 0, NO_MODBUS_RESPONSE: 0, CONNECTION_REFUSED: 0, NO_TCP_RESPONSE: 0}
+
+        def add_result(result: SweepResult):
+            counts[result.status] += 1
+            if result.status in (CONNECTION_REFUSED, NO_TCP_RESPONSE) and confiuration.responders_only:
+                return
+            self.status_text_callback(f"{result.ip}: {result.message}", failed=not result.responded)
+            if result.responded or not confiuration.responders_only:
+                row = ["{num: <{width}}".format(num=result.ip, width=15), f" {result.message}"]
+                to_return.rows.append(row)
+                if row_callback is not None:
+                    row_callback(row)
+
+        try:
+            if not run_sweep(iterate_targets(confiuration.targets), confiuration, add_result, self.cancelled):
+                self.status_text_callback("Interrupted!", failed=True)
+        except (ValueError, OSError) as e:
+            self.status_text_callback(f"Sweep failed: {e}", failed=True)
+            return None
+        to_return.rows.sort(key=lambda row: sort_key(row[0].strip()))
+        self.status_text_callback(f"{counts[RESPONDED]} responded, "
+                                  f"{counts[NO_MODBUS_RESPONSE]} accepted TCP without a valid Modbus response, "
+                                  f"{counts[CONNECTION_REFUSED]} refused, "
+                                  f"{counts[NO_TCP_RESPONSE]} did not answer on TCP")
         return to_return
 
 
@@ -466,3 +1213,6 @@ class ModbusHandler:
 class HistoryItem:
     table_content: TableContents
     modbus_handler: ModbusHandler
+    snapshot: Optional[RegisterSnapshot] = None
+    # The connection the snapshot was read over, writes derived from it go to the same device
+    modbus_config: Optional[ModbusConfig] = None
@@ -0,0 +1,162 @@
+"""
+ModTerm - Modbus analyser for the terminal
+
+Copyright (C) 2023  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import curses
+import queue
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Optional, Set
+from modterm.components.background_worker import background_worker
+from modterm.components.definitions import ModbusConfig
+from modterm.components.menu_base import UI_POLL_INTERVAL
+from modterm.components.register_snapshot import RegisterSnapshot
+from modterm.components import vectorized_decode
+
+# Number of polls the achieved poll rate is averaged over
+RATE_WINDOW = 10
+
+
+@dataclass
+class PollResult:
+    snapshot: Optional[RegisterSnapshot]
+    started: float
+    duration: float
+    overran: bool
+    error: Optional[str] = None
+    changed: Set[int] = field(default_factory=set)
+
+
+def changed_registers(previous: Optional[RegisterSnapshot], current: RegisterSnapshot) -> Set[int]:
+    # Indices of the registers, coils or inputs whose value, or whether they could be read at all, differs
+    if previous is None:
+        return set()
+    count = min(len(previous), len(current))
+    if vectorized_decode.is_available() and not current.is_bits:
+        old_values, old_valid = vectorized_decode.snapshot_arrays(previous, 0, count)
+        new_values, new_valid = vectorized_decode.snapshot_arrays(current, 0, count)
+        return set(((old_values != new_values) | (old_valid != new_valid)).nonzero()[0].tolist())
+    return {index for index, (old, new) in enumerate(zip(previous[:count], current[:count])) if old != new}
+
+
+class Monitor:
+    # Polls the range of the last read of a handler at a fixed interval on the background worker, while the data
+    # window shows each result in place with the registers changed by the poll marked. A poll taking longer than
+    # the interval skips the deadlines it missed instead of polling back to back to catch up.
+    def __init__(self, screen, data_window, modbus_handler, modbus_config: ModbusConfig, interval: float):
+        self.screen = screen
+        self.data_window = data_window
+        self.modbus_handler = modbus_handler
+        self.modbus_config = modbus_config
+        self.read_config = modbus_handler.last_read_config
+        self.interval = interval
+        self.stop_event = threading.Event()
+        self.results = queue.Queue()
+        self.poll_times = deque(maxlen=RATE_WINDOW)
+        self.overruns = 0
+        self.last_result: Optional[PollResult] = None
+        self.table_title = data_window.title
+        self.poll_error: Optional[str] = None
+
+    def set_status(self, text, failed=False, highlighted=False):
+        # Called from the background worker, only errors are shown in the title
+        if failed:
+            self.poll_error = text
+
+    def poll_loop(self):
+        deadline = time.monotonic()
+        previous = self.modbus_handler.last_data
+        while not self.stop_event.is_set():
+            started = time.monotonic()
+            self.poll_error = None
+            snapshot = self.modbus_handler.poll(self.modbus_config, self.read_config)
+            finished = time.monotonic()
+            if self.modbus_handler.cancelled():
+                return
+            result = PollResult(snapshot=snapshot, started=started, duration=finished - started,
+                                overran=started + self.interval < finished, error=self.poll_error)
+            if snapshot is not None:
+                result.changed = changed_registers(previous, snapshot)
+                previous = snapshot
+            if result.overran:
+                self.overruns += 1
+            self.results.put(result)
+            deadline += self.interval
+            if deadline < finished:
+                deadline += (int((finished - deadline) / self.interval) + 1) * self.interval
+            self.stop_event.wait(deadline - time.monotonic())
+
+    def show(self, result: PollResult):
+        self.last_result = result
+        self.poll_times.append(result.started)
+        if result.snapshot is None:
+            return
+        table_data = self.modbus_handler.show_snapshot(self.modbus_config, result.snapshot)
+        if table_data is None:
+            return
+        self.table_title = table_data.title
+        self.data_window.data_rows = table_data.rows
+        self.data_window.marked_rows = result.changed
+        if len(table_data.rows) < self.data_window.position:
+            self.data_window.show_row(len(table_data.rows) - 1)
+
+    def get_title(self) -> str:
+        title = f"Monitoring every {self.interval:g} s"
+        if 2 <= len(self.poll_times) and self.poll_times[0] < self.poll_times[-1]:
+            title += f", {(len(self.poll_times) - 1) / (self.poll_times[-1] - self.poll_times[0]):.1f} polls/s"
+        if self.last_result is not None:
+            title += f", last poll {self.last_result.duration * 1000:.0f} ms"
+            if self.last_result.overran:
+                title += " (overran)"
+        title += f", {self.overruns} overruns"
+        if self.last_result is not None and self.last_result.error is not None:
+            title += f", {self.last_result.error}"
+        return title + ", ESC to stop"
+
+    def run(self):
+        # The handler belongs to a result in the history, it only reports to the monitor while polling
+        status_text_callback = self.modbus_handler.status_text_callback
+        self.modbus_handler.status_text_callback = self.set_status
+        self.modbus_handler.cancel_event.clear()
+        job = background_worker.submit(self.poll_loop)
+        self.screen.timeout(UI_POLL_INTERVAL)
+        key = -1
+        try:
+            while key not in (27, ord("m")) and not job.done.is_set():
+                self.data_window.check_navigate(key)
+                while not self.results.empty():
+                    self.show(self.results.get())
+                self.data_window.title = self.get_title()
+                self.data_window.draw()
+                curses.doupdate()
+                key = self.screen.getch()
+        finally:
+            self.stop_event.set()
+            # Wakes up a poll waiting for its response
+            self.modbus_handler.cancel()
+            job.done.wait()
+            # The handler is handed back as it was received, not cancelled
+            self.modbus_handler.cancel_event.clear()
+            self.modbus_handler.status_text_callback = status_text_callback
+        self.screen.timeout(-1)
+        self.data_window.marked_rows = set()
+        self.data_window.title = self.table_title
+        if job.error is not None:
+            raise job.error
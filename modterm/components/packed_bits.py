@@ -0,0 +1,68 @@
+"""
+ModTerm - Modbus analyser for the terminal
+
+Copyright (C) 2023  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from typing import Iterable, Iterator, Optional
+
+
+class PackedBits:
+    # Coil and discrete input values packed eight to a byte, LSB first like on the wire, with a second bitmap
+    # marking the bits that were actually read. Indexing returns None for bits that could not be read.
+    def __init__(self, length: int = 0):
+        self.length = length
+        self.values = bytearray((length + 7) // 8)
+        self.valid = bytearray((length + 7) // 8)
+
+    @classmethod
+    def from_list(cls, bits: Iterable[Optional[bool]]) -> "PackedBits":
+        bits = list(bits)
+        packed = cls(len(bits))
+        packed.set_range(0, bits)
+        return packed
+
+    def set_range(self, offset: int, bits: Iterable[Optional[bool]]):
+        for index, bit in enumerate(bits, start=offset):
+            mask = 1 << (index & 7)
+            if bit is None:
+                self.valid[index >> 3] &= ~mask
+                self.values[index >> 3] &= ~mask
+                continue
+            self.valid[index >> 3] |= mask
+            if bit:
+                self.values[index >> 3] |= mask
+            else:
+                self.values[index >> 3] &= ~mask
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, index: int) -> Optional[bool]:
+        if isinstance(index, slice):
+            return PackedBits.from_list(self[i] for i in range(*index.indices(self.length)))
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("bit index out of range")
+        mask = 1 << (index & 7)
+        if not self.valid[index >> 3] & mask:
+            return None
+        return bool(self.values[index >> 3] & mask)
+
+    def __iter__(self) -> Iterator[Optional[bool]]:
+        for index in range(self.length):
+            yield self[index]
@@ -0,0 +1,260 @@
+"""
+ModTerm - Modbus analyser for the terminal
+
+Copyright (C) 2023  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import threading
+import time
+import logging
+from dataclasses import dataclass, field
+from itertools import groupby
+from typing import Dict, List, Optional, Tuple
+from modterm.components.definitions import ModbusConfig, ReadConfig, TableContents, COIL, DISCRETE, MAX_BLOCK_SIZES, \
+    TCP, REGISTER_GAP, BIT_GAP
+from modterm.components.connection_pool import ConnectionPool, connection_pool, get_connection_key, \
+    get_line_settings
+from modterm.components.device_capabilities import device_profiles, learned_timeout
+from modterm.components.modbus_handler import ModbusHandler
+from modterm.components.register_snapshot import RegisterSnapshot
+
+logger = logging.getLogger("ModTerm")
+
+# Share of the time a bus may spend on requests
+DEFAULT_BUDGET = 0.8
+# Jobs falling due this close to each other are read together
+COALESCE_WINDOW = 0.02
+
+SCHEDULER_HEADER_ROW = ["{: <24}".format("Job"), "{: >8}".format("Polls"), "{: >7}".format("Missed"),
+                        "{: >7}".format("Errors"), "{: >13}".format("Jitter avg ms"), "{: >13}".format("Jitter max ms")]
+
+
+@dataclass
+class JobStats:
+    polls: int = 0
+    missed_deadlines: int = 0
+    errors: int = 0
+    jitter_total: float = 0
+    jitter_max: float = 0
+
+    @property
+    def jitter_mean(self) -> float:
+        return self.jitter_total / self.polls if self.polls else 0
+
+
+@dataclass
+class PollJob:
+    # Reads number registers (or coils, inputs) from start every period seconds. The callback gets the job and
+    # the snapshot of its range, or None if the read failed, on the thread of the bus.
+    modbus_config: ModbusConfig
+    unit: int
+    command: str
+    start: int
+    number: int
+    period: float
+    name: str = ""
+    callback: Optional[callable] = None
+    deadline: float = 0
+    stats: JobStats = field(default_factory=JobStats)
+    last_result: Optional[RegisterSnapshot] = None
+
+    def __post_init__(self):
+        if self.name == "":
+            self.name = f"{self.unit}:{self.start}-{self.start + self.number - 1} {self.command.split()[1]}"
+
+
+@dataclass
+class BusStats:
+    requests: int = 0
+    busy: float = 0
+    started: float = field(default_factory=time.monotonic)
+
+    @property
+    def utilisation(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.busy / elapsed if elapsed else 0
+
+
+def coalesce(ranges: List[Tuple[int, int]], gap: int) -> List[Tuple[int, int]]:
+    # Merges (start, number) ranges overlapping or less than gap apart, the merged ranges are read in blocks
+    merged = []
+    for start, number in sorted(ranges):
+        if merged and start <= merged[-1][0] + merged[-1][1] + gap:
+            merged_start, merged_number = merged[-1]
+            merged[-1] = (merged_start, max(merged_number, start + number - merged_start))
+        else:
+            merged.append((start, number))
+    return merged
+
+
+def check_budget(budget: float) -> float:
+    if not 0 < budget <= 1:
+        raise ValueError(f"The bus utilisation budget must be more than 0 and at most 1, not {budget}")
+    return budget
+
+
+class BusWorker:
+    # Polls the jobs of a serial line or TCP endpoint, one request at a time, on a thread of its own. After each
+    # request the bus is left idle long enough to keep its utilisation within the budget.
+    def __init__(self, key: Tuple, budget: float, pool: ConnectionPool, stop_event: threading.Event):
+        self.key = key
+        self.name = f"{key[1]}:{key[2]}" if key[0] == TCP else key[1]
+        self.budget = budget
+        self.stop_event = stop_event
+        self.jobs: List[PollJob] = []
+        self.stats = BusStats()
+        self.idle_until = 0
+        self.modbus_handler = ModbusHandler(self.log_status, pool=pool)
+        self.thread = threading.Thread(target=self.run, name=f"ModTerm poll {self.name}", daemon=True)
+
+    def log_status(self, text, failed=False, highlighted=False):
+        if failed and not self.stop_event.is_set():
+            logger.warning(f"Polling {self.name}: {text}")
+
+    def run(self):
+        now = time.monotonic()
+        for job in self.jobs:
+            job.deadline = now
+        while not self.stop_event.is_set():
+            now = time.monotonic()
+            ready = max(min(job.deadline for job in self.jobs), self.idle_until)
+            if now < ready:
+                self.stop_event.wait(ready - now)
+                continue
+            due = [job for job in self.jobs if job.deadline <= now + COALESCE_WINDOW]
+            self.poll(due)
+            finished = time.monotonic()
+            for job in due:
+                job.deadline += job.period
+                if job.deadline < finished:
+                    # Periods that went by without a poll
+                    missed = int((finished - job.deadline) / job.period) + 1
+                    job.stats.missed_deadlines += missed
+                    job.deadline += missed * job.period
+
+    def poll(self, due: List[PollJob]):
+        def group_key(job):
+            return job.unit, job.command, get_connection_key(job.modbus_config)
+
+        for (unit, command, _), group in groupby(sorted(due, key=group_key), key=group_key):
+            group = list(group)
+            gap = BIT_GAP if command in (COIL, DISCRETE) else REGISTER_GAP
+            for start, number in coalesce([(job.start, job.number) for job in group], gap):
+                if self.stop_event.is_set():
+                    return
+                now = time.monotonic()
+                if now < self.idle_until:
+                    self.stop_event.wait(self.idle_until - now)
+                started = time.monotonic()
+                snapshot = self.read(group[0].modbus_config, unit, command, start, number)
+                finished = time.monotonic()
+                self.stats.requests += 1
+                self.stats.busy += finished - started
+                self.idle_until = finished + (finished - started) * (1 / self.budget - 1)
+                for job in group:
+                    if start <= job.start and job.start + job.number <= start + number:
+                        self.deliver(job, snapshot, started)
+
+    def read(self, modbus_config: ModbusConfig, unit: int, command: str, start: int,
+             number: int) -> Optional[RegisterSnapshot]:
+        capabilities = device_profiles.get(modbus_config, unit)
+        client = self.modbus_handler.get_client(modbus_config, timeout=learned_timeout(capabilities))
+        if client is None:
+            return None
+        read_config = ReadConfig(command=command, start=start, number=number, unit=unit,
+                                 block_size=MAX_BLOCK_SIZES[command])
+        self.modbus_handler.last_gaps = []
+        try:
+            return self.modbus_handler.get_register_blocks(client, read_config, capabilities)
+        finally:
+            self.modbus_handler.release_client(client)
+
+    @staticmethod
+    def deliver(job: PollJob, snapshot: Optional[RegisterSnapshot], started: float):
+        jitter = abs(started - job.deadline)
+        job.stats.polls += 1
+        job.stats.jitter_total += jitter
+        job.stats.jitter_max = max(job.stats.jitter_max, jitter)
+        result = None
+        if snapshot is not None and job.start - snapshot.start + job.number <= len(snapshot):
+            result = snapshot[job.start - snapshot.start:job.start - snapshot.start + job.number]
+        # Blocks that timed out or were answered with an exception leave their registers invalid in the snapshot
+        if result is None or not all(result.is_valid(index) for index in range(len(result))):
+            job.stats.errors += 1
+        job.last_result = result
+        if job.callback is not None:
+            try:
+                job.callback(job, result)
+            except Exception:
+                logger.error(f"Poll callback of {job.name} failed", exc_info=True)
+
+
+class PollScheduler:
+    # Polls any number of jobs on any number of devices. Every serial line and TCP endpoint gets its own queue
+    # and thread, so a slow bus never holds up the others. Jobs of the same unit and function falling due
+    # together are read with as few requests as possible.
+    def __init__(self, budget: float = DEFAULT_BUDGET, pool: ConnectionPool = connection_pool):
+        self.budget = check_budget(budget)
+        self.budgets: Dict[Tuple, float] = {}
+        self.pool = pool
+        self.jobs: List[PollJob] = []
+        self.buses: Dict[Tuple, BusWorker] = {}
+        self.stop_event = threading.Event()
+
+    def add(self, job: PollJob) -> PollJob:
+        if self.buses:
+            raise RuntimeError("Jobs can't be added to a running scheduler")
+        # One serial line runs at one set of settings, its units can't be polled at others
+        key = get_connection_key(job.modbus_config)
+        for other in self.jobs:
+            if get_connection_key(other.modbus_config) == key and \
+                    get_line_settings(other.modbus_config) != get_line_settings(job.modbus_config):
+                raise ValueError(f"{job.name} is on {job.modbus_config.interface} with other line settings than "
+                                 f"{other.name}")
+        self.jobs.append(job)
+        return job
+
+    def set_budget(self, modbus_config: ModbusConfig, budget: float):
+        # Overrides the utilisation budget of one bus
+        self.budgets[get_connection_key(modbus_config)] = check_budget(budget)
+
+    def start(self):
+        self.stop_event.clear()
+        for job in self.jobs:
+            key = get_connection_key(job.modbus_config)
+            if key not in self.buses:
+                self.buses[key] = BusWorker(key, self.budgets.get(key, self.budget), self.pool, self.stop_event)
+            self.buses[key].jobs.append(job)
+        for bus in self.buses.values():
+            bus.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+        for bus in self.buses.values():
+            bus.modbus_handler.cancel()
+        for bus in self.buses.values():
+            bus.thread.join()
+        self.buses = {}
+
+    def get_table(self) -> TableContents:
+        rows = [["{: <24}".format(job.name[:24]),
+                 "{: >8}".format(job.stats.polls),
+                 "{: >7}".format(job.stats.missed_deadlines),
+                 "{: >7}".format(job.stats.errors),
+                 "{: >13.1f}".format(job.stats.jitter_mean * 1000),
+                 "{: >13.1f}".format(job.stats.jitter_max * 1000)] for job in self.jobs]
+        utilisation = ", ".join(f"{bus.name}: {bus.stats.utilisation:.0%}" for bus in self.buses.values())
+        return TableContents(header=SCHEDULER_HEADER_ROW, rows=rows, title=f"Bus utilisation {utilisation}")
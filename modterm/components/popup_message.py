@@ -1,6 +1,8 @@
 from modterm.components.window_base import WindowBase
+from modterm.components.hepers import get_text_input, CancelInput
 import curses
 from textwrap import wrap
+from typing import Optional
 
 
 def show_popup_message(screen, width: int, title: str, message: str):
@@ -14,3 +16,13 @@ def show_popup_message(screen, width: int, title: str, message: str):
     popup.window.refresh()
     curses.napms(3000)
     curses.flushinp()
+
+
+def show_input_popup(screen, width: int, title: str, label: str, default: str = "") -> Optional[str]:
+    popup = WindowBase(screen=screen, height=5, width=width, title=title)
+    popup.draw_window()
+    popup.window.addstr(2, 2, label)
+    try:
+        return get_text_input(popup.window, width - len(label) - 5, 2, len(label) + 2, default)
+    except CancelInput:
+        return None
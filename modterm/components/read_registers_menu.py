@@ -18,16 +18,16 @@ along with this program. If not, see <https://www.gnu.org/licenses/>.
 """
 
 import curses
-from modterm.components.definitions import HOLDING, INPUT, COIL, DISCRETE
+from modterm.components.definitions import HOLDING, INPUT, COIL, DISCRETE, MAX_BLOCK_SIZES
 from modterm.components.hepers import get_text_input, CancelInput, text_input_to_int
 from modterm.components.scrollable_list import SelectWindow
-from modterm.components.modbus_handler import ModbusHandler
+from modterm.components.modbus_handler import ModbusHandler, WORDS_HEADER_ROW, BITS_HEADER_ROW
 from modterm.components.config_handler import load_read_config, save_read_config
 from modterm.components.menu_base import MenuBase
 
 
 class ReadRegistersMenu(MenuBase):
-    def __init__(self, screen, normal_text, highlighted_text, modbus_config):
+    def __init__(self, screen, normal_text, highlighted_text, modbus_config, data_window=None):
         super().__init__(screen,
                          normal_text,
                          highlighted_text,
@@ -36,23 +36,34 @@ class ReadRegistersMenu(MenuBase):
                                       4: "F4 - Number of registers to read: ",
                                       5: "F5 - Modbus unit ID: ",
                                       6: "F6 - Block size: ",
-                                      7: "Start reading, ESC to interrupt the process "},
+                                      7: "F7 - Pipelined requests (TCP): ",
+                                      8: "F8 - Map readable registers on address errors: ",
+                                      9: "F9 - Use learned device capabilities: ",
+                                      10: "Start reading, ESC to interrupt the process "},
                          config_values={2: "command",
                                         3: "start",
                                         4: "number",
                                         5: "unit",
                                         6: "block_size",
-                                        7: ""},
+                                        7: "pipeline_depth",
+                                        8: "adaptive_split",
+                                        9: "use_capabilities",
+                                        10: ""},
                          interfaces={2: self.switch_command,
                                      3: self.get_start_register,
                                      4: self.get_number_of_registers,
                                      5: self.get_unit_id,
-                                     6: self.get_block_size},
+                                     6: self.get_block_size,
+                                     7: self.get_pipeline_depth,
+                                     8: self.swap_adaptive_split,
+                                     9: self.swap_use_capabilities},
                          menu_name="Read registers")
 
         self.modbus_handler = ModbusHandler(self.add_status_text)
         self.modbus_config = modbus_config
         self.configuration = load_read_config()
+        self.data_window = data_window
+        self.live_rows = []
 
     def switch_command(self, clear=False):
         command_list = [INPUT, HOLDING, COIL, DISCRETE]
@@ -61,6 +72,10 @@ class ReadRegistersMenu(MenuBase):
                                 self.dialog.window.getbegyx()[1] + 15, self.normal_text, self.highlighted_text,
                                 command_list)
         if (selection := selector.get_selection()) is not None:
+            # A block size left at the protocol limit follows the limit of the new command
+            if self.configuration.block_size >= MAX_BLOCK_SIZES[self.configuration.command]:
+                self.configuration.block_size = MAX_BLOCK_SIZES[selection]
+            self.configuration.block_size = min(self.configuration.block_size, MAX_BLOCK_SIZES[selection])
             self.configuration.command = selection
 
     def get_start_register(self, clear=False):
@@ -116,21 +131,86 @@ class ReadRegistersMenu(MenuBase):
 
     def get_block_size(self, clear=False):
         try:
-            block_size = get_text_input(self.dialog.window, 4, 6, 19,
+            block_size = get_text_input(self.dialog.window, 5, 6, 19,
                                         str(self.configuration.block_size) if not clear else "")
         except CancelInput:
             return
         block_size = text_input_to_int(block_size)
+        max_block_size = MAX_BLOCK_SIZES[self.configuration.command]
         if block_size is not None:
-            if not 1 <= block_size <= 125:
+            if not 1 <= block_size <= max_block_size:
                 block_size = None
         if block_size is None:
-            self.dialog.window.addstr(6, 23, "Block size must be between 1 and 125")
+            self.dialog.window.addstr(6, 23, f"Block size must be between 1 and {max_block_size}")
             self.dialog.window.refresh()
             curses.napms(1000)
         else:
             self.configuration.block_size = block_size
 
+    def get_pipeline_depth(self, clear=False):
+        try:
+            pipeline_depth = get_text_input(self.dialog.window, 4, 7, 33,
+                                            str(self.configuration.pipeline_depth) if not clear else "")
+        except CancelInput:
+            return
+        pipeline_depth = text_input_to_int(pipeline_depth)
+        if pipeline_depth is not None:
+            if not 1 <= pipeline_depth <= 16:
+                pipeline_depth = None
+        if pipeline_depth is None:
+            self.dialog.window.addstr(7, 33, "Must be between 1 (sequential) and 16")
+            self.dialog.window.refresh()
+            curses.napms(1000)
+        else:
+            self.configuration.pipeline_depth = pipeline_depth
+
+    def swap_adaptive_split(self, clear=False):
+        self.configuration.adaptive_split = not self.configuration.adaptive_split
+
+    def swap_use_capabilities(self, clear=False):
+        self.configuration.use_capabilities = not self.configuration.use_capabilities
+
+    def show_progress(self, key):
+        # Rows are decoded block by block and shown in the data window while the rest of the read is in flight
+        progress = self.modbus_handler.progress
+        if progress is None:
+            return
+        self.data_window.check_navigate(key)
+        data = self.modbus_handler.partial_data
+        # The last row waits for the next register, it is part of the 32 bit values
+        ready = progress.ready if progress.ready == len(data) else max(0, progress.ready - 1)
+        if len(self.live_rows) < ready:
+            if self.configuration.command in (COIL, DISCRETE):
+                rows = ModbusHandler.bit_rows(data, self.configuration.start, len(self.live_rows), ready)
+            else:
+                rows = ModbusHandler.word_rows(data, self.modbus_config, self.configuration.start,
+                                               len(self.live_rows), ready)
+            self.live_rows.extend(rows)
+        eta = "--" if (eta := progress.eta) is None else f"{int(eta) // 60}:{int(eta) % 60:02}"
+        self.data_window.title = (f"Reading {progress.blocks_done}/{progress.blocks_total} blocks, "
+                                  f"{progress.rate:.0f} registers/s, ETA {eta}, ESC to interrupt")
+        self.data_window.draw()
+        curses.doupdate()
+
     def action(self):
         save_read_config(self.configuration)
-        return self.modbus_handler.get_data_rows(self.screen, self.modbus_config, self.configuration)
+        if self.data_window is None:
+            return self.run_in_background(self.modbus_handler.get_data_rows, self.modbus_config, self.configuration)
+        previous_table = self.data_window.data_rows, self.data_window.header, self.data_window.title
+        self.modbus_handler.progress = None
+        self.live_rows = []
+        self.data_window.data_rows = self.live_rows
+        self.data_window.header = BITS_HEADER_ROW if self.configuration.command in (COIL, DISCRETE) else WORDS_HEADER_ROW
+        self.data_window.title = "Reading..."
+        self.data_window.page = 1
+        self.data_window.position = 1
+        self.data_window.touch()
+        self.data_window.draw()
+        curses.doupdate()
+        table_data = self.run_in_background(self.modbus_handler.get_data_rows, self.modbus_config, self.configuration,
+                                            progress=self.show_progress)
+        if table_data is None:
+            self.data_window.data_rows, self.data_window.header, self.data_window.title = previous_table
+            self.data_window.page = 1
+            self.data_window.position = 1
+        return table_data
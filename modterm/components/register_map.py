@@ -0,0 +1,193 @@
+"""
+ModTerm - Modbus analyser for the terminal
+
+Copyright (C) 2023  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import csv
+import json
+import os
+from dataclasses import dataclass, field
+from itertools import groupby
+from typing import List, Optional, Sequence, Union
+from modterm.components.definitions import RegisterPoint, DeviceCapabilities, HOLDING, INPUT, COIL, DISCRETE, \
+    MAX_BLOCK_SIZES, REGISTER_GAP, BIT_GAP, POINT_TYPES, BigEndian, LittleEndian
+from modterm.components.device_capabilities import block_size_limit, get_dead_ranges
+from modterm.components.decoders import decode_value
+
+MAP_HEADER_ROW = ["{: <24}".format("Name"), "{: >6}".format("Addr"), "{: >5}".format("HAdr"),
+                  "{: >8}".format("Function"), "{: >4}".format("Type"), "{: >16}".format("Value")]
+
+# Function names accepted in map files, besides the function codes and the commands themselves
+FUNCTIONS = {
+    "holding": HOLDING,
+    "input": INPUT,
+    "coil": COIL,
+    "coils": COIL,
+    "discrete": DISCRETE,
+    "1": COIL,
+    "2": DISCRETE,
+    "3": HOLDING,
+    "4": INPUT,
+    **{command.lower(): command for command in (HOLDING, INPUT, COIL, DISCRETE)}
+}
+FUNCTION_LABELS = {HOLDING: "Holding", INPUT: "Input", COIL: "Coil", DISCRETE: "Discrete"}
+TYPES = {
+    **{point_type: point_type for point_type in POINT_TYPES},
+    "UINT16": "U16",
+    "INT16": "I16",
+    "UINT32": "U32",
+    "INT32": "I32",
+    "FLOAT32": "F32",
+    "FLOAT": "F32",
+    "BOOL": "BIT"
+}
+ORDERS = {
+    "big": BigEndian,
+    "little": LittleEndian,
+    BigEndian.lower(): BigEndian,
+    LittleEndian.lower(): LittleEndian
+}
+
+
+class RegisterMapError(Exception):
+    pass
+
+
+@dataclass
+class PlannedRead:
+    command: str
+    start: int
+    number: int
+    points: List[RegisterPoint] = field(default_factory=list)
+
+
+def parse_point(entry: dict, line: int) -> RegisterPoint:
+    # Empty fields, as CSV files have them, get the default
+    entry = {key.strip().lower(): value for key, value in entry.items()
+             if key is not None and value is not None and str(value).strip() != ""}
+    try:
+        name = str(entry["name"]).strip()
+        address = entry["address"]
+        address = int(address, 16) if str(address).strip().lower().startswith("0x") else int(address)
+    except KeyError as e:
+        raise RegisterMapError(f"Point {line} has no {e.args[0]}")
+    except ValueError:
+        raise RegisterMapError(f"Invalid address of point {line}: {entry['address']}")
+    if not 0 <= address <= 65535:
+        raise RegisterMapError(f"Address of {name} is out of range: {address}")
+    command = FUNCTIONS.get(str(entry.get("function", "holding")).strip().lower())
+    if command is None:
+        raise RegisterMapError(f"Unknown function of {name}: {entry['function']}")
+    bits = command in (COIL, DISCRETE)
+    point_type = TYPES.get(str(entry.get("type", "BIT" if bits else "U16")).strip().upper())
+    if point_type is None:
+        raise RegisterMapError(f"Unknown type of {name}: {entry['type']}")
+    if bits != (point_type == "BIT"):
+        raise RegisterMapError(f"{name}: coils and discrete inputs are BIT points, registers can't be")
+    if 65536 < address + POINT_TYPES[point_type]:
+        raise RegisterMapError(f"{name} runs past the last register")
+    try:
+        scale = float(entry.get("scale", 1))
+    except ValueError:
+        raise RegisterMapError(f"Invalid scale of {name}: {entry['scale']}")
+    orders = []
+    for key in ("byte_order", "word_order"):
+        if key not in entry:
+            orders.append(None)
+        elif (order := ORDERS.get(str(entry[key]).strip().lower())) is None:
+            raise RegisterMapError(f"Invalid {key.replace('_', ' ')} of {name}: {entry[key]}")
+        else:
+            orders.append(order)
+    return RegisterPoint(name=name, address=address, command=command, type=point_type, scale=scale,
+                         byte_order=orders[0], word_order=orders[1])
+
+
+def load_map_entries(path: str) -> List[dict]:
+    # The entries of a JSON list (or of an object with one under "points"), or the rows of a CSV file with a
+    # header row
+    try:
+        with open(path, newline="") as f:
+            if os.path.splitext(path)[1].lower() == ".json":
+                entries = json.load(f)
+                if isinstance(entries, dict):
+                    entries = entries.get("points")
+                if not isinstance(entries, list) or not all(isinstance(entry, dict) for entry in entries):
+                    raise RegisterMapError("The map has to be a list of points")
+            else:
+                entries = list(csv.DictReader(f))
+    except (OSError, UnicodeDecodeError, json.JSONDecodeError, csv.Error) as e:
+        raise RegisterMapError(f"Failed to load the map: {e}")
+    if len(entries) == 0:
+        raise RegisterMapError("The map has no points")
+    return entries
+
+
+def load_register_map(path: str) -> List[RegisterPoint]:
+    # The fields of the points are name, address, function, type, scale, byte_order and word_order, only name
+    # and address are mandatory
+    return [parse_point(entry, line) for line, entry in enumerate(load_map_entries(path), start=1)]
+
+
+def plan_reads(points: Sequence[RegisterPoint],
+               capabilities: Optional[DeviceCapabilities] = None) -> List[PlannedRead]:
+    # The fewest reads covering every point. Points are read together while the unwanted registers between them
+    # are cheaper than a request of their own, a read never spans a known unreadable range of the device or
+    # goes beyond the largest block it takes.
+    reads = []
+    for command, group in groupby(sorted(points, key=lambda point: (point.command, point.address)),
+                                  key=lambda point: point.command):
+        gap = BIT_GAP if command in (COIL, DISCRETE) else REGISTER_GAP
+        block_size = MAX_BLOCK_SIZES[command]
+        dead_ranges = []
+        if capabilities is not None:
+            block_size = block_size_limit(capabilities, command, block_size)
+            dead_ranges = get_dead_ranges(capabilities, command)
+        current = None
+        for point in group:
+            if current is not None:
+                end = current.start + current.number
+                new_end = max(end, point.address + point.size)
+                if (point.address <= end + gap and new_end - current.start <= block_size and
+                        not any(first < point.address and end <= last for first, last in dead_ranges)):
+                    current.number = new_end - current.start
+                    current.points.append(point)
+                    continue
+            current = PlannedRead(command=command, start=point.address, number=point.size, points=[point])
+            reads.append(current)
+    return reads
+
+
+def decode_point(point: RegisterPoint, values: Sequence[Optional[Union[int, bool]]], byte_order: str = BigEndian,
+                 word_order: str = BigEndian) -> Optional[Union[float, bool]]:
+    # The scaled value of a point from its registers (or bit), None if any of them could not be read
+    if len(values) < point.size or any(value is None for value in values[:point.size]):
+        return None
+    if point.type == "BIT":
+        return bool(values[0])
+    value = decode_value(values, point.type, point.byte_order or byte_order, point.word_order or word_order)
+    return value * point.scale if point.scale != 1 else value
+
+
+def format_value(point: RegisterPoint, value: Optional[Union[float, bool]]) -> str:
+    if value is None:
+        return "--"
+    if point.type == "BIT":
+        return "1" if value else "0"
+    if isinstance(value, int):
+        return str(value)
+    # Single precision floats carry about 7 significant digits
+    return f"{value:0.7g}" if point.type == "F32" else f"{value:0.10g}"
@@ -0,0 +1,90 @@
+"""
+ModTerm - Modbus analyser for the terminal
+
+Copyright (C) 2023  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import curses
+import os
+from modterm.components.hepers import get_text_input, CancelInput, text_input_to_int
+from modterm.components.config_handler import load_register_map_config, save_register_map_config
+from modterm.components.modbus_handler import ModbusHandler
+from modterm.components.register_map import load_register_map, RegisterMapError
+from modterm.components.menu_base import MenuBase
+
+
+class RegisterMapMenu(MenuBase):
+    def __init__(self, screen, normal_text, highlighted_text, modbus_config):
+        super().__init__(screen,
+                         normal_text,
+                         highlighted_text,
+                         menu_labels={2: "F2 - Map file: ",
+                                      3: "F3 - Modbus unit ID: ",
+                                      4: "Read points, ESC to interrupt the process "},
+                         config_values={2: "path",
+                                        3: "unit",
+                                        4: ""},
+                         interfaces={2: self.get_path,
+                                     3: self.get_unit_id},
+                         menu_name="Read register map")
+
+        self.modbus_handler = ModbusHandler(self.add_status_text)
+        self.modbus_config = modbus_config
+        self.configuration = load_register_map_config()
+        self.help_text_rows.extend(["",
+                                    "Reads the points of a JSON or CSV register map with name, address,",
+                                    "function, type, scale, byte_order and word_order fields. Nearby points",
+                                    "are read together, each is decoded with its own type and orders."])
+
+    def get_path(self, clear=False):
+        try:
+            file_path = get_text_input(self.dialog.window, self.dialog.width - 18, 2, 16,
+                                       str(self.configuration.path) if not clear else "")
+        except CancelInput:
+            return
+        if not os.path.isfile(file_path):
+            self.dialog.window.addstr(2, 16, "  File doesn't exist  ")
+            self.dialog.window.refresh()
+            curses.napms(1000)
+        else:
+            self.configuration.path = file_path
+
+    def get_unit_id(self, clear=False):
+        try:
+            unit_id = get_text_input(self.dialog.window, 5, 3, 23,
+                                     str(self.configuration.unit) if not clear else "")
+        except CancelInput:
+            return
+        unit_id = text_input_to_int(unit_id)
+        if unit_id is not None:
+            if not 0 <= unit_id <= 255:
+                unit_id = None
+        if unit_id is None:
+            self.dialog.window.addstr(3, 23, "Invalid unit ID")
+            self.dialog.window.refresh()
+            curses.napms(1000)
+        else:
+            self.configuration.unit = unit_id
+
+    def action(self):
+        save_register_map_config(self.configuration)
+        try:
+            points = load_register_map(self.configuration.path)
+        except RegisterMapError as e:
+            self.add_status_text(str(e), failed=True)
+            return None
+        return self.run_in_background(self.modbus_handler.read_register_map, self.modbus_config, points,
+                                      self.configuration.unit, os.path.basename(self.configuration.path))
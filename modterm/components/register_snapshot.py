@@ -0,0 +1,101 @@
+"""
+ModTerm - Modbus analyser for the terminal
+
+Copyright (C) 2023  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import copy
+import time
+from array import array
+from collections.abc import Sequence
+from typing import Iterable, Iterator, Optional, Union
+from modterm.components.definitions import COIL, DISCRETE
+from modterm.components.packed_bits import PackedBits
+
+
+class RegisterSnapshot(Sequence):
+    # The result of one read: registers in a uint16 array, or coils and discrete inputs packed eight to a byte,
+    # with a bitmap marking the items actually read. Items that could not be read are returned as None.
+    # Slices with a step of 1 are views sharing the buffers of the snapshot they were taken from.
+    def __init__(self, command: str, start: int, length: int, started: Optional[float] = None):
+        self.command = command
+        self.start = start
+        self.length = length
+        self.offset = 0
+        self.started = time.time() if started is None else started
+        self.finished: Optional[float] = None
+        if self.is_bits:
+            self.bits = PackedBits(length)
+            self.words = None
+            self.valid = self.bits.valid
+        else:
+            self.bits = None
+            self.words = array("H", bytes(2 * length))
+            self.valid = bytearray((length + 7) // 8)
+
+    @property
+    def is_bits(self) -> bool:
+        return self.command in (COIL, DISCRETE)
+
+    def is_valid(self, index: int) -> bool:
+        index += self.offset
+        return bool(self.valid[index >> 3] & (1 << (index & 7)))
+
+    def set_range(self, index: int, values: Iterable[Optional[Union[int, bool]]]):
+        if self.is_bits:
+            self.bits.set_range(self.offset + index, values)
+            return
+        for position, value in enumerate(values, start=self.offset + index):
+            mask = 1 << (position & 7)
+            if value is None:
+                self.valid[position >> 3] &= ~mask
+                self.words[position] = 0
+            else:
+                self.valid[position >> 3] |= mask
+                self.words[position] = value
+
+    def view(self, begin: int, end: int) -> "RegisterSnapshot":
+        begin, end, _ = slice(begin, end).indices(self.length)
+        view = copy.copy(self)
+        view.offset = self.offset + begin
+        view.start = self.start + begin
+        view.length = max(0, end - begin)
+        return view
+
+    def word_buffer(self) -> memoryview:
+        return memoryview(self.words)[self.offset:self.offset + self.length]
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            if index.step in (None, 1):
+                return self.view(index.start, index.stop)
+            return [self[i] for i in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("register index out of range")
+        if self.is_bits:
+            return self.bits[self.offset + index]
+        if not self.is_valid(index):
+            return None
+        return self.words[self.offset + index]
+
+    def __iter__(self) -> Iterator[Optional[Union[int, bool]]]:
+        for index in range(self.length):
+            yield self[index]
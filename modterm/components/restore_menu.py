@@ -0,0 +1,127 @@
+"""
+ModTerm - Modbus analyser for the terminal
+
+Copyright (C) 2023  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import curses
+from typing import Dict
+from modterm.components.hepers import get_text_input, CancelInput, text_input_to_int
+from modterm.components.config_handler import load_restore_config, save_restore_config
+from modterm.components.modbus_handler import ModbusHandler, HistoryItem
+from modterm.components.scrollable_list import SelectWindow
+from modterm.components.definitions import HOLDING, ModbusConfig
+from modterm.components.menu_base import MenuBase
+
+
+class RestoreMenu(MenuBase):
+    def __init__(self, screen, normal_text, highlighted_text, modbus_config, history: Dict[str, HistoryItem]):
+        super().__init__(screen,
+                         normal_text,
+                         highlighted_text,
+                         menu_labels={2: "F2 - Result: ",
+                                      3: "F3 - Modbus unit ID: ",
+                                      4: "F4 - Dry run: ",
+                                      5: "Restore, ESC to interrupt the process "},
+                         config_values={2: "snapshot",
+                                        3: "unit",
+                                        4: "dry_run",
+                                        5: ""},
+                         interfaces={2: self.select_snapshot,
+                                     3: self.get_unit_id,
+                                     4: self.swap_dry_run},
+                         menu_name="Restore holding registers")
+
+        self.modbus_handler = ModbusHandler(self.add_status_text)
+        self.modbus_config = modbus_config
+        # Only the reads of holding registers can be written back
+        self.history = {title: item for title, item in history.items()
+                        if item.snapshot is not None and item.snapshot.command == HOLDING}
+        self.configuration = load_restore_config()
+        if self.configuration.snapshot not in self.history:
+            self.configuration.snapshot = ""
+            if len(self.history) != 0:
+                self.set_snapshot(next(iter(self.history)))
+        self.help_text_rows.extend(["",
+                                    "Reads the registers of an earlier result from the device, and writes",
+                                    "back the ones that differ, in as few requests as they allow. Every",
+                                    "request is read back to verify it. A dry run only lists the requests",
+                                    "it would send, with the time they are estimated to take on the bus.",
+                                    "The registers are written to the device the result was read from,",
+                                    "whatever the connection settings are now."])
+
+    def target_config(self) -> ModbusConfig:
+        # The device the snapshot was read from, not the one the header is set to now
+        if (item := self.history.get(self.configuration.snapshot)) is not None and item.modbus_config is not None:
+            return item.modbus_config
+        return self.modbus_config
+
+    def set_snapshot(self, title: str):
+        self.configuration.snapshot = title
+        if (read_config := self.history[title].modbus_handler.last_read_config) is not None:
+            self.configuration.unit = read_config.unit
+
+    def select_snapshot(self, clear=False):
+        if len(self.history) == 0:
+            return
+        selector = SelectWindow(self.screen, min(len(self.history), 10) + 2, self.dialog.width - 16,
+                                self.dialog.window.getbegyx()[0] + 3, self.dialog.window.getbegyx()[1] + 14,
+                                self.normal_text, self.highlighted_text, list(self.history.keys()))
+        if (selection := selector.get_selection()) is not None:
+            self.set_snapshot(selection)
+
+    def get_unit_id(self, clear=False):
+        try:
+            unit_id = get_text_input(self.dialog.window, 5, 3, 23,
+                                     str(self.configuration.unit) if not clear else "")
+        except CancelInput:
+            return
+        unit_id = text_input_to_int(unit_id)
+        if unit_id is not None:
+            if not 0 < unit_id <= 255:
+                unit_id = None
+        if unit_id is None:
+            self.dialog.window.addstr(3, 23, "Invalid unit ID")
+            self.dialog.window.refresh()
+            curses.napms(1000)
+        else:
+            self.configuration.unit = unit_id
+
+    def swap_dry_run(self, clear=False):
+        self.configuration.dry_run = not self.configuration.dry_run
+
+    def draw(self, no_highlight=False):
+        # Titles of results are longer than the dialog is wide
+        title = self.configuration.snapshot
+        if self.dialog.width - 18 < len(title):
+            self.configuration.snapshot = title[:self.dialog.width - 21] + "..."
+        try:
+            super().draw(no_highlight)
+        finally:
+            self.configuration.snapshot = title
+        target = f"Target: {ModbusHandler.describe_source(self.target_config(), self.configuration.unit)}"
+        self.dialog.window.addstr(max(self.menu_labels.keys()) + 1, 2, target[:self.dialog.width - 4],
+                                  self.normal_text)
+        self.dialog.window.refresh()
+
+    def action(self):
+        save_restore_config(self.configuration)
+        if self.configuration.snapshot not in self.history:
+            self.add_status_text("Read some holding registers to restore first", failed=True)
+            return None
+        return self.run_in_background(self.modbus_handler.restore_snapshot, self.target_config(),
+                                      self.history[self.configuration.snapshot].snapshot, self.configuration.unit,
+                                      self.configuration.dry_run)
@@ -23,8 +23,10 @@ from modterm.components.definitions import TableContents
 
 
 class ScrollableList:
-    def __init__(self, height, width, y, x, normal_text, highlighted_text, empty_list_message="No data to display", added_border=False):
+    def __init__(self, height, width, y, x, normal_text, highlighted_text, empty_list_message="No data to display", added_border=False,
+                 marked_text=curses.A_BOLD):
         self.normal_text = normal_text
+        self.marked_text = marked_text
         self.added_border = added_border
         self.highlighted_text = highlighted_text
         self.empty_list_message = empty_list_message
@@ -51,45 +53,84 @@ class ScrollableList:
             108: self.page_down
         }
         self.bar_position = None
+        # Indices of the rows to draw with marked_text, like the registers changed by the last poll
+        self.marked_rows = set()
+        self.full_redraw = True
+        self.shown = None
+        self.drawn_title = None
+        self.drawn_lines = {}
 
     def draw(self, table_data: TableContents = None):
-        if self.added_border:
-            self.underlay_window.clear()
-            self.underlay_window.refresh()
-        self.window.erase()
-        self.window.border(0)
-        self.window.box()
+        # Only the lines that differ from what is already on the window are written. The whole window is only
+        # repainted when the header has changed, or the window itself (see touch).
         if table_data is not None and len(table_data.title):
             self.title = table_data.title
-        if self.title != "":
-            to_draw = self.title
-            if len(self.title) > self.width - 6:
-                to_draw = to_draw[:self.width - 6]
-            self.window.addstr(0, (self.window.getmaxyx()[1] - len(to_draw)) // 2, f" {to_draw} ")
         if table_data is not None and table_data.header is not None and self.header != table_data.header:
             self.header = table_data.header
+        if table_data is not None and table_data.rows is not None and self.data_rows != table_data.rows:
+            self.data_rows = table_data.rows
+            self.page = 1
+            self.position = 1
+            self.marked_rows = set()
         if self.header is None:
             height = self.height
             start_row = 0
         else:
             height = self.height - 1
             start_row = 1
-        if table_data is not None and table_data.rows is not None and self.data_rows != table_data.rows:
-            self.data_rows = table_data.rows
-            self.page = 1
-            self.position = 1
+
+        shown = (self.header, len(self.data_rows) == 0)
+        if self.full_redraw or self.shown is None or any(a is not b for a, b in zip(shown, self.shown)):
+            self.draw_frame()
+            self.shown = shown
+        if self.title != self.drawn_title:
+            self.draw_title()
+
         if len(self.data_rows) == 0:
-            self.window.addstr(1, 1, self.empty_list_message)
             self.bar_position = None
-            self.window.refresh()
+            self.refresh()
             return
 
-        columns = 0
-        if self.header is not None:
+        first = height * (self.page - 1)
+        for line in range(1, height + 1):
+            i = first + line
+            if i <= len(self.data_rows):
+                if type(self.data_rows[i-1]) is list:
+                    string = " ".join(x for x in self.data_rows[i-1])
+                else:
+                    string = str(self.data_rows[i-1])
+                if len(string) > self.width - 4:
+                    string = string[:self.width - 4]
+                if i == self.position:
+                    attribute = self.highlighted_text
+                    self.bar_position = line + start_row
+                elif i - 1 in self.marked_rows:
+                    attribute = self.marked_text
+                else:
+                    attribute = self.normal_text
+            else:
+                string, attribute = "", self.normal_text
+            if self.drawn_lines.get(line) != (string, attribute):
+                self.window.addstr(line + start_row, 2, " " * (self.width - 4), self.normal_text)
+                self.window.addstr(line + start_row, 2, string, attribute)
+                self.drawn_lines[line] = (string, attribute)
+        self.refresh()
+
+    def draw_frame(self):
+        if self.added_border:
+            self.underlay_window.erase()
+            self.underlay_window.noutrefresh()
+        self.window.erase()
+        self.window.border(0)
+        self.drawn_title = None
+        self.drawn_lines = {}
+        self.full_redraw = False
+        if len(self.data_rows) == 0:
+            self.window.addstr(1, 1, self.empty_list_message)
+        elif self.header is not None:
             header_string = ""
             for idx, item in enumerate(self.header):
                 if len(header_string) + len(item) < self.width - 2:
-                    columns = idx
                     header_string += item + " "
                 else:
                     break
@@ -97,21 +138,23 @@ class ScrollableList:
                 header_string = header_string[:self.width - 4]
             self.window.addstr(1, 2, header_string, self.normal_text)
 
-        for i in range(1 + (height * (self.page - 1)), min(height + 1 + (height * (self.page - 1)), len(self.data_rows) + 1)):
-            if type(self.data_rows[i-1]) is list:
-                string = " ".join(x for x in self.data_rows[i-1])
-            else:
-                string = str(self.data_rows[i-1])
-            if len(string) > self.width - 4:
-                string = string[:self.width - 4]
-            if (i + (height * (self.page - 1)) == self.position + (height * (self.page - 1))):
-                self.window.addstr(i - (height * (self.page - 1)) + start_row, 2, string, self.highlighted_text)
-                self.bar_position = i - (height * (self.page - 1)) + start_row
-            else:
-                self.window.addstr(i - (height * (self.page - 1)) + start_row, 2, string, self.normal_text)
-            if i == height:
-                break
-        self.window.refresh()
+    def draw_title(self):
+        self.window.hline(0, 1, curses.ACS_HLINE, self.width - 2)
+        if self.title != "":
+            to_draw = self.title
+            if len(self.title) > self.width - 6:
+                to_draw = to_draw[:self.width - 6]
+            self.window.addstr(0, (self.window.getmaxyx()[1] - len(to_draw)) // 2, f" {to_draw} ")
+        self.drawn_title = self.title
+
+    def touch(self):
+        # Something else has been drawn over the window, the next draw repaints all of it
+        self.full_redraw = True
+
+    def refresh(self):
+        # Only marks the window for the next curses.doupdate(), which is left to the caller so that everything
+        # drawn for one keystroke reaches the terminal in one update
+        self.window.noutrefresh()
 
     def step_down(self):
         if self.header is None:
@@ -163,6 +206,27 @@ class ScrollableList:
         else:
             self.position = len(self.data_rows)
 
+    def show_row(self, index):
+        # Moves the cursor onto the row with the given index, on the page holding it
+        height = self.height if self.header is None else self.height - 1
+        if not 0 <= index < len(self.data_rows):
+            return
+        self.page = index // height + 1
+        self.position = index + 1
+
+    def find_row(self, column, value):
+        # Binary search for the row with the value in the given column, the column has to be in ascending order
+        low, high = 0, len(self.data_rows)
+        while low < high:
+            middle = (low + high) // 2
+            if int(self.data_rows[middle][column]) < value:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.data_rows) and int(self.data_rows[low][column]) == value:
+            return low
+        return None
+
     def get_current_row_data(self):
         try:
             return self.data_rows[self.position - 1]
@@ -171,18 +235,17 @@ class ScrollableList:
 
     def get_next_4_row_raw_data(self):
         to_return = []
-        rows = self.data_rows[self.position-1:]
-        if 4 < len(rows):
-            rows = rows[:4]
+        rows = self.data_rows[self.position-1:self.position + 3]
         for row in rows:
             to_return.append(int(row[4]))
         return to_return
 
-    def check_navigate(self, keystroke):
+    def check_navigate(self, keystroke) -> bool:
         try:
             self.keymap[keystroke]()
         except KeyError:
-            pass
+            return False
+        return True
 
 
 class SelectWindow:
@@ -195,6 +258,7 @@ class SelectWindow:
 
     def get_selection(self):
         self.scrollable_list.draw(TableContents(None, self.options, title=self.title))
+        curses.doupdate()
         x = self.screen.getch()
         while x != 27:
             if x == curses.KEY_DOWN:
@@ -208,5 +272,6 @@ class SelectWindow:
             if x == ord("\n"):
                 return self.scrollable_list.get_current_row_data()
             self.scrollable_list.draw()
+            curses.doupdate()
             x = self.screen.getch()
         return None
@@ -0,0 +1,85 @@
+"""
+ModTerm - Modbus analyser for the terminal
+
+Copyright (C) 2023  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import curses
+from modterm.components.hepers import get_text_input, CancelInput, text_input_to_float
+from modterm.components.config_handler import load_search_config, save_search_config
+from modterm.components.menu_base import MenuBase
+
+
+class SearchMenu(MenuBase):
+    def __init__(self, screen, normal_text, highlighted_text, modbus_handler):
+        super().__init__(screen,
+                         normal_text,
+                         highlighted_text,
+                         menu_labels={2: "F2 - Value: ",
+                                      3: "F3 - Tolerance: ",
+                                      4: "Search! "},
+                         config_values={2: "value",
+                                        3: "tolerance",
+                                        4: ""},
+                         interfaces={2: self.get_value,
+                                     3: self.get_tolerance},
+                         menu_name="Search values")
+
+        self.configuration = load_search_config()
+        self.modbus_handler = modbus_handler
+        self.help_text_rows.extend(["",
+                                    "Finds the registers holding the value as any of U16, I16, U32, I32 or F32,",
+                                    "in any byte and word order. With a tolerance, every value within",
+                                    "value - tolerance and value + tolerance is a match."])
+
+    def get_value(self, clear=False):
+        try:
+            value = get_text_input(self.dialog.window, 20, 2, 14, str(self.configuration.value) if not clear else "")
+        except CancelInput:
+            return
+        value = text_input_to_float(value)
+        if value is None:
+            self.dialog.window.addstr(2, 13, "Invalid value")
+            self.dialog.window.refresh()
+            curses.napms(1000)
+            return
+        self.configuration.value = value
+
+    def get_tolerance(self, clear=False):
+        try:
+            tolerance = get_text_input(self.dialog.window, 20, 3, 18,
+                                       str(self.configuration.tolerance) if not clear else "")
+        except CancelInput:
+            return
+        tolerance = text_input_to_float(tolerance)
+        if tolerance is None or tolerance < 0:
+            self.dialog.window.addstr(3, 17, "Invalid tolerance")
+            self.dialog.window.refresh()
+            curses.napms(1000)
+            return
+        self.configuration.tolerance = tolerance
+
+    def action(self):
+        save_search_config(self.configuration)
+        # The handler belongs to a result in the history, it only reports to the dialog while searching
+        status_text_callback = self.modbus_handler.status_text_callback
+        self.modbus_handler.status_text_callback = self.add_status_text
+        try:
+            return self.run_in_background(self.modbus_handler.search_values,
+                                          self.configuration.value - self.configuration.tolerance,
+                                          self.configuration.value + self.configuration.tolerance)
+        finally:
+            self.modbus_handler.status_text_callback = status_text_callback
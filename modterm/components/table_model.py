@@ -0,0 +1,67 @@
+"""
+ModTerm - Modbus analyser for the terminal
+
+Copyright (C) 2023  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import threading
+from collections import OrderedDict
+from collections.abc import Sequence
+from typing import List, Iterator
+
+PAGE_SIZE = 256
+CACHED_PAGES = 16
+
+
+class LazyRows(Sequence):
+    # Table rows formatted on demand, a page at a time, by format_rows(begin, end). Only the most recently
+    # used pages are kept, so a table costs the same to show and scroll whatever the number of rows is.
+    def __init__(self, length: int, format_rows: callable, page_size: int = PAGE_SIZE,
+                 cached_pages: int = CACHED_PAGES):
+        self.length = length
+        self.format_rows = format_rows
+        self.page_size = page_size
+        self.cached_pages = cached_pages
+        self.pages: OrderedDict[int, List[List[str]]] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get_page(self, page: int) -> List[List[str]]:
+        with self.lock:
+            if (rows := self.pages.get(page)) is not None:
+                self.pages.move_to_end(page)
+                return rows
+        rows = self.format_rows(page * self.page_size, min(self.length, (page + 1) * self.page_size))
+        with self.lock:
+            self.pages[page] = rows
+            while self.cached_pages < len(self.pages):
+                self.pages.popitem(last=False)
+        return rows
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.length))]
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("row index out of range")
+        return self.get_page(index // self.page_size)[index % self.page_size]
+
+    def __iter__(self) -> Iterator[List[str]]:
+        for page in range((self.length + self.page_size - 1) // self.page_size):
+            yield from self.get_page(page)
@@ -0,0 +1,102 @@
+"""
+ModTerm - Modbus analyser for the terminal
+
+Copyright (C) 2023  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import curses
+from modterm.components.hepers import get_text_input, CancelInput, text_input_to_float
+from modterm.components.config_handler import load_track_config, save_track_config
+from modterm.components.scrollable_list import SelectWindow
+from modterm.components.definitions import TRACK_CONDITIONS
+from modterm.components.menu_base import MenuBase
+
+
+class TrackMenu(MenuBase):
+    def __init__(self, screen, normal_text, highlighted_text, modbus_config, modbus_handler):
+        super().__init__(screen,
+                         normal_text,
+                         highlighted_text,
+                         menu_labels={2: "F2 - Condition: ",
+                                      3: "F3 - Value: ",
+                                      4: "F4 - Tolerance: ",
+                                      5: "Read and narrow down! "},
+                         config_values={2: "condition",
+                                        3: "value",
+                                        4: "tolerance",
+                                        5: ""},
+                         interfaces={2: self.get_condition,
+                                     3: self.get_value,
+                                     4: self.get_tolerance},
+                         menu_name="Track values")
+
+        self.configuration = load_track_config()
+        self.modbus_config = modbus_config
+        self.modbus_handler = modbus_handler
+        self.help_text_rows.extend(["",
+                                    "Reads the registers of the table again and keeps the candidates, decoded",
+                                    "as any type in any byte and word order, whose value meets the condition",
+                                    "since the previous read. New search starts over with every register.",
+                                    "Value and tolerance are only used by the Equal to value condition."])
+
+    def get_condition(self, clear=False):
+        width = len(max(TRACK_CONDITIONS, key=len)) + 4
+        selector = SelectWindow(self.screen, len(TRACK_CONDITIONS) + 2, width, self.dialog.window.getbegyx()[0] + 3,
+                                self.dialog.window.getbegyx()[1] + 18, self.normal_text, self.highlighted_text,
+                                TRACK_CONDITIONS)
+        if (selection := selector.get_selection()) is not None:
+            self.configuration.condition = selection
+
+    def get_value(self, clear=False):
+        try:
+            value = get_text_input(self.dialog.window, 20, 3, 14, str(self.configuration.value) if not clear else "")
+        except CancelInput:
+            return
+        value = text_input_to_float(value)
+        if value is None:
+            self.dialog.window.addstr(3, 13, "Invalid value")
+            self.dialog.window.refresh()
+            curses.napms(1000)
+            return
+        self.configuration.value = value
+
+    def get_tolerance(self, clear=False):
+        try:
+            tolerance = get_text_input(self.dialog.window, 20, 4, 18,
+                                       str(self.configuration.tolerance) if not clear else "")
+        except CancelInput:
+            return
+        tolerance = text_input_to_float(tolerance)
+        if tolerance is None or tolerance < 0:
+            self.dialog.window.addstr(4, 17, "Invalid tolerance")
+            self.dialog.window.refresh()
+            curses.napms(1000)
+            return
+        self.configuration.tolerance = tolerance
+
+    def action(self):
+        save_track_config(self.configuration)
+        # The handler belongs to a result in the history, it only reports to the dialog while tracking
+        status_text_callback = self.modbus_handler.status_text_callback
+        self.modbus_handler.status_text_callback = self.add_status_text
+        try:
+            return self.run_in_background(self.modbus_handler.track_values,
+                                          self.modbus_config,
+                                          self.configuration.condition,
+                                          self.configuration.value - self.configuration.tolerance,
+                                          self.configuration.value + self.configuration.tolerance)
+        finally:
+            self.modbus_handler.status_text_callback = status_text_callback
@@ -165,4 +165,4 @@ class UnitSweepMenu(MenuBase):
 
     def action(self):
         save_unit_sweep_config(self.configuration)
-        return self.modbus_handler.unit_sweep(self.screen, self.modbus_config, self.configuration)
+        return self.run_in_background(self.modbus_handler.unit_sweep, self.modbus_config, self.configuration)
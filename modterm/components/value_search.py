@@ -0,0 +1,137 @@
+"""
+ModTerm - Modbus analyser for the terminal
+
+Copyright (C) 2023  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+from modterm.components.definitions import BigEndian, LittleEndian
+from modterm.components.register_snapshot import RegisterSnapshot
+from modterm.components import vectorized_decode
+from modterm.components.decoders import decode_values
+
+SEARCH_TYPES = ["U16", "I16", "U32", "I32", "F32"]
+ORDERS = [(BigEndian, BigEndian), (BigEndian, LittleEndian), (LittleEndian, BigEndian), (LittleEndian, LittleEndian)]
+# Word order makes no difference to 16 bit values
+COLUMNS = [(value_type, byte_order, None) for value_type in SEARCH_TYPES[:2] for byte_order in (BigEndian, LittleEndian)] + \
+          [(value_type, byte_order, word_order) for value_type in SEARCH_TYPES[2:] for byte_order, word_order in ORDERS]
+MAX_MATCHES = 5000
+
+
+@dataclass
+class SearchMatch:
+    index: int
+    address: int
+    value_type: str
+    byte_order: str
+    word_order: Optional[str]
+    value: float
+
+    @property
+    def label(self) -> str:
+        value = f"{self.value:g}" if self.value_type == "F32" else str(int(self.value))
+        order = f"bytes: {self.byte_order}"
+        if self.word_order is not None:
+            order += f", words: {self.word_order}"
+        return f"{self.address: >6} {self.value_type} {value: >12}  {order}"
+
+
+def float32(value: float) -> float:
+    # The value closest to the given one a register pair can hold
+    try:
+        return struct.unpack("f", struct.pack("f", value))[0]
+    except OverflowError:
+        return value
+
+
+def decode_column(snapshot: RegisterSnapshot, value_type: str, byte_order: str,
+                  word_order: Optional[str]) -> Tuple:
+    # The value of every register (16 bit types) or register pair (32 bit types) of the snapshot, indexed by its
+    # first register. With NumPy, these are a float64 array and a validity mask, otherwise a list with None for
+    # the values that could not be read. NaN floats are not valid values.
+    np = vectorized_decode.load_numpy()
+    if np is not None:
+        registers, valid = vectorized_decode.snapshot_arrays(snapshot, 0, len(snapshot))
+        words = vectorized_decode.swap_bytes(registers) if byte_order == LittleEndian else registers
+        if value_type in ("U16", "I16"):
+            values = words.astype(np.uint16).view(np.int16) if value_type == "I16" else words
+        else:
+            high, low = (words[1:], words[:-1]) if word_order == LittleEndian else (words[:-1], words[1:])
+            values = (high << 16) | low
+            valid = valid[:-1] & valid[1:]
+            if value_type == "I32":
+                values = values.view(np.int32)
+            elif value_type == "F32":
+                with np.errstate(invalid="ignore"):
+                    values = values.view(np.float32).astype(np.float64)
+                valid = valid & ~np.isnan(values)
+        return values.astype(np.float64), valid
+
+    values = decode_values(list(snapshot), value_type, byte_order, word_order or BigEndian)
+    if value_type == "F32":
+        values = [None if value is None or value != value else value for value in values]
+    return values, None
+
+
+class ValueIndex:
+    # Every value of a register snapshot, decoded as each 16 and 32 bit type in every byte and word order, kept
+    # sorted along with the index of its first register, so a search is two binary searches per column.
+    # Columns are decoded the first time they are searched and kept for as long as the snapshot is shown.
+    def __init__(self, snapshot: RegisterSnapshot):
+        self.snapshot = snapshot
+        self.columns: Dict[Tuple[str, str, Optional[str]], Tuple] = {}
+
+    def column(self, value_type: str, byte_order: str, word_order: Optional[str]) -> Tuple:
+        np = vectorized_decode.load_numpy()
+        key = (value_type, byte_order, word_order)
+        if key not in self.columns:
+            values, valid = decode_column(self.snapshot, *key)
+            if np is not None:
+                indices = np.flatnonzero(valid)
+                order = np.argsort(values[indices], kind="stable")
+                self.columns[key] = values[indices][order], indices[order]
+            else:
+                pairs = sorted((value, idx) for idx, value in enumerate(values) if value is not None)
+                self.columns[key] = array("d", (value for value, _ in pairs)), array("l", (idx for _, idx in pairs))
+        return self.columns[key]
+
+    def search(self, low: float, high: float, limit: int = MAX_MATCHES) -> Tuple[List[SearchMatch], int]:
+        # Returns the matches with the lowest addresses, up to the limit, and the total number of matches
+        np = vectorized_decode.load_numpy()
+        found = []
+        total = 0
+        for value_type, byte_order, word_order in COLUMNS:
+            first, last = (float32(low), float32(high)) if value_type == "F32" else (low, high)
+            values, indices = self.column(value_type, byte_order, word_order)
+            if np is not None:
+                begin = int(np.searchsorted(values, first, "left"))
+                end = int(np.searchsorted(values, last, "right"))
+            else:
+                begin, end = bisect_left(values, first), bisect_right(values, last)
+            total += end - begin
+            hits = sorted(zip(indices[begin:end].tolist(), values[begin:end].tolist()))[:limit]
+            found.extend((idx, value_type, byte_order, word_order, value) for idx, value in hits)
+        found.sort(key=lambda hit: (hit[0], SEARCH_TYPES.index(hit[1])))
+        return [SearchMatch(index=idx,
+                            address=self.snapshot.start + idx,
+                            value_type=value_type,
+                            byte_order=byte_order,
+                            word_order=word_order,
+                            value=value) for idx, value_type, byte_order, word_order, value in found[:limit]], total
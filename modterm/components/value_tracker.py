@@ -0,0 +1,142 @@
+"""
+ModTerm - Modbus analyser for the terminal
+
+Copyright (C) 2023  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import heapq
+from array import array
+from itertools import repeat
+from typing import Dict, List, Optional, Tuple
+from modterm.components.definitions import TableContents, CHANGED, UNCHANGED, INCREASED, DECREASED
+from modterm.components.register_snapshot import RegisterSnapshot
+from modterm.components.table_model import LazyRows
+from modterm.components.value_search import COLUMNS, decode_column, float32
+from modterm.components import vectorized_decode
+
+TRACK_HEADER_ROW = ["{: >4}".format("Idx"), "{: >6}".format("Addr"), "{: >5}".format("HAdr"),
+                    "{: >4}".format("Type"), "{: >13}".format("Byte order"), "{: >13}".format("Word order"),
+                    "{: >14}".format("Previous"), "{: >14}".format("Value")]
+
+
+def compare(condition: str, previous, current, low: float, high: float):
+    # Works the same on single values and on NumPy arrays of them
+    if condition == CHANGED:
+        return current != previous
+    if condition == UNCHANGED:
+        return current == previous
+    if condition == INCREASED:
+        return current > previous
+    if condition == DECREASED:
+        return current < previous
+    return (low <= current) & (current <= high)
+
+
+class ValueTracker:
+    # Registers of a range that may hold a quantity, narrowed down by what happened to it between successive
+    # reads of the range. Every decoding and byte and word order is tracked separately: each column keeps the
+    # indices of its candidate registers and their values in the last read, as arrays.
+    def __init__(self, snapshot: RegisterSnapshot):
+        np = vectorized_decode.load_numpy()
+        self.command = snapshot.command
+        self.start = snapshot.start
+        self.length = len(snapshot)
+        self.reads = 1
+        self.candidates: Dict[Tuple[str, str, Optional[str]], Tuple] = {}
+        self.previous: Dict[Tuple[str, str, Optional[str]], Tuple] = {}
+        for column in COLUMNS:
+            values, valid = decode_column(snapshot, *column)
+            if np is not None:
+                indices = np.flatnonzero(valid)
+                self.candidates[column] = indices, values[indices]
+            else:
+                indices = array("l", (idx for idx, value in enumerate(values) if value is not None))
+                self.candidates[column] = indices, array("d", (values[idx] for idx in indices))
+            self.previous[column] = self.candidates[column][1]
+
+    def same_range(self, snapshot: RegisterSnapshot) -> bool:
+        return (snapshot.command, snapshot.start, len(snapshot)) == (self.command, self.start, self.length)
+
+    def narrow(self, snapshot: RegisterSnapshot, condition: str, low: float = 0, high: float = 0):
+        # Keeps the candidates whose value in the snapshot meets the condition, compared to the previous read
+        np = vectorized_decode.load_numpy()
+        for column, (indices, last_values) in self.candidates.items():
+            first, last = (float32(low), float32(high)) if column[0] == "F32" else (low, high)
+            values, valid = decode_column(snapshot, *column)
+            if np is not None:
+                current = values[indices]
+                keep = valid[indices] & compare(condition, last_values, current, first, last)
+                self.candidates[column] = indices[keep], current[keep]
+                self.previous[column] = last_values[keep]
+                continue
+            kept_indices, kept_values, kept_previous = array("l"), array("d"), array("d")
+            for idx, last_value in zip(indices, last_values):
+                if (value := values[idx]) is not None and compare(condition, last_value, value, first, last):
+                    kept_indices.append(idx)
+                    kept_values.append(value)
+                    kept_previous.append(last_value)
+            self.candidates[column] = kept_indices, kept_values
+            self.previous[column] = kept_previous
+        self.reads += 1
+
+    def __len__(self) -> int:
+        return sum(len(indices) for indices, _ in self.candidates.values())
+
+    def get_table(self, title: str) -> TableContents:
+        # Candidates of all the columns in register order, formatted a page at a time
+        np = vectorized_decode.load_numpy()
+        columns = list(self.candidates.keys())
+        if np is not None:
+            indices = np.concatenate([self.candidates[column][0] for column in columns])
+            kinds = np.concatenate([np.full(len(self.candidates[column][0]), number)
+                                    for number, column in enumerate(columns)])
+            order = np.lexsort((kinds, indices))
+            indices, kinds = indices[order], kinds[order]
+            values = np.concatenate([self.candidates[column][1] for column in columns])[order]
+            previous = np.concatenate([self.previous[column] for column in columns])[order]
+        else:
+            # The indices of every column are in ascending order already
+            indices, kinds, values, previous = array("l"), array("b"), array("d"), array("d")
+            for idx, number, last_value, value in heapq.merge(*(
+                    zip(self.candidates[column][0], repeat(number), self.previous[column], self.candidates[column][1])
+                    for number, column in enumerate(columns))):
+                indices.append(idx)
+                kinds.append(number)
+                previous.append(last_value)
+                values.append(value)
+
+        def format_rows(begin: int, end: int) -> List[List[str]]:
+            formatted = []
+            for idx, number, last_value, value in zip(indices[begin:end].tolist(), kinds[begin:end].tolist(),
+                                                      previous[begin:end].tolist(), values[begin:end].tolist()):
+                value_type, byte_order, word_order = columns[number]
+                formatted.append(["{: >4}".format(idx),
+                                  "{: >6}".format(self.start + idx),
+                                  "{: >5X}".format(self.start + idx),
+                                  "{: >4}".format(value_type),
+                                  "{: >13}".format(byte_order),
+                                  "{: >13}".format(word_order if word_order is not None else "-"),
+                                  self.format_value(value_type, last_value),
+                                  self.format_value(value_type, value)])
+            return formatted
+
+        return TableContents(header=TRACK_HEADER_ROW, rows=LazyRows(len(indices), format_rows), title=title)
+
+    @staticmethod
+    def format_value(value_type: str, value: float) -> str:
+        if value_type == "F32":
+            return "{: >14}".format(f"{value:0.5g}")
+        return "{: >14}".format(int(value))
@@ -0,0 +1,150 @@
+"""
+ModTerm - Modbus analyser for the terminal
+
+Copyright (C) 2023  Máté Szabó
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+from typing import List, Optional, Sequence, Tuple
+from modterm.components.definitions import LittleEndian
+from modterm.components.register_snapshot import RegisterSnapshot
+
+# Below this many rows the per register decoder is just as fast
+MIN_ROWS = 32
+
+# NumPy takes longer to import than the rest of ModTerm, it is only loaded once something is to be decoded
+np = None
+DIGITS = None
+numpy_checked = False
+
+
+def load_numpy():
+    # The numpy module, None if it is not installed
+    global np, DIGITS, numpy_checked
+    if not numpy_checked:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        if numpy is not None:
+            DIGITS = numpy.frombuffer(b"0123456789ABCDEF", dtype=numpy.uint8)
+        np = numpy
+        numpy_checked = True
+    return np
+
+
+def is_available() -> bool:
+    return load_numpy() is not None
+
+
+def swap_bytes(words):
+    return (words >> 8) | ((words & 0xff) << 8)
+
+
+def text_column(chars, width: int):
+    # Turns an (n, width) array of ASCII codes into an array of strings
+    return np.ascontiguousarray(chars, dtype=np.uint8).view(f"S{width}").ravel().astype(f"U{width}")
+
+
+def int_column(values, width: int, base: int = 10):
+    # Right aligned decimal or upper case hexadecimal text, same as "{: >{width}}" and "{: >{width}X}"
+    values = values.astype(np.int64)
+    negative = values < 0
+    magnitude = np.abs(values)
+    digits = np.ones(len(values), dtype=np.int64)
+    remaining = magnitude // base
+    while remaining.any():
+        digits += remaining > 0
+        remaining //= base
+    total = max(width, int((digits + negative).max(initial=0)))
+    chars = np.full((len(values), total), ord(" "), dtype=np.uint8)
+    rows = np.arange(len(values))
+    for position in range(int(digits.max(initial=0))):
+        in_number = position < digits
+        chars[rows[in_number], total - 1 - position] = DIGITS[(magnitude[in_number] // base ** position) % base]
+    chars[rows[negative], total - 1 - digits[negative]] = ord("-")
+    text = text_column(chars, total)
+    if width < total:
+        # Only the values not fitting the width overflow it
+        text = np.char.rjust(np.char.lstrip(text), width)
+    return text
+
+
+def snapshot_arrays(data: Sequence[Optional[int]], begin: int, end: int) -> Tuple:
+    # Register values and validity of a range, straight from the buffers of a snapshot
+    if isinstance(data, RegisterSnapshot):
+        registers = np.frombuffer(data.word_buffer()[begin:end], dtype=np.uint16).astype(np.uint32)
+        first_bit = data.offset + begin
+        bitmap = np.frombuffer(data.valid, dtype=np.uint8)[first_bit >> 3:(data.offset + end + 7) >> 3]
+        valid = np.unpackbits(bitmap, bitorder="little")[first_bit & 7:(first_bit & 7) + end - begin].astype(bool)
+        return registers, valid
+    window = data[begin:end]
+    valid = np.fromiter((register is not None for register in window), dtype=bool, count=len(window))
+    registers = np.fromiter((register or 0 for register in window), dtype=np.uint32, count=len(window))
+    return registers, valid
+
+
+def word_rows(data: Sequence[Optional[int]], byte_order: str, word_order: str, start_reg: int, begin: int,
+              end: int) -> List[List[str]]:
+    # Same columns as ModbusHandler.word_rows, every column is decoded and formatted for the whole range at once.
+    # The register following the range is needed for the 32 bit values of the last row.
+    count = end - begin
+    registers, valid = snapshot_arrays(data, begin, min(end + 1, len(data)))
+    valid = np.append(valid, np.zeros(count + 1 - len(valid), dtype=bool))
+    registers = np.append(registers, np.zeros(count + 1 - len(registers), dtype=np.uint32))
+    is_word = valid[:count]
+    is_dword = is_word & valid[1:]
+
+    words = swap_bytes(registers) if byte_order == LittleEndian else registers
+    high, low = (words[1:], words[:-1]) if word_order == LittleEndian else (words[:-1], words[1:])
+    u16 = words[:count]
+    u32 = (high << 16) | low
+    i16 = u16.astype(np.uint16).view(np.int16)
+    i32 = u32.view(np.int32)
+    with np.errstate(invalid="ignore"):
+        f32 = u32.view(np.float32).astype(np.float64)
+
+    idx = np.arange(begin, end)
+    columns = [int_column(idx, 4),
+               int_column(idx + start_reg, 6),
+               int_column(idx + start_reg, 5, base=16)]
+
+    f32_text = np.char.mod("%0.3f", f32)
+    too_long = np.char.str_len(f32_text) > 11
+    if too_long.any():
+        f32_text[too_long] = np.char.mod("%0.5e", f32[too_long])
+    f32_text = np.char.rjust(f32_text, 12)
+
+    value_columns = [(int_column(registers[:count], 5, base=16), 5, is_word),
+                     (int_column(u16, 6), 6, is_word),
+                     (int_column(i16, 7), 7, is_word),
+                     (int_column(u32, 11), 11, is_dword),
+                     (int_column(i32, 12), 12, is_dword),
+                     (f32_text, 12, is_dword)]
+
+    first, second = registers[:count] >> 8, registers[:count] & 0xff
+    if byte_order == LittleEndian:
+        first, second = second, first
+    characters = np.stack([first, second], axis=1)
+    characters[(characters < 32) | (126 < characters)] = ord("-")
+    value_columns.append((text_column(characters, 2), 2, is_word))
+
+    bits = np.unpackbits(u16.astype(">u2").view(np.uint8).reshape(-1, 2), axis=1) + ord("0")
+    bits = np.insert(bits, [4, 8, 12], ord(" "), axis=1)
+    value_columns.append((text_column(bits, 19), 19, is_word))
+
+    for text, padding, mask in value_columns:
+        columns.append(np.where(mask, text, "--".rjust(padding)))
+    return [list(row) for row in zip(*(column.tolist() for column in columns))]
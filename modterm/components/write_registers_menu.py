@@ -37,20 +37,23 @@ class WriteRegistersMenu(MenuBase):
                                       5: "F5 - Format: ",
                                       6: "F6 - Multicast enable: ",
                                       7: "F7 - Value: ",
-                                      8: "Write! "},
+                                      8: "F8 - Read back: ",
+                                      9: "Write! "},
                          config_values={2: "command",
                                         3: "address",
                                         4: "unit",
                                         5: "format",
                                         6: "multicast",
                                         7: "value",
-                                        8: ""},
+                                        8: "verify",
+                                        9: ""},
                          interfaces={2: self.switch_command,
                                      3: self.get_register,
                                      4: self.get_unit_id,
                                      5: self.get_format,
                                      6: self.swap_multicast,
-                                     7: self.get_value},
+                                     7: self.get_value,
+                                     8: self.swap_verify},
                          menu_name="Write registers")
 
         self.configuration = load_write_config()
@@ -128,6 +131,9 @@ class WriteRegistersMenu(MenuBase):
         else:
             self.configuration.multicast = True
 
+    def swap_verify(self, clear=False):
+        self.configuration.verify = not self.configuration.verify
+
     def get_value(self, clear=False):
         try:
             value = get_text_input(self.dialog.window, 15, 7, 14,
@@ -147,4 +153,4 @@ class WriteRegistersMenu(MenuBase):
 
     def action(self):
         save_write_config(self.configuration)
-        return self.modbus_handler.write_registers(self.modbus_config, self.configuration, formats)
+        return self.run_in_background(self.modbus_handler.write_registers, self.modbus_config, self.configuration, formats)